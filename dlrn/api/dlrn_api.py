@@ -28,6 +28,7 @@ from dlrn.api.inputs.metrics import MetricsInput
 from dlrn.api.inputs.promotions import PromoteInput
 from dlrn.api.inputs.promotions import PromotionsInput
 from dlrn.api.inputs.recheck_package import RecheckPackageInput
+from dlrn.api.inputs.remote_import import RemoteImportBatchInput
 from dlrn.api.inputs.remote_import import RemoteImportInput
 from dlrn.api.inputs.repo_status import RepoStatusInput
 from dlrn.api.inputs.report_result import ReportResultInput
@@ -49,6 +50,7 @@ from dlrn.db import getSession
 from dlrn.db import Promotion
 from dlrn.purge import FLAG_PURGED
 from dlrn.remote import import_commit
+from dlrn.remote import import_commits
 from dlrn.utils import aggregate_repo_files
 from dlrn.utils import import_object
 
@@ -159,6 +161,23 @@ def _rollback_batch_promotion(rollback_list):
                 pass    # yes, ignore errors
 
 
+def _aggregate_rollback_items(promote_name, datadir, reponame):
+    # The top-level files of an aggregate are symlinks to a hashed directory,
+    # record them so a failed batch promotion can restore them too
+    items = []
+    base_promote_dir = os.path.join(datadir, "repos", promote_name)
+    for filename in ["%s.repo" % reponame, "%s.repo.md5" % reponame,
+                     "versions.csv"]:
+        target_link = os.path.join(base_promote_dir, filename)
+        if os.path.islink(target_link):
+            items.append({'target_link': target_link,
+                          'previous_link': os.readlink(target_link)})
+        elif not os.path.lexists(target_link):
+            items.append({'target_link': target_link,
+                          'previous_link': None})
+    return items
+
+
 def _get_logger():
     return logging.getLogger("dlrn")
 
@@ -772,8 +791,13 @@ def promote_batch():
         promote_batch = parse_obj_as(List[PromoteInput], request.json)
     except ValidationError as e:
         raise InvalidUsage(str(e), status_code=400)
+    if not promote_batch:
+        raise InvalidUsage('Empty promotion batch', status_code=400)
     # Now we will be running all checks for each combination
     # Check for invalid promote names
+    # The promotions are grouped by promote_name, keeping the order of the
+    # request, so each aggregate is only computed once
+    groups = {}
     for promote in promote_batch:
         commit_hash = promote.commit_hash
         distro_hash = promote.distro_hash
@@ -809,108 +833,128 @@ def promote_batch():
         if not os.path.samefile(target_dir, base_directory):
             raise InvalidUsage('Invalid promote_name %s' % promote_name,
                                status_code=403)
+        groups.setdefault(promote_name, []).append((promote, commit))
 
     # After all checks have been performed, do all promotions
     log_messages = []
     rollback_list = []
-    for promote in promote_batch:
-        rollback_item = {}
-        commit_hash = promote.commit_hash
-        distro_hash = promote.distro_hash
-        extended_hash = promote.extended_hash
-        promote_name = promote.promote_name
-        commit = _get_commit(session, commit_hash, distro_hash, extended_hash)
-        # We should create a relative symlink
-        yumrepodir = commit.getshardedcommitdir()
-        if config_options.use_components:
-            base_directory = os.path.join(app.config['REPO_PATH'],
-                                          "component/%s" %
-                                          commit.component)
-            # In this case, the relative path should not include
-            # the component part
-            yumrepodir = yumrepodir.replace("component/%s/" % commit.component,
-                                            '')
-        else:
-            base_directory = app.config['REPO_PATH']
-
-        target_link = os.path.join(base_directory, promote_name)
-        rollback_item['target_link'] = target_link
-        rollback_item['previous_link'] = None
-        # Remove symlink if it exists, so we can create it again
-        if os.path.lexists(os.path.abspath(target_link)):
-            rollback_item['previous_link'] = os.readlink(
-                os.path.abspath(target_link))
-            os.remove(target_link)
-
-        rollback_list.append(rollback_item)
-        # This is the only destructive operation. If something fails here,
-        # we will try to roll everything back
-        try:
-            os.symlink(yumrepodir, target_link)
-        except Exception as e:
-            _rollback_batch_promotion(rollback_list)
-            raise InvalidUsage("Symlink creation failed with error: %s. "
-                               "All previously created symlinks have been "
-                               "rolled back." %
-                               e, status_code=500)
-
-        timestamp = time.mktime(datetime.now().timetuple())
-        promotion = Promotion(commit_id=commit.id,
-                              promotion_name=promote_name,
-                              timestamp=timestamp,
-                              user=auth_multi.current_user(),
-                              component=commit.component,
-                              aggregate_hash=None)
-        session.add(promotion)
-        log_messages.append("Added new promotion in batch \
-                            promotion named {promote_name} to \
-                            commit with hash {commit_hash}, distro_hash \
-                            {distro_hash}, extended_hash {extended_hash} \
-                            and aggregate_hash {aggregate_hash} \
-                            for component {component} by user {name}"
-                            .format(promote_name=promote_name,
-                                    commit_hash=commit_hash,
-                                    distro_hash=distro_hash,
-                                    extended_hash=extended_hash,
-                                    aggregate_hash=None,
-                                    component=commit.component,
-                                    name=auth_multi.current_user()))
+    promotions = {}
+    timestamp = time.mktime(datetime.now().timetuple())
+    for promote_name, group in groups.items():
+        promotions[promote_name] = []
+        for promote, commit in group:
+            rollback_item = {}
+            # We should create a relative symlink
+            yumrepodir = commit.getshardedcommitdir()
+            if config_options.use_components:
+                base_directory = os.path.join(app.config['REPO_PATH'],
+                                              "component/%s" %
+                                              commit.component)
+                # In this case, the relative path should not include
+                # the component part
+                yumrepodir = yumrepodir.replace(
+                    "component/%s/" % commit.component, '')
+            else:
+                base_directory = app.config['REPO_PATH']
+
+            target_link = os.path.join(base_directory, promote_name)
+            rollback_item['target_link'] = target_link
+            rollback_item['previous_link'] = None
+            # Remove symlink if it exists, so we can create it again
+            if os.path.lexists(os.path.abspath(target_link)):
+                rollback_item['previous_link'] = os.readlink(
+                    os.path.abspath(target_link))
+                os.remove(target_link)
+
+            rollback_list.append(rollback_item)
+            # This is the only destructive operation. If something fails
+            # here, we will try to roll everything back
+            try:
+                os.symlink(yumrepodir, target_link)
+            except Exception as e:
+                _rollback_batch_promotion(rollback_list)
+                raise InvalidUsage("Symlink creation failed with error: %s. "
+                                   "All previously created symlinks have "
+                                   "been rolled back." %
+                                   e, status_code=500)
+
+            promotion = Promotion(commit_id=commit.id,
+                                  promotion_name=promote_name,
+                                  timestamp=timestamp,
+                                  user=auth_multi.current_user(),
+                                  component=commit.component,
+                                  aggregate_hash=None)
+            session.add(promotion)
+            promotions[promote_name].append(promotion)
 
     # And finally, if we are using components, update the top-level
-    # repo file
-    repo_checksum = None
+    # repo file of each promote_name, once all its symlinks are updated
+    checksums = {}
     if config_options.use_components:
         datadir = os.path.realpath(config_options.datadir)
         pkginfo_driver = config_options.pkginfo_driver
         pkginfo = import_object(pkginfo_driver, cfg_options=config_options)
         packages = pkginfo.getpackages(tags=config_options.tags)
-        repo_checksum = aggregate_repo_files(promote_name, datadir, session,
-                                             config_options.reponame, packages,
-                                             hashed_dir=True)
-        promotion.aggregate_hash = repo_checksum
-        session.add(promotion)
-        log_messages.append("Promoted batch finished with aggregate_hash \
-                            {aggregate_hash} by user {name}"
-                            .format(aggregate_hash=repo_checksum,
-                                    name=auth_multi.current_user()))
-
-    # Close session and return the last promotion we did (which includes the
-    # repo checksum)
+        for promote_name in groups:
+            rollback_list.extend(_aggregate_rollback_items(
+                promote_name, datadir, config_options.reponame))
+            try:
+                checksums[promote_name] = aggregate_repo_files(
+                    promote_name, datadir, session, config_options.reponame,
+                    packages, hashed_dir=True)
+            except Exception as e:
+                session.rollback()
+                _rollback_batch_promotion(rollback_list)
+                raise InvalidUsage("Repo aggregation failed with error: %s. "
+                                   "All previously created symlinks have "
+                                   "been rolled back." %
+                                   e, status_code=500)
+            for promotion in promotions[promote_name]:
+                promotion.aggregate_hash = checksums[promote_name]
+
+    for promote_name, group in groups.items():
+        for promote, commit in group:
+            log_messages.append("Added new promotion in batch \
+                                promotion named {promote_name} to \
+                                commit with hash {commit_hash}, distro_hash \
+                                {distro_hash}, extended_hash {extended_hash} \
+                                and aggregate_hash {aggregate_hash} \
+                                for component {component} by user {name}"
+                                .format(promote_name=promote_name,
+                                        commit_hash=promote.commit_hash,
+                                        distro_hash=promote.distro_hash,
+                                        extended_hash=promote.extended_hash,
+                                        aggregate_hash=checksums.get(
+                                            promote_name),
+                                        component=commit.component,
+                                        name=auth_multi.current_user()))
+        if promote_name in checksums:
+            log_messages.append("Promoted batch for {promote_name} finished \
+                                with aggregate_hash {aggregate_hash} by \
+                                user {name}"
+                                .format(promote_name=promote_name,
+                                        aggregate_hash=checksums[
+                                            promote_name],
+                                        name=auth_multi.current_user()))
+
+    # All promotions are committed in a single transaction. Return the last
+    # promotion of the request (which includes the repo checksum)
     session.commit()
     for log_message in log_messages:
         logger.info(log_message)
+    promote, commit = groups[promote_batch[-1].promote_name][-1]
     repo_hash = _repo_hash(commit)
     repo_url = "%s/%s" % (config_options.baseurl, commit.getshardedcommitdir())
-    result = {'commit_hash': commit_hash,
-              'distro_hash': distro_hash,
+    result = {'commit_hash': promote.commit_hash,
+              'distro_hash': promote.distro_hash,
               'extended_hash': commit.extended_hash,
               'repo_hash': repo_hash,
               'repo_url': repo_url,
-              'promote_name': promote_name,
+              'promote_name': promote.promote_name,
               'component': commit.component,
               'timestamp': timestamp,
               'user': auth_multi.current_user(),
-              'aggregate_hash': repo_checksum}
+              'aggregate_hash': checksums.get(promote.promote_name)}
     return jsonify(result), 201
 
 
@@ -936,6 +980,28 @@ def remote_import():
     return jsonify(result), 201
 
 
+@app.route('/api/remote/import/batch', methods=['POST'])
+@auth_multi.login_required(optional=False, role=can_write_roles)
+@_json_media_type
+def remote_import_batch():
+    logger = _get_logger()
+    parsed_input = parse_input(logger=logger, obj=RemoteImportBatchInput,
+                               default_return=InvalidUsageWrapper)
+    if isinstance(parsed_input, InvalidUsageWrapper):
+        raise parsed_input
+
+    repo_urls = parsed_input.repo_urls
+    try:
+        import_commits(repo_urls, app.config['CONFIG_FILE'],
+                       db_connection=app.config['DB_PATH'])
+    except Exception as e:
+        raise InvalidUsage("Remote import failed with error: %s" %
+                           e, status_code=500)
+
+    result = {'repo_urls': repo_urls}
+    return jsonify(result), 201
+
+
 @app.template_filter()
 def strftime(date, fmt="%Y-%m-%d %H:%M:%S"):
     gmdate = time.gmtime(date)
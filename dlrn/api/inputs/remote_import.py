@@ -12,6 +12,7 @@
 
 from pydantic import AnyHttpUrl
 from pydantic import BaseModel
+from pydantic import conlist
 
 
 class RemoteImportInput(BaseModel):
@@ -23,3 +24,13 @@ class RemoteImportInput(BaseModel):
                          $builder/$repo/$component/cd/88/cd88...
     """
     repo_url: AnyHttpUrl
+
+
+class RemoteImportBatchInput(BaseModel):
+    """Input class that validates request's arguments for remote_import_batch
+
+    :param list repo_urls: List of other DLRN instance repos with hash
+                           to import from by using HTTP or HTTPS
+                           protocols, as in RemoteImportInput
+    """
+    repo_urls: conlist(AnyHttpUrl, min_items=1)
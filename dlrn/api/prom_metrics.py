@@ -15,11 +15,16 @@ from dlrn.config import ConfigOptions
 from dlrn.db import closeSession
 from dlrn.db import Commit
 from dlrn.db import getSession
+from dlrn.rsync import get_stats
+from dlrn.utils import get_known_error_stats
+from dlrn.utils import get_phase_stats
+from dlrn.utils import PHASE_BUCKETS
 
 from flask import g
 from flask import Response
 
 from prometheus_client.core import CounterMetricFamily
+from prometheus_client.core import HistogramMetricFamily
 from prometheus_client.core import REGISTRY
 from prometheus_client import generate_latest
 from prometheus_client import Summary
@@ -44,6 +49,14 @@ def _get_config_options(config_file):
     return ConfigOptions(cp)
 
 
+def _histogram_buckets(phase_stats):
+    # Return the cumulative bucket counts of a build phase
+    buckets = [(str(bound), count) for bound, count in
+               zip(PHASE_BUCKETS, phase_stats['buckets'])]
+    buckets.append(('+Inf', phase_stats['count']))
+    return buckets
+
+
 class DLRNPromCollector(object):
     @REQUEST_TIME.time()
     def collect(self):
@@ -61,6 +74,10 @@ class DLRNPromCollector(object):
                                         'Total number of builds',
                                         labels=['baseurl'])
 
+        h_phases = HistogramMetricFamily('dlrn_build_phase_seconds',
+                                         'Time spent on each build phase',
+                                         labels=['baseurl', 'phase'])
+
         # Find the commits count for each metric
         with app.app_context():
             session = _get_db()
@@ -77,7 +94,40 @@ class DLRNPromCollector(object):
             c_retry.add_metric([config_options.baseurl], retried_commits)
             c_overall.add_metric([config_options.baseurl], all_commits)
 
-        return [c_success, c_failed, c_retry, c_overall]
+        phase_stats = get_phase_stats(config_options.datadir)
+        for phase in sorted(phase_stats):
+            h_phases.add_metric([config_options.baseurl, phase],
+                                _histogram_buckets(phase_stats[phase]),
+                                phase_stats[phase]['sum'])
+
+        rsync_stats = get_stats(config_options)
+        c_rsync = CounterMetricFamily('dlrn_rsync_transfers',
+                                      'Total number of rsync transfers',
+                                      labels=['baseurl'])
+        c_rsync.add_metric([config_options.baseurl],
+                           rsync_stats['transfers'])
+        c_rsync_time = CounterMetricFamily('dlrn_rsync_seconds',
+                                           'Time spent on rsync transfers',
+                                           labels=['baseurl'])
+        c_rsync_time.add_metric([config_options.baseurl],
+                                rsync_stats['seconds'])
+        c_rsync_bytes = CounterMetricFamily('dlrn_rsync_bytes_sent',
+                                            'Bytes sent by rsync transfers',
+                                            labels=['baseurl'])
+        c_rsync_bytes.add_metric([config_options.baseurl],
+                                 rsync_stats['bytes_sent'])
+
+        c_known_errors = CounterMetricFamily('dlrn_known_errors',
+                                             'Total number of failed builds '
+                                             'matching each known error',
+                                             labels=['baseurl', 'pattern'])
+        known_errors = get_known_error_stats(config_options.datadir)
+        for pattern in sorted(known_errors):
+            c_known_errors.add_metric([config_options.baseurl, pattern],
+                                      known_errors[pattern])
+
+        return [c_success, c_failed, c_retry, c_overall, h_phases, c_rsync,
+                c_rsync_time, c_rsync_bytes, c_known_errors]
 
 
 REGISTRY.register(DLRNPromCollector())
@@ -10,7 +10,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import filecmp
+import io
 import logging
 import multiprocessing
 import os
@@ -20,8 +20,11 @@ import shutil
 from datetime import datetime
 
 from dlrn.config import setup_logging
+from dlrn.drivers.pkginfo import getpackage
 from dlrn.utils import fetch_remote_file
+from dlrn.utils import file_signature
 from dlrn.utils import import_object
+from dlrn.utils import timed_phase
 from time import time
 
 logger = logging.getLogger("dlrn-build")
@@ -62,9 +65,9 @@ def build_worker(packages, commit, run_cmd=False, build_env=None,
 
 
 def get_version_from(packages, project_name):
-    for package in packages:
-        if package['name'] == project_name:
-            return package.get('version-from')
+    package = getpackage(packages, project_name)
+    if package is not None:
+        return package.get('version-from')
     return None
 
 
@@ -133,6 +136,64 @@ def build_rpm(packages, commit, env_vars, dev_mode, use_public,
     return built_rpms, notes
 
 
+# Contents of the remote .repo files included in the mock configuration,
+# kept per worker process: url -> (fetch time, lines)
+_repo_file_cache = {}
+# Last mock configuration generated per worker process:
+# path -> (inputs, contents)
+_mock_config_cache = {}
+
+
+def _fetch_repo_file(url, config_options):
+    ttl = config_options.deps_cache_ttl
+    if ttl <= 0:
+        return fetch_remote_file(url)
+    cached = _repo_file_cache.get(url)
+    if cached is not None and time() - cached[0] < ttl:
+        return cached[1]
+    # Once the TTL expires, only download the file again if the server
+    # reports that it changed
+    contents = fetch_remote_file(
+        url, cache_dir=os.path.realpath(config_options.datadir))
+    _repo_file_cache[url] = (time(), contents)
+    return contents
+
+
+def _replace_last_line(contents, lines, last):
+    # delete the last line which must be """
+    contents = io.StringIO(contents).readlines()[:-1]
+    return ''.join(contents + list(lines) + [last])
+
+
+def _generate_mock_config(templatecfg, current_repo, worker_id,
+                          deps_contents, public_contents):
+    with open(templatecfg, "r") as fp:
+        contents = fp.read()
+
+    if os.path.exists(current_repo):
+        # Read the .repo file
+        with open(current_repo) as fp:
+            current_repo_contents = fp.readlines()
+        contents = _replace_last_line(contents, current_repo_contents,
+                                      "\"\"\"")
+
+    # Set the worker id in the mock configuration, to allow multiple workers
+    # for the same config
+    lines = []
+    for line in io.StringIO(contents).readlines():
+        if line.startswith("config_opts['root']"):
+            line = line[:-2] + "-" + str(worker_id) + "'\n"
+        lines.append(line)
+    contents = ''.join(lines)
+
+    if deps_contents is not None:
+        contents = _replace_last_line(contents, deps_contents, "\n\"\"\"")
+    if public_contents is not None:
+        contents = _replace_last_line(contents, public_contents,
+                                      "\n\"\"\"")
+    return contents
+
+
 def build_rpm_wrapper(commit, dev_mode, use_public, bootstrap, env_vars,
                       sequential, config_options, pkginfo, version_from=None):
     # Get the worker id
@@ -152,9 +213,7 @@ def build_rpm_wrapper(commit, dev_mode, use_public, bootstrap, env_vars,
     datadir = os.path.realpath(config_options.datadir)
     baseurl = config_options.baseurl
     templatecfg = os.path.join(configdir, config_options.target + ".cfg")
-    newcfg = os.path.join(datadir, mock_config + ".new")
     oldcfg = os.path.join(datadir, mock_config)
-    shutil.copyfile(templatecfg, newcfg)
     deps_url = config_options.deps_url.strip()
     if deps_url == '' or not deps_url:
         if not baseurl:
@@ -162,83 +221,58 @@ def build_rpm_wrapper(commit, dev_mode, use_public, bootstrap, env_vars,
         # Default to baseurl + delorean_deps.repo
         deps_url = os.path.join(baseurl,  'delorean-deps.repo')
 
-    if (config_options.build_driver ==
-            'dlrn.drivers.kojidriver.KojiBuildDriver' and
-            config_options.fetch_mock_config):
+    koji_mock_config = (config_options.build_driver ==
+                        'dlrn.drivers.kojidriver.KojiBuildDriver' and
+                        config_options.fetch_mock_config)
+    if koji_mock_config:
         buildrpm.write_mock_config(oldcfg)
 
     # Add the most current repo, we may have dependencies in it
     current_repo = os.path.join(datadir, "repos", "current",
                                 "%s.repo" % config_options.reponame)
-    if os.path.exists(current_repo):
-        # Read the .repo file
-        with open(current_repo) as fp:
-            current_repo_contents = fp.readlines()
-        with open(newcfg, "r") as fp:
-            contents = fp.readlines()
-        # delete the last line which must be """
-        contents = contents[:-1]
-        contents = contents + current_repo_contents + ["\"\"\""]
-        with open(newcfg, "w") as fp:
-            fp.writelines(contents)
-
-    # Set the worker id in the mock configuration, to allow multiple workers
-    # for the same config
-    with open(newcfg, "r") as fp:
-        contents = fp.readlines()
-    with open(newcfg, "w") as fp:
-        for line in contents:
-            if line.startswith("config_opts['root']"):
-                line = line[:-2] + "-" + str(worker_id) + "'\n"
-            fp.write(line)
-
-    # delete the last line which must be """
-    with open(newcfg, "r") as fp:
-        contents = fp.readlines()
-    contents = contents[:-1]
 
     try:
-        contents.extend(fetch_remote_file(deps_url))
-        contents.extend(["\n\"\"\""])
-        with open(newcfg, "w") as fp:
-            fp.writelines(contents)
+        deps_contents = _fetch_repo_file(deps_url, config_options)
     except Exception:
+        deps_contents = None
         logger.warning(
             "Could not open %s. If some dependent repositories must be "
             "included in the mock configuration, then check the baseurl "
             " and deps_url values in projects.ini, and make sure the file "
             "can be accesed." % deps_url)
 
+    public_contents = None
     if dev_mode or use_public:
-        with open(newcfg, "r") as fp:
-            contents = fp.readlines()
-
-        # delete the last line which must be """
-        contents = contents[:-1]
         try:
-            contents.extend(
-                fetch_remote_file(baseurl + "/current/delorean.repo"))
-            contents.extend(["\n\"\"\""])
-            with open(newcfg, "w") as fp:
-                fp.writelines(contents)
+            public_contents = _fetch_repo_file(
+                baseurl + "/current/delorean.repo", config_options)
         except Exception as e:
             logger.error("Could not open %s/current/delorean.repo. Check the "
                          "baseurl value in projects.ini, and make sure the "
                          "file can be downloaded." % baseurl)
             raise e
 
-    # don't change dlrn.cfg if the content hasn't changed to prevent
+    # Only regenerate the mock configuration when one of its inputs changed,
+    # and don't change dlrn.cfg if the content hasn't changed to prevent
     # mock from rebuilding its cache.
-    try:
-        if not filecmp.cmp(newcfg, oldcfg):
-            if (config_options.build_driver ==
-                    'dlrn.drivers.kojidriver.KojiBuildDriver'):
-                if not config_options.fetch_mock_config:
-                    shutil.copyfile(newcfg, oldcfg)
-            else:
-                shutil.copyfile(newcfg, oldcfg)
-    except OSError:
-        shutil.copyfile(newcfg, oldcfg)
+    inputs = (file_signature(templatecfg), file_signature(current_repo),
+              worker_id, deps_contents, public_contents)
+    cached = _mock_config_cache.get(oldcfg)
+    if (cached is None or cached[0] != inputs or
+            not os.path.exists(oldcfg)):
+        contents = _generate_mock_config(templatecfg, current_repo,
+                                         worker_id, deps_contents,
+                                         public_contents)
+        try:
+            with open(oldcfg, "r") as fp:
+                changed = fp.read() != contents
+        except (IOError, OSError):
+            changed = True
+        if changed and (not koji_mock_config or
+                        not os.path.exists(oldcfg)):
+            with open(oldcfg, "w") as fp:
+                fp.write(contents)
+        _mock_config_cache[oldcfg] = (inputs, contents)
 
     # Set env variable for Copr configuration
     if (config_options.build_driver ==
@@ -260,14 +294,24 @@ def build_rpm_wrapper(commit, dev_mode, use_public, bootstrap, env_vars,
     # Set env variable for mock configuration
     os.environ['MOCK_CONFIG'] = mock_config
 
+    # Let build_srpm.sh initialize the chroot only once, the package build
+    # reuses it
+    if (config_options.build_driver ==
+            'dlrn.drivers.mockdriver.MockBuildDriver' and
+            config_options.warm_chroot):
+        os.environ['DLRN_WARM_CHROOT'] = '1'
+    elif 'DLRN_WARM_CHROOT' in os.environ:
+        del os.environ['DLRN_WARM_CHROOT']
+
     # if bootstraping, set the appropriate mock config option
     if bootstrap is True:
         additional_mock_options = '-D repo_bootstrap 1'
     else:
         additional_mock_options = None
 
-    pkginfo.preprocess(package_name=commit.project_name,
-                       commit_hash=commit.commit_hash)
+    with timed_phase(commit, 'preprocess'):
+        pkginfo.preprocess(package_name=commit.project_name,
+                           commit_hash=commit.commit_hash)
 
     if (config_options.pkginfo_driver ==
             'dlrn.drivers.gitrepo.GitRepoDriver' and
@@ -290,20 +334,22 @@ def build_rpm_wrapper(commit, dev_mode, use_public, bootstrap, env_vars,
     # right commit is there
     os.environ['DLRN_SOURCE_COMMIT'] = commit.commit_hash
 
-    run(os.path.join(scriptsdir, "build_srpm.sh"), commit, env_vars,
-        dev_mode, use_public, bootstrap, version_from=version_from,
-        config_options=config_options)
+    with timed_phase(commit, 'srpm'):
+        run(os.path.join(scriptsdir, "build_srpm.sh"), commit, env_vars,
+            dev_mode, use_public, bootstrap, version_from=version_from,
+            config_options=config_options)
 
     # SRPM is built, now build the RPM using the driver
     datadir = os.path.realpath(config_options.datadir)
     yumrepodir = _get_yumrepodir(commit)
     yumrepodir_abs = os.path.join(datadir, yumrepodir)
 
-    buildrpm.build_package(output_directory=yumrepodir_abs,
-                           additional_mock_opts=additional_mock_options,
-                           package_name=commit.project_name,
-                           commit=commit,
-                           verbose=config_options.verbose_build)
+    with timed_phase(commit, 'build'):
+        buildrpm.build_package(output_directory=yumrepodir_abs,
+                               additional_mock_opts=additional_mock_options,
+                               package_name=commit.project_name,
+                               commit=commit,
+                               verbose=config_options.verbose_build)
 
 
 def run(program, commit, env_vars, dev_mode, use_public, bootstrap,
@@ -0,0 +1,155 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# When a mirror or the dependencies repo is down, every build fails with a
+# known error and is marked as RETRY. After circuit_breaker_threshold
+# consecutive builds marked as RETRY in a run, the circuit breaker stops
+# dispatching new builds, and probes deps_url and baseurl with an
+# exponential backoff. Once they answer, builds resume, and the first one
+# failing again with a known error pauses them again. If the endpoints are
+# still down after circuit_breaker_timeout seconds, the rest of the run is
+# skipped, and the commits will be built in the next run.
+
+import logging
+import os
+import requests
+import threading
+import time
+
+logger = logging.getLogger("dlrn-circuit-breaker")
+
+# Maximum time, in seconds, between two probes
+PROBE_INTERVAL_MAX = 600
+PROBE_TIMEOUT = 30
+
+
+def probe_url(url):
+    # Return True if url is reachable. Any HTTP answer below 500 is fine,
+    # we only want to know if the server is up
+    if url.startswith('file://'):
+        return os.path.exists(url[len('file://'):])
+    if not url.startswith(('http://', 'https://')):
+        return True
+    try:
+        response = requests.head(url, timeout=PROBE_TIMEOUT,
+                                 allow_redirects=True)
+    except requests.exceptions.RequestException as e:
+        logger.info('Probe of %s failed: %s' % (url, e))
+        return False
+    if response.status_code >= 500:
+        logger.info('Probe of %s failed with HTTP status %d' %
+                    (url, response.status_code))
+        return False
+    return True
+
+
+class CircuitBreaker(object):
+    def __init__(self, threshold, endpoints=None, probe_interval=30,
+                 timeout=3600):
+        self.threshold = threshold
+        self.endpoints = endpoints or []
+        self.probe_interval = probe_interval
+        self.timeout = timeout
+        self.failures = 0
+        self.open = False
+        self.stopped = False
+        # Set if the remaining builds were skipped
+        self.skipped = False
+        self._cond = threading.Condition()
+        self._slots = None
+
+    @classmethod
+    def from_config(cls, config_options):
+        endpoints = [url for url in (config_options.deps_url,
+                                     config_options.baseurl) if url]
+        return cls(config_options.circuit_breaker_threshold,
+                   endpoints=endpoints,
+                   probe_interval=config_options.circuit_breaker_interval,
+                   timeout=config_options.circuit_breaker_timeout)
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def record(self, commit):
+        # Update the breaker with the result of a build
+        if not self.enabled:
+            return
+        with self._cond:
+            if commit.status != 'RETRY':
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= self.threshold and not self.open:
+                logger.warning('%d consecutive builds failed with a known '
+                               'error, pausing the builds' % self.failures)
+                self.open = True
+
+    def probe(self):
+        return all(probe_url(url) for url in self.endpoints)
+
+    def wait(self):
+        # Wait until builds can be dispatched. Return False if they should
+        # not be resumed in this run
+        with self._cond:
+            if self.stopped:
+                return False
+            if not self.open:
+                return True
+        interval = self.probe_interval
+        deadline = time.time() + self.timeout
+        while True:
+            with self._cond:
+                self._cond.wait(interval)
+                if self.stopped:
+                    return False
+            if self.probe():
+                with self._cond:
+                    self.open = False
+                    # The next known error will pause the builds again
+                    self.failures = self.threshold - 1
+                logger.info('Endpoints reachable again, resuming the builds')
+                return True
+            if time.time() >= deadline:
+                logger.error('Endpoints still unreachable after %d seconds, '
+                             'skipping the remaining builds' % self.timeout)
+                with self._cond:
+                    self.skipped = True
+                    self.stopped = True
+                return False
+            interval = min(interval * 2, PROBE_INTERVAL_MAX)
+            logger.info('Endpoints unreachable, next probe in %d seconds' %
+                        interval)
+
+    def gate(self, commits, in_flight):
+        # Iterate over commits for multiprocessing.Pool.imap, which reads
+        # its input in a separate thread as fast as it can. Only in_flight
+        # commits are dispatched before done() is called for their results,
+        # and no commit is dispatched while the breaker is open
+        self._slots = threading.Semaphore(in_flight)
+        for commit in commits:
+            self._slots.acquire()
+            if not self.wait():
+                return
+            yield commit
+
+    def done(self):
+        # A build dispatched by gate() has been processed
+        if self._slots is not None:
+            self._slots.release()
+
+    def stop(self):
+        # Stop dispatching builds, and wake up gate()
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+        self.done()
@@ -13,6 +13,7 @@ import logging
 import os
 import re
 
+from dlrn.retry import parse_retry_limits
 from dlrn.utils import import_class
 
 _config_options = None
@@ -45,6 +46,13 @@ DLRN_CORE_CONFIG = {
         'datadir': {'default': _default_datadir()},
         'gerrit': {},
         'maxretries': {'type': 'int', 'default': 3},
+        'known_errors_file': {'default': ''},
+        'retry_limits': {'type': 'list'},
+        'retry_backoff': {'type': 'int', 'default': 0},
+        'retry_backoff_max': {'type': 'int', 'default': 3600},
+        'circuit_breaker_threshold': {'type': 'int', 'default': 0},
+        'circuit_breaker_interval': {'type': 'int', 'default': 30},
+        'circuit_breaker_timeout': {'type': 'int', 'default': 3600},
         'baseurl': {},
         'smtpserver': {},
         'distro': {},
@@ -53,6 +61,14 @@ DLRN_CORE_CONFIG = {
         'reponame': {},
         'rsyncdest': {'default': ''},
         'rsyncport': {'default': 22},
+        'rsync_workers': {'type': 'int', 'default': 0},
+        'remote_download_workers': {'type': 'int', 'default': 4},
+        'rsync_options': {'type': 'list',
+                          'default': ['-avzR', '--delete-delay']},
+        'rsync_skip_compress': {'type': 'list',
+                                'default': ['rpm', 'gz', 'xz', 'zst', 'bz2']},
+        'rsync_whole_file': {'type': 'boolean', 'default': False},
+        'rsync_ssh_multiplex': {'type': 'boolean', 'default': False},
         'scriptsdir': {'default': _default_scriptsdir()},
         'configdir': {},
         'templatedir': {'default': _default_templatedir()},
@@ -74,6 +90,15 @@ DLRN_CORE_CONFIG = {
         'use_components': {'type': 'boolean', 'default': False},
         'verbose_build': {'type': 'boolean', 'default': False},
         'deps_url': {'default': ''},
+        'deps_cache_ttl': {'type': 'int', 'default': 0},
+        'coalesce_policy': {'default': ''},
+        'daemon_poll_interval': {'type': 'int', 'default': 300},
+        'daemon_socket': {'default': ''},
+        'skip_unchanged_repos': {'type': 'boolean', 'default': False},
+        'git_mirror_dir': {'default': ''},
+        'git_clone_filter': {'default': ''},
+        'distgit_clone_depth': {'type': 'int', 'default': 0},
+        'git_backend': {'default': 'sh'},
     }
 }
 
@@ -92,6 +117,12 @@ class ConfigOptions(object):
     def __init__(self, cp, overrides=None):
         self.parse_overrides(cp, overrides)
         self.parse_config(DLRN_CORE_CONFIG, cp)
+        # Fail early on invalid retry limits, rather than when a build fails
+        try:
+            parse_retry_limits(self.retry_limits)
+        except ValueError as e:
+            logging.error(str(e))
+            raise RuntimeError("Invalid config option retry_limits: %s" % e)
         # dynamic directory defaults
         if not self.configdir:
             self.configdir = self.scriptsdir
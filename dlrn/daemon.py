@@ -0,0 +1,127 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Helpers for the dlrn --daemon mode:
+#
+# - PollScheduler keeps track of when each package has to be polled for new
+#   commits, using a per-package interval ('poll-interval' key in the package
+#   information) or a global default.
+#
+# - TriggerServer listens on a local UNIX socket, and accepts package names
+#   (one per line) to be polled as soon as possible, e.g. from a webhook.
+
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+
+logger = logging.getLogger("dlrn-daemon")
+
+
+class PollScheduler(object):
+
+    def __init__(self, default_interval):
+        self.default_interval = default_interval
+        self.next_poll = {}
+        self.triggers = queue.Queue()
+
+    def interval(self, package):
+        try:
+            return int(package.get('poll-interval', self.default_interval))
+        except ValueError:
+            logger.warning("Invalid poll-interval for package %s, using "
+                           "the default value" % package['name'])
+            return self.default_interval
+
+    def trigger(self, name):
+        self.triggers.put(name)
+
+    def due(self, packages, now=None):
+        if now is None:
+            now = time.time()
+        names = set()
+        while True:
+            try:
+                names.add(self.triggers.get_nowait())
+            except queue.Empty:
+                break
+        result = []
+        for package in packages:
+            name = package['name']
+            if name in names or self.next_poll.get(name, 0) <= now:
+                result.append(name)
+        unknown = names.difference(result)
+        if unknown:
+            logger.warning("Ignoring triggers for unknown packages: %s" %
+                           ', '.join(sorted(unknown)))
+        return result
+
+    def polled(self, packages, names, now=None):
+        if now is None:
+            now = time.time()
+        for package in packages:
+            if package['name'] in names:
+                self.next_poll[package['name']] = (now +
+                                                   self.interval(package))
+
+    def wait(self, packages, timeout, now=None):
+        # Wait until the next package is due for polling, a trigger is
+        # received or timeout seconds have passed
+        if now is None:
+            now = time.time()
+        next_poll = min([self.next_poll.get(p['name'], 0) for p in packages] or
+                        [now + timeout])
+        delay = max(0, min(next_poll - now, timeout))
+        try:
+            name = self.triggers.get(timeout=delay)
+        except queue.Empty:
+            return
+        # Put it back, so it is picked up by the next call to due()
+        self.triggers.put(name)
+
+
+class _TriggerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            name = line.decode('utf-8', 'replace').strip()
+            if name:
+                logger.info("Received trigger for package %s" % name)
+                self.server.scheduler.trigger(name)
+                self.wfile.write(b'OK\n')
+
+
+class TriggerServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, scheduler):
+        self.path = path
+        self.scheduler = scheduler
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, _TriggerHandler)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Listening for build triggers on %s" % self.path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
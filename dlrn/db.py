@@ -22,6 +22,7 @@ from sqlalchemy import desc
 from sqlalchemy import event
 from sqlalchemy import exc
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import or_
 from sqlalchemy import String
@@ -38,6 +39,9 @@ Base = sqlalchemy.ext.declarative.declarative_base()
 
 class Commit(Base):
     __tablename__ = "commits"
+    # Used to find the previous builds of a commit, and count its retries
+    __table_args__ = (Index('commits_hashes_idx', 'commit_hash',
+                            'distro_hash'),)
 
     id = Column(Integer, primary_key=True)
     # Type has a default value for safety, this may be dropped in the future
@@ -64,8 +68,8 @@ class Commit(Base):
     extended_hash = Column(String(128), doc="Git hash of the extended commit")
     commit_branch = Column(String(256),
                            doc="Branch for the source commit")
-    status = Column(String(64), doc="Build status, can be SUCCESS, FAILED "
-                                    "or RETRY")
+    status = Column(String(64), doc="Build status, can be SUCCESS, FAILED, "
+                                    "RETRY or SKIPPED")
     component = Column(String(64), doc="Component for the package")
     artifacts = Column(Text, doc="Path to generated artifacts")
     notes = Column(Text, doc="Notes, free-form")
@@ -73,6 +77,12 @@ class Commit(Base):
     versions_csv = Column(String(256),
                           doc="URL of the source versions.csv in downstream "
                               "driver")
+    timings = Column(Text, doc="Duration of each build phase in seconds, "
+                               "as a JSON dictionary")
+    next_retry_at = Column(Integer,
+                           doc="For commits in RETRY state, timestamp before "
+                               "which the build should not be retried, in "
+                               "seconds since the UNIX epoch")
     civotes = relationship("CIVote", back_populates="commit")
     promotions = relationship("Promotion", back_populates="commit")
 
@@ -226,23 +236,34 @@ def closeSession(session):
     session.remove()
 
 
+# Filter out the commits with one of the statuses in not_status, which can
+# be a single status or a list
+def _without_status(not_status):
+    if isinstance(not_status, str):
+        return Commit.status != not_status
+    return Commit.status.notin_(not_status)
+
+
 # Get the most recently processed commit for project_name, we ignore commits
-# with a status of "RETRY" as we want to retry these.
+# with a status of "RETRY" as we want to retry these, and "SKIPPED" as they
+# were never built.
 def getLastProcessedCommit(
-        session, project_name, not_status="RETRY", type='rpm'):
+        session, project_name, not_status=("RETRY", "SKIPPED"), type='rpm'):
     commit = session.query(Commit).filter(Commit.project_name == project_name,
                                           Commit.type == type,
-                                          Commit.status != not_status).\
+                                          _without_status(not_status)).\
         order_by(desc(Commit.id)).first()
     return commit
 
 
 # Get the most recently built commit for project_name and commit_branch, we
-# ignore commits with a status of "RETRY" as we want to retry these.
+# ignore commits with a status of "RETRY" as we want to retry these, and
+# "SKIPPED" as they were never built.
 def getLastBuiltCommit(
-        session, project_name, commit_branch, not_status="RETRY", type='rpm'):
+        session, project_name, commit_branch, not_status=("RETRY", "SKIPPED"),
+        type='rpm'):
     commit = session.query(Commit).filter(Commit.project_name == project_name,
-                                          Commit.status != not_status,
+                                          _without_status(not_status),
                                           Commit.type == type,
                                           Commit.commit_branch ==
                                           commit_branch).\
@@ -0,0 +1,161 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Copy the contents of a DLRN database into another one, for example to
+# move from SQLite to MySQL. The tables are copied one by one, in foreign
+# key order, reading the source with a server-side cursor and inserting the
+# rows in chunks. Primary keys are preserved, so the copy can be resumed
+# after the last row copied to each table.
+
+import argparse
+import logging
+import sqlalchemy
+import sys
+import time
+
+from dlrn.config import setup_logging
+from dlrn.db import Base
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy.pool import NullPool
+from sqlalchemy import select
+
+logger = logging.getLogger("dlrn-db-migrate")
+
+# Number of rows fetched from the source and inserted at a time
+CHUNK_SIZE = 5000
+
+
+def _resume_filter(table, dest_conn):
+    # Return a filter for the source rows not copied to dest yet, and the
+    # number of rows already copied
+    copied = dest_conn.execute(select(func.count()).select_from(
+        table)).scalar()
+    if copied == 0:
+        return None, 0
+    pk = list(table.primary_key.columns)
+    if len(pk) == 1 and isinstance(pk[0].type, Integer):
+        last_id = dest_conn.execute(select(func.max(pk[0]))).scalar()
+        logger.info("Resuming %s after id %s" % (table.name, last_id))
+        return pk[0] > last_id, copied
+    # Other primary keys are only used by small tables, like users, so
+    # skip the rows already copied
+    existing = set(tuple(row) for row in dest_conn.execute(select(*pk)))
+    return existing, copied
+
+
+def _reset_sequence(table, dest_conn):
+    # PostgreSQL does not update the sequences when the ids are inserted
+    pk = list(table.primary_key.columns)
+    if (dest_conn.dialect.name != 'postgresql' or len(pk) != 1 or
+            not isinstance(pk[0].type, Integer)):
+        return
+    dest_conn.execute(sqlalchemy.text(
+        "SELECT setval(pg_get_serial_sequence('%s', '%s'), "
+        "COALESCE(MAX(%s), 1)) FROM %s" % (table.name, pk[0].name,
+                                           pk[0].name, table.name)))
+
+
+def copy_table(table, source_conn, dest_engine, chunk_size=CHUNK_SIZE):
+    with dest_engine.connect() as dest_conn:
+        resume, copied = _resume_filter(table, dest_conn)
+    pk = list(table.primary_key.columns)
+    query = select(table).order_by(*pk)
+    if resume is not None and not isinstance(resume, set):
+        query = query.where(resume)
+
+    start = time.time()
+    rows_copied = 0
+    result = source_conn.execution_options(stream_results=True).execute(
+        query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = [dict(row._mapping) for row in rows]
+        if isinstance(resume, set):
+            chunk = [row for row in chunk
+                     if tuple(row[c.name] for c in pk) not in resume]
+        if chunk:
+            with dest_engine.begin() as dest_conn:
+                dest_conn.execute(table.insert(), chunk)
+        rows_copied += len(chunk)
+        elapsed = time.time() - start
+        logger.info("%s: %d rows copied, %.1f rows/sec" %
+                    (table.name, copied + rows_copied,
+                     rows_copied / elapsed if elapsed else 0))
+    result.close()
+
+    with dest_engine.begin() as dest_conn:
+        _reset_sequence(table, dest_conn)
+    elapsed = time.time() - start
+    logger.info("%s: done, %d rows copied in %.1f seconds (%.1f rows/sec)" %
+                (table.name, rows_copied, elapsed,
+                 rows_copied / elapsed if elapsed else 0))
+    return rows_copied
+
+
+def migrate_db(source_string, dest_string, chunk_size=CHUNK_SIZE,
+               tables=None):
+    source_engine = sqlalchemy.create_engine(source_string,
+                                             poolclass=NullPool)
+    dest_engine = sqlalchemy.create_engine(dest_string, poolclass=NullPool)
+    Base.metadata.create_all(dest_engine)
+
+    total = 0
+    start = time.time()
+    with source_engine.connect() as source_conn:
+        # Tables are sorted by dependency, so users are copied before
+        # commits, and commits before civotes and promotions
+        for table in Base.metadata.sorted_tables:
+            if tables and table.name not in tables:
+                continue
+            total += copy_table(table, source_conn, dest_engine,
+                                chunk_size=chunk_size)
+    elapsed = time.time() - start
+    logger.info("Migration finished, %d rows copied in %.1f seconds "
+                "(%.1f rows/sec)" % (total, elapsed,
+                                     total / elapsed if elapsed else 0))
+    return total
+
+
+def db_migrate():
+    parser = argparse.ArgumentParser()
+    # Some of the non-positional arguments are required, so change the text
+    # saying "optional arguments" to just "arguments":
+    parser._optionals.title = 'arguments'
+
+    parser.add_argument('--source',
+                        help="SQLAlchemy connection string for the source "
+                             "database (required).",
+                        required=True)
+    parser.add_argument('--dest',
+                        help="SQLAlchemy connection string for the "
+                             "destination database (required).",
+                        required=True)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="Number of rows copied at a time. Default: %d"
+                             % CHUNK_SIZE)
+    parser.add_argument('--tables',
+                        help="Only copy these tables (comma-separated "
+                             "list).")
+    parser.add_argument('--debug', action='store_true',
+                        help="Print debug logs")
+
+    options = parser.parse_args(sys.argv[1:])
+
+    setup_logging(options.debug)
+
+    tables = options.tables.split(',') if options.tables else None
+    migrate_db(options.source, options.dest, chunk_size=options.chunk_size,
+               tables=tables)
+    return 0
@@ -12,7 +12,12 @@
 
 
 from dlrn.db import Commit
+from dlrn.drivers.pkginfo import getcachedpackages
+from dlrn.drivers.pkginfo import getpackage
+from dlrn.drivers.pkginfo import info_cache_ttl
+from dlrn.drivers.pkginfo import PackageList
 from dlrn.drivers.pkginfo import PkgInfoDriver
+from dlrn.gitbackend import get_git_backend
 from dlrn.repositories import getdistrobranch
 from dlrn.repositories import getsourcebranch
 from dlrn.repositories import refreshrepo
@@ -60,12 +65,14 @@ class DownstreamInfoDriver(PkgInfoDriver):
             'use_upstream_spec': {'type': 'boolean'},
             'downstream_spec_replace_list': {'type': 'list'},
             'cache_dir': {},
+            'cache_packages': {'type': 'boolean'},
         }
     }
 
     def __init__(self, *args, **kwargs):
         super(DownstreamInfoDriver, self).__init__(*args, **kwargs)
         self.distroinfo_path = None
+        self.versions = None
 
     def getpackages(self, **kwargs):
         """Valid parameters:
@@ -82,6 +89,7 @@ class DownstreamInfoDriver(PkgInfoDriver):
             fail_req_config_missing('info_file')
 
         inforepo = None
+        repo_url = None
         if local_info_repo:
             inforepo = info.DistroInfo(
                 info_files=info_files,
@@ -100,8 +108,10 @@ class DownstreamInfoDriver(PkgInfoDriver):
             inforepo = info.DistroInfo(
                 info_files=info_files,
                 remote_git_info=self.config_options.rdoinfo_repo,
+                cache_ttl=info_cache_ttl(self.config_options),
                 cache_base_path=self.config_options.cache_dir)
             rdoinfo_repo = self.config_options.rdoinfo_repo
+            repo_url = rdoinfo_repo
             self.distroinfo_path = "%s/%s" % (rdoinfo_repo.rstrip('/'),
                                               info_files[0])
             for extra_file in info_files[1:]:
@@ -110,12 +120,8 @@ class DownstreamInfoDriver(PkgInfoDriver):
 
         else:
             fail_req_config_missing('repo')
-        pkginfo = inforepo.get_info(apply_tag=tags)
-
-        self.packages = pkginfo["packages"]
-        if tags:
-            # FIXME allow list of tags?
-            self.packages = query.filter_pkgs(self.packages, {'tags': tags})
+        self.packages = getcachedpackages(inforepo, self.config_options,
+                                          tags, repo_url=repo_url)
 
         if self.config_options.downstream_tag:
             # filter out packages missing parameters with
@@ -124,8 +130,14 @@ class DownstreamInfoDriver(PkgInfoDriver):
             self.packages = query.filter_pkgs(
                 self.packages,
                 {'tags': downstream_tag})
+        self.packages = PackageList(self.packages)
         return self.packages
 
+    def prefetch(self, **kwargs):
+        # Fetch versions.csv once per run. The driver object is passed to the
+        # getinfo workers, so they will all use the same data
+        self.versions = self._getversions()
+
     def _getversions(self):
         """Fetch 'versions.csv'
 
@@ -144,7 +156,8 @@ class DownstreamInfoDriver(PkgInfoDriver):
         vers = {}
 
         for versions_url_file in versions_url_list:
-            content = fetch_remote_file(versions_url_file)
+            content = fetch_remote_file(
+                versions_url_file, cache_dir=self.config_options.cache_dir)
             # first line is headers
             for row in csv.reader(content[1:]):
                 row.append(versions_url_file)
@@ -189,7 +202,9 @@ class DownstreamInfoDriver(PkgInfoDriver):
             fail_req_config_missing('downstream_distro_branch')
         source_branch = getsourcebranch(
             package, default_branch=self.config_options.source)
-        versions = self._getversions()
+        if self.versions is None:
+            self.versions = self._getversions()
+        versions = self.versions
 
         ups_distro = package['master-distgit']
         ups_distro_dir = self._upstream_distgit_clone_dir(package['name'])
@@ -218,7 +233,7 @@ class DownstreamInfoDriver(PkgInfoDriver):
             try:
                 distro_branch, extended_hash_dsdist, dt_extended = refreshrepo(
                     distro, distro_dir, self.config_options, distro_branch,
-                    local=local, full_path=distro_dir_full)
+                    local=local, full_path=distro_dir_full, shallow=True)
 
                 _, extended_hash_dssource, _ = refreshrepo(
                     ds_source, dsgit_dir, self.config_options, dsgit_branch,
@@ -249,7 +264,7 @@ class DownstreamInfoDriver(PkgInfoDriver):
                 # in dev mode, so no try/except
                 refreshrepo(distro, distro_dir, self.config_options,
                             distro_branch, local=local,
-                            full_path=distro_dir_full)
+                            full_path=distro_dir_full, shallow=True)
             if not os.path.isdir(ups_distro_dir):
                 refreshrepo(ups_distro, ups_distro_dir, self.config_options,
                             ups_distro_branch, local=local,
@@ -283,14 +298,10 @@ class DownstreamInfoDriver(PkgInfoDriver):
             else:
                 # When running with --local, we really want to use the local
                 # source git, regardless of the upstream versions.csv info
-                git = sh.git.bake(_cwd=repo_dir, _tty_out=False)
-                lines = git.log("--pretty=format:'%ct %H'",
-                                "-1", "--first-parent",
-                                "--reverse")
-                for line in lines:
-                    # There is only one line
-                    dt, commit_hash = str(line).strip().strip("'").\
-                                        split(" ")[:2]
+                commits = get_git_backend(self.config_options).getcommits(
+                    repo_dir, "-1")
+                # There is only one commit
+                dt, commit_hash = commits[0]
 
             try:
                 dt_commit = float(dt)
@@ -386,12 +397,8 @@ class DownstreamInfoDriver(PkgInfoDriver):
     def distgit_dir(self, package_name):
         datadir = self.config_options.datadir
         # Find extra directory inside it, if needed
-        extra_dir = '/'
-        for package in self.packages:
-            if package['name'] == package_name:
-                if 'distgit-path' in package:
-                    extra_dir = package['distgit-path']
-                    break
+        package = getpackage(self.packages, package_name)
+        extra_dir = (package or {}).get('distgit-path', '/')
         return os.path.join(datadir, package_name + "_distro",
                             extra_dir.lstrip('/'))
 
@@ -406,12 +413,8 @@ class DownstreamInfoDriver(PkgInfoDriver):
     def upstream_distgit_dir(self, package_name):
         datadir = self.config_options.datadir
         # Find extra directory inside it, if needed
-        extra_dir = '/'
-        for package in self.packages:
-            if package['name'] == package_name:
-                if 'distgit-path' in package:
-                    extra_dir = package['distgit-path']
-                    break
+        package = getpackage(self.packages, package_name)
+        extra_dir = (package or {}).get('distgit-path', '/')
         return os.path.join(datadir, package_name + "_distro_upstream",
                             extra_dir.lstrip('/'))
 
@@ -27,7 +27,9 @@ import requests
 import sh
 
 from dlrn.db import Commit
+from dlrn.drivers.pkginfo import PackageList
 from dlrn.drivers.pkginfo import PkgInfoDriver
+from dlrn.gitbackend import get_git_backend
 from dlrn.repositories import getsourcebranch
 from dlrn.repositories import refreshrepo
 from dlrn.utils import run_external_preprocess
@@ -95,7 +97,7 @@ class GitRepoDriver(PkgInfoDriver):
         datadir = self.config_options.datadir
         skip_dirs = self.config_options.skip_dirs
         dev_mode = kwargs.get('dev_mode')
-        packages = []
+        packages = PackageList()
 
         gitpath = os.path.join(datadir, 'package_info')
         if not os.path.exists(gitpath):
@@ -195,9 +197,8 @@ class GitRepoDriver(PkgInfoDriver):
             dt_distro = 0  # Doesn't get used in dev mode
         else:
             # Get distro_hash from last commit in distgit directory
-            git = sh.git.bake(_cwd=distro_dir, _tty_out=False)
-            repoinfo = str(git.log("--pretty=format:%H %ct", "-1", ".")
-                           ).strip().split(" ")
+            repoinfo = get_git_backend(self.config_options).getlastcommit(
+                distro_dir, subdir=True)
             distro_hash = repoinfo[0]
             dt_distro = repoinfo[1]
 
@@ -222,13 +223,11 @@ class GitRepoDriver(PkgInfoDriver):
                 # move on to the next repo
                 return PkgInfoDriver.Info([], True)
 
-            git = sh.git.bake(_cwd=repo_dir, _tty_out=False)
             # Git gives us commits already sorted in the right order
-            lines = git.log("--pretty=format:'%ct %H'", since,
-                            "--first-parent", "--reverse")
+            commits = get_git_backend(self.config_options).getcommits(
+                repo_dir, since)
 
-            for line in lines:
-                dt, commit_hash = str(line).strip().strip("'").split(" ")
+            for dt, commit_hash in commits:
                 commit = Commit(dt_commit=float(dt), project_name=project,
                                 type='rpm',
                                 commit_hash=commit_hash, repo_dir=repo_dir,
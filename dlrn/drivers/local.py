@@ -19,11 +19,12 @@
 
 import logging
 import os
-import sh
 import shutil
 
 from dlrn.db import Commit
+from dlrn.drivers.pkginfo import PackageList
 from dlrn.drivers.pkginfo import PkgInfoDriver
+from dlrn.gitbackend import get_git_backend
 from rdopkg.utils import specfile
 
 logging.basicConfig(level=logging.ERROR)
@@ -63,7 +64,7 @@ class LocalDriver(PkgInfoDriver):
         is_src_dir_distgit = [
             f for f in os.listdir(src_dir) if f.endswith('.spec')]
         if not is_src_dir_distgit:
-            return []
+            return PackageList()
         package, version = self._get_infos_from_pkg(src_dir)
         dest_dir = os.path.join(datadir, package)
         logger.info("Copy distgit source from %s to %s" % (src_dir, dest_dir))
@@ -78,7 +79,7 @@ class LocalDriver(PkgInfoDriver):
         logger.info(
             "Got version %s for %s from the spec" % (version, package))
         pkg_hash['source-branch'] = version
-        return [pkg_hash]
+        return PackageList([pkg_hash])
 
     def getinfo(self, **kwargs):
         project = kwargs.get('project')
@@ -87,9 +88,8 @@ class LocalDriver(PkgInfoDriver):
         distro_dir = os.path.join(datadir, package['name'])
 
         # Get distro_hash from last commit in distgit directory
-        git = sh.git.bake(_cwd=package['master-distgit'], _tty_out=False)
-        repoinfo = str(git.log("--pretty=format:%H %ct", "-1", ".")
-                       ).strip().split(" ")
+        repoinfo = get_git_backend(self.config_options).getlastcommit(
+            package['master-distgit'], subdir=True)
         distro_hash = repoinfo[0]
         dt_distro = repoinfo[1]
 
@@ -31,6 +31,7 @@ class MockBuildDriver(BuildRPMDriver):
     DRIVER_CONFIG = {
         'mockbuild_driver': {
             'install_after_build': {'type': 'boolean', 'default': True},
+            'warm_chroot': {'type': 'boolean', 'default': False},
         },
     }
 
@@ -73,6 +74,10 @@ class MockBuildDriver(BuildRPMDriver):
                                  '--resultdir', output_dir]
                     if additional_mock_opts:
                         mock_opts += [additional_mock_opts]
+                    if self.config_options.warm_chroot:
+                        # build_srpm.sh has just initialized the chroot, and
+                        # built the source RPM in it without cleaning it
+                        mock_opts += ['--no-clean']
                     mock_opts += ['--rebuild', src_rpm]
                     sh.env('/usr/bin/mock', *mock_opts,
                            postinstall=install_after_build,
@@ -12,8 +12,9 @@
 
 # PkgInfoDriver derived classes expose the following functions:
 #
-# getpackages(). This function will return an array of hashes. Each individual
-# hash must contain the following mandatory parameters (others are optional):
+# getpackages(). This function will return an array of hashes, as a
+# PackageList. Each individual hash must contain the following mandatory
+# parameters (others are optional):
 # - 'name' : package name
 # - 'upstream': URL for upstream repo
 # - 'master-distgit': URL for distgit repo
@@ -23,6 +24,10 @@
 #            specific package, and True if the package was skipped due to any
 #            git clone error, False if not.
 #
+# prefetch(). This function will be called once per run, before calling
+#             getinfo() for each package, to fetch any data shared by all
+#             packages.
+#
 # preprocess(). This function will run any required pre-processing for the spec
 #               files.
 #
@@ -30,13 +35,236 @@
 #                given package name.
 
 from collections import namedtuple
+from dlrn.gitbackend import get_git_backend
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+from distroinfo import helpers
+from distroinfo import query
+
+
+logger = logging.getLogger("dlrn-pkginfo")
+
+# Bump this when the format of the cached package lists changes
+PACKAGE_CACHE_VERSION = 2
+
+# Default cache_ttl of the distroinfo info repos
+INFO_CACHE_TTL = 3600
+
+
+class PackageList(list):
+    """A list of package dicts, indexed by package name and project.
+
+    It behaves like a regular list, but lookups by name or project do not
+    need to scan the whole list. The index is updated when the list is
+    modified, but not when the package dicts themselves change their name
+    or project.
+    """
+
+    def __init__(self, packages=()):
+        super(PackageList, self).__init__(packages)
+        self._reindex()
+
+    def _reindex(self):
+        self._byname = {}
+        self._byproject = {}
+        self._position = {}
+        for package in self:
+            self._index(package)
+
+    def _index(self, package):
+        # Keep the first package with a given name, like a linear scan would
+        self._byname.setdefault(package['name'], package)
+        self._byproject.setdefault(package.get('project'), []).append(
+            (len(self._position), package['name']))
+        self._position[package['name']] = len(self._position)
+
+    def get(self, name, default=None):
+        return self._byname.get(name, default)
+
+    def project_names(self, projects):
+        # Return the names of the packages in any of the projects, in the
+        # same order as in the list
+        names = []
+        for project in set(projects):
+            names.extend(self._byproject.get(project, []))
+        return [name for _, name in sorted(names)]
+
+    def append(self, package):
+        super(PackageList, self).append(package)
+        self._index(package)
+
+    def extend(self, packages):
+        super(PackageList, self).extend(packages)
+        self._reindex()
+
+    def __iadd__(self, packages):
+        self.extend(packages)
+        return self
+
+    def insert(self, index, package):
+        super(PackageList, self).insert(index, package)
+        self._reindex()
+
+    def remove(self, package):
+        super(PackageList, self).remove(package)
+        self._reindex()
+
+    def pop(self, *args):
+        package = super(PackageList, self).pop(*args)
+        self._reindex()
+        return package
+
+    def __setitem__(self, index, value):
+        super(PackageList, self).__setitem__(index, value)
+        self._reindex()
+
+    def __delitem__(self, index):
+        super(PackageList, self).__delitem__(index)
+        self._reindex()
+
+
+def getpackage(packages, name):
+    # Return the package dict for name, or None if not found. Use the index
+    # if packages is a PackageList.
+    if isinstance(packages, PackageList):
+        return packages.get(name)
+    for package in packages:
+        if package['name'] == name:
+            return package
+    return None
+
+
+def getprojectnames(packages, projects):
+    # Return the names of the packages belonging to any of projects
+    if isinstance(packages, PackageList):
+        return packages.project_names(projects)
+    return [p['name'] for p in packages if p['project'] in projects]
+
+
+def info_cache_ttl(config_options):
+    # With cache_packages, the package list is cached for the HEAD of the
+    # info repo, so it is fetched every time it is parsed
+    if config_options.cache_packages:
+        return 0
+    return INFO_CACHE_TTL
+
+
+def _remote_git_urls(info):
+    # Return the URLs of the remote git info repos used by a parsed
+    # distroinfo info, or None if one of them is not a git repo
+    urls = set()
+    for remote in (info.get('remote-info') or {}).values():
+        if not remote.get('remote_git_info'):
+            return None
+        urls.add(remote['remote_git_info'])
+    return sorted(urls)
+
+
+def _package_cache_key(config_options, repo_url, remote_urls, tags):
+    # Return a key identifying the package list for the current HEAD of the
+    # info repo and of its remote info repos, or None if one of them cannot
+    # be read
+    git_backend = get_git_backend(config_options)
+    heads = []
+    for url in [repo_url] + remote_urls:
+        try:
+            heads.append([url, git_backend.remotehead(url)])
+        except Exception as e:
+            logger.debug('Could not get the HEAD of %s: %s' % (url, e))
+            return None
+    return hashlib.sha1(json.dumps(
+        [PACKAGE_CACHE_VERSION, heads, tags]).encode('utf-8')).hexdigest()
+
+
+def _write_file(path, content):
+    tmp_file = '%s.%d' % (path, os.getpid())
+    with open(tmp_file, 'wb') as fp:
+        fp.write(content)
+    os.rename(tmp_file, path)
+
+
+def getcachedpackages(inforepo, config_options, tags, repo_url=None):
+    """Return the list of packages in a distroinfo repo, filtered by tags.
+
+    If the cache_packages option is set and repo_url is the git info repo
+    used by inforepo, the parsed package list is cached under the distroinfo
+    cache directory. It is keyed by the HEAD of the info repo and of the
+    remote info repos found when the list was last parsed, which are read
+    without cloning the repos or parsing the info files.
+    """
+    cache_file = None
+    if config_options.cache_packages and repo_url:
+        cache_dir = os.path.join(
+            config_options.cache_dir or helpers.get_default_cache_base_path(),
+            'dlrn-packages')
+        prefix = hashlib.sha1(json.dumps(
+            [repo_url, inforepo.info_files]).encode('utf-8')).hexdigest()
+        remotes_file = os.path.join(cache_dir, '%s-remotes.json' % prefix)
+        try:
+            with open(remotes_file) as fp:
+                remote_urls = json.load(fp)
+        except (IOError, OSError, ValueError):
+            remote_urls = []
+        cache_key = _package_cache_key(config_options, repo_url, remote_urls,
+                                       tags)
+        if cache_key:
+            cache_file = os.path.join(cache_dir, '%s-%s.pickle' %
+                                      (prefix, cache_key))
+            try:
+                with open(cache_file, 'rb') as fp:
+                    logger.debug('Using cached package list %s' % cache_file)
+                    return pickle.load(fp)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError) as e:
+                logger.debug('Could not load cached package list: %s' % e)
+
+    pkginfo = inforepo.get_info(apply_tag=tags)
+    packages = pkginfo["packages"]
+    if tags:
+        # FIXME allow list of tags?
+        packages = query.filter_pkgs(packages, {'tags': tags})
+
+    if cache_file:
+        new_remote_urls = _remote_git_urls(pkginfo)
+        if new_remote_urls is None:
+            logger.debug('Not caching the package list, a remote info repo '
+                         'is not a git repo')
+            return packages
+        if new_remote_urls != remote_urls:
+            # The key needs the HEAD of the remote info repos found now
+            remote_urls = new_remote_urls
+            cache_key = _package_cache_key(config_options, repo_url,
+                                           remote_urls, tags)
+            if not cache_key:
+                return packages
+            cache_file = os.path.join(cache_dir, '%s-%s.pickle' %
+                                      (prefix, cache_key))
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            _write_file(remotes_file,
+                        json.dumps(remote_urls).encode('utf-8'))
+            _write_file(cache_file,
+                        pickle.dumps(packages, pickle.HIGHEST_PROTOCOL))
+            # Remove the lists cached for previous commits
+            for f in os.listdir(cache_dir):
+                if (f.startswith(prefix) and f.endswith('.pickle') and
+                        f != os.path.basename(cache_file)):
+                    os.unlink(os.path.join(cache_dir, f))
+        except (IOError, OSError) as e:
+            logger.warning('Could not cache package list: %s' % e)
+    return packages
 
 
 class PkgInfoDriver(object):
     Info = namedtuple('Info', ['commits', 'skipped'])
 
     def __init__(self, *args, **kwargs):
-        self.packages = []
+        self.packages = PackageList()
         self.config_options = kwargs.get('cfg_options')
 
     def getpackages(self):
@@ -45,6 +273,9 @@ class PkgInfoDriver(object):
     def getinfo(self):
         return Info(None, False)
 
+    def prefetch(self):
+        return
+
     def preprocess(self):
         return
 
@@ -21,7 +21,12 @@
 #    containts a .spec.j2 file
 
 from dlrn.db import Commit
+from dlrn.drivers.pkginfo import getcachedpackages
+from dlrn.drivers.pkginfo import getpackage
+from dlrn.drivers.pkginfo import info_cache_ttl
+from dlrn.drivers.pkginfo import PackageList
 from dlrn.drivers.pkginfo import PkgInfoDriver
+from dlrn.gitbackend import get_git_backend
 from dlrn.repositories import getdistrobranch
 from dlrn.repositories import getsourcebranch
 from dlrn.repositories import refreshrepo
@@ -31,7 +36,6 @@ import logging
 import os
 import sh
 
-from distroinfo import query
 from distroinfo import info
 
 
@@ -52,6 +56,7 @@ class RdoInfoDriver(PkgInfoDriver):
             'rdoinfo_file': {'name': 'info_files', 'type': 'list',
                              'default': ['rdo.yml']},
             'cache_dir': {},
+            'cache_packages': {'type': 'boolean'},
         }
     }
 
@@ -68,6 +73,7 @@ class RdoInfoDriver(PkgInfoDriver):
         local_info_repo = kwargs.get('local_info_repo')
         tags = kwargs.get('tags')
         inforepo = None
+        repo_url = None
         info_files = self.config_options.rdoinfo_file
 
         if local_info_repo:
@@ -87,7 +93,9 @@ class RdoInfoDriver(PkgInfoDriver):
             inforepo = info.DistroInfo(
                 info_files=self.config_options.rdoinfo_file,
                 remote_git_info=self.config_options.rdoinfo_repo,
+                cache_ttl=info_cache_ttl(self.config_options),
                 cache_base_path=self.config_options.cache_dir)
+            repo_url = self.config_options.rdoinfo_repo
             self.distroinfo_path = "%s/%s" % (
                 self.config_options.rdoinfo_repo.rstrip('/'), info_files[0])
             for extra_file in info_files[1:]:
@@ -106,12 +114,10 @@ class RdoInfoDriver(PkgInfoDriver):
                 self.distroinfo_path += ",%s/%s" % (
                     rdoinfo_repo.rstrip('/'))
 
-        pkginfo = inforepo.get_info(apply_tag=tags)
-
-        self.packages = pkginfo["packages"]
-        if tags:
-            # FIXME allow list of tags?
-            self.packages = query.filter_pkgs(self.packages, {'tags': tags})
+        self.packages = PackageList(getcachedpackages(inforepo,
+                                                      self.config_options,
+                                                      tags,
+                                                      repo_url=repo_url))
         return self.packages
 
     def getinfo(self, **kwargs):
@@ -134,7 +140,7 @@ class RdoInfoDriver(PkgInfoDriver):
             try:
                 distro_branch, distro_hash, dt_distro = refreshrepo(
                     distro, distro_dir, self.config_options, distro_branch,
-                    local=local, full_path=distro_dir_full)
+                    local=local, full_path=distro_dir_full, shallow=True)
             except Exception:
                 # The error was already logged by refreshrepo, and we want
                 # to avoid halting the whole run because this distgit repo
@@ -147,7 +153,8 @@ class RdoInfoDriver(PkgInfoDriver):
                 # We should fail in this case, since we are running
                 # in dev mode, so no try/except
                 refreshrepo(distro, distro_dir, self.config_options, distro_branch,
-                            local=local, full_path=distro_dir_full)
+                            local=local, full_path=distro_dir_full,
+                            shallow=True)
 
         # repo is usually a string, but if it contains more then one entry we
         # git clone into a project subdirectory
@@ -171,26 +178,20 @@ class RdoInfoDriver(PkgInfoDriver):
                 # move on to the next repo
                 return PkgInfoDriver.Info([], True)
 
-            git = sh.git.bake(_cwd=repo_dir, _tty_out=False)
+            backend = get_git_backend(self.config_options)
             # Git gives us commits already sorted in the right order
             if tags_only is True:
                 logger.info('Building tags only for %s' % project)
                 if since == '-1':
                     # we need 2 entries as HEAD will be listed too
                     since = '-2'
-                lines = filter(
-                    lambda x: x.find('tag: ') >= 0,
-                    git.log('--simplify-by-decoration',
-                            "--pretty=format:'%ct %H %d'",
-                            since, "--first-parent",
-                            "--reverse", "%s" % source_branch))
+                commits = backend.getcommits(repo_dir, since,
+                                             ref=source_branch,
+                                             tags_only=True)
             else:
-                lines = git.log("--pretty=format:'%ct %H'",
-                                since, "--first-parent",
-                                "--reverse")
+                commits = backend.getcommits(repo_dir, since)
 
-            for line in lines:
-                dt, commit_hash = str(line).strip().strip("'").split(" ")[:2]
+            for dt, commit_hash in commits:
                 if self.config_options.use_components and 'component' in package:
                     component = package['component']
                 else:
@@ -246,12 +247,8 @@ class RdoInfoDriver(PkgInfoDriver):
     def distgit_dir(self, package_name):
         datadir = self.config_options.datadir
         # Find extra directory inside it, if needed
-        extra_dir = '/'
-        for package in self.packages:
-            if package['name'] == package_name:
-                if 'distgit-path' in package:
-                    extra_dir = package['distgit-path']
-                    break
+        package = getpackage(self.packages, package_name)
+        extra_dir = (package or {}).get('distgit-path', '/')
         return os.path.join(datadir, package_name + "_distro",
                             extra_dir.lstrip('/'))
 
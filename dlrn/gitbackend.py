@@ -0,0 +1,234 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Backends for the read-only git operations done by the drivers, such as
+# listing the commits to process or finding the last commit of a repo.
+#
+# - ShGitBackend runs the git command line through sh, and is the default.
+#
+# - Pygit2GitBackend uses libgit2 in-process, avoiding the cost of spawning
+#   a git process per operation. It requires the optional pygit2 module.
+#
+# The backend is selected with the git_backend option in projects.ini.
+
+import logging
+import os
+import sh
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+logger = logging.getLogger("dlrn-gitbackend")
+
+
+def _parse_since(since):
+    # Convert the since argument, as used by the git log calls in the
+    # drivers ("-N" or "--after=<timestamp>"), into a limit and a timestamp
+    limit = None
+    after = None
+    if since:
+        if since.startswith('--after='):
+            after = int(since[len('--after='):])
+        elif since.startswith('-') and since[1:].isdigit():
+            limit = int(since[1:])
+        else:
+            raise ValueError("Unsupported since argument %s" % since)
+    return limit, after
+
+
+class GitBackend(object):
+
+    def getcommits(self, path, since, ref=None, tags_only=False):
+        # Return a list of (commit timestamp, commit hash) for the commits in
+        # the first-parent history of ref (HEAD by default), oldest first.
+        # since can be "-N", to get the last N commits, or
+        # "--after=<timestamp>". If tags_only is True, only tagged commits
+        # are returned.
+        raise NotImplementedError()
+
+    def getlastcommit(self, path, subdir=False):
+        # Return [commit hash, commit timestamp] for HEAD. If subdir is True,
+        # return the last commit modifying the directory at path instead.
+        raise NotImplementedError()
+
+    def branchexists(self, path, name, remote=False):
+        raise NotImplementedError()
+
+    def tagexists(self, path, name):
+        raise NotImplementedError()
+
+    def remoteurls(self, path):
+        # Return the list of fetch URLs for the remotes of the repo
+        raise NotImplementedError()
+
+    def remotehead(self, url):
+        # Return the commit hash of HEAD in the remote repo at url, without
+        # cloning it
+        return str(sh.git('ls-remote', url, 'HEAD',
+                          _tty_out=False)).split()[0]
+
+
+class ShGitBackend(GitBackend):
+
+    def _git(self, path):
+        return sh.git.bake(_cwd=path, _tty_out=False)
+
+    def getcommits(self, path, since, ref=None, tags_only=False):
+        git = self._git(path)
+        if tags_only:
+            args = ['--simplify-by-decoration', "--pretty=format:'%ct %H %d'",
+                    since, "--first-parent", "--reverse"]
+        else:
+            args = ["--pretty=format:'%ct %H'", since, "--first-parent",
+                    "--reverse"]
+        if ref:
+            args.append(ref)
+        commits = []
+        for line in git.log(*args):
+            if tags_only and line.find('tag: ') < 0:
+                continue
+            dt, commit_hash = str(line).strip().strip("'").split(" ")[:2]
+            commits.append((dt, commit_hash))
+        return commits
+
+    def getlastcommit(self, path, subdir=False):
+        git = self._git(path)
+        return str(git.log("--pretty=format:%H %ct", "-1",
+                           "." if subdir else "HEAD")).strip().split(" ")
+
+    def branchexists(self, path, name, remote=False):
+        git = self._git(path)
+        if remote:
+            return bool(git.branch('--list', '--remote', name))
+        return bool(git.branch('--list', name))
+
+    def tagexists(self, path, name):
+        return bool(self._git(path).tag('-l', name))
+
+    def remoteurls(self, path):
+        urls = []
+        for line in str(self._git(path)("remote", "-v")).splitlines():
+            if '(fetch)' in line:
+                urls.append(line.split()[1])
+        return urls
+
+
+class Pygit2GitBackend(GitBackend):
+
+    def _repo(self, path):
+        return pygit2.Repository(pygit2.discover_repository(path))
+
+    def _refs(self, repo, prefix=''):
+        # Return the set of commit ids pointed to by the refs under prefix
+        ids = set()
+        for name in repo.references:
+            if not name.startswith(prefix):
+                continue
+            try:
+                ids.add(repo.references[name].peel(pygit2.Commit).id)
+            except (pygit2.GitError, ValueError, KeyError):
+                # Broken references or references to non-commits
+                continue
+        return ids
+
+    def getcommits(self, path, since, ref=None, tags_only=False):
+        limit, after = _parse_since(since)
+        repo = self._repo(path)
+        start = repo.revparse_single(ref or 'HEAD').peel(pygit2.Commit)
+        if tags_only:
+            # Emulate --simplify-by-decoration: only consider commits pointed
+            # to by a ref, then keep the tagged ones
+            decorated = self._refs(repo)
+            decorated.add(repo.head.peel(pygit2.Commit).id)
+            tagged = self._refs(repo, 'refs/tags/')
+        walker = repo.walk(start.id)
+        walker.simplify_first_parent()
+        commits = []
+        for commit in walker:
+            if after is not None and commit.commit_time < after:
+                break
+            if tags_only and commit.id not in decorated:
+                continue
+            commits.append(commit)
+            if limit is not None and len(commits) >= limit:
+                break
+        if tags_only:
+            commits = [c for c in commits if c.id in tagged]
+        return [(str(c.commit_time), str(c.id)) for c in reversed(commits)]
+
+    def _treeid(self, commit, relpath):
+        if relpath == '.':
+            return commit.tree.id
+        try:
+            return commit.tree[relpath].id
+        except KeyError:
+            return None
+
+    def getlastcommit(self, path, subdir=False):
+        repo = self._repo(path)
+        head = repo.head.peel(pygit2.Commit)
+        relpath = '.'
+        if subdir:
+            relpath = os.path.relpath(os.path.realpath(path),
+                                      os.path.realpath(repo.workdir))
+        if relpath != '.':
+            # Find the most recent commit that changed the directory, i.e.
+            # the first one whose tree differs from all of its parents
+            for commit in repo.walk(head.id, pygit2.GIT_SORT_TIME):
+                treeid = self._treeid(commit, relpath)
+                if treeid is None:
+                    continue
+                if all(self._treeid(parent, relpath) != treeid
+                       for parent in commit.parents):
+                    head = commit
+                    break
+        return [str(head.id), str(head.commit_time)]
+
+    def branchexists(self, path, name, remote=False):
+        repo = self._repo(path)
+        if remote:
+            return repo.branches.remote.get(name) is not None
+        return repo.branches.local.get(name) is not None
+
+    def tagexists(self, path, name):
+        return ('refs/tags/%s' % name) in self._repo(path).references
+
+    def remoteurls(self, path):
+        return [remote.url for remote in self._repo(path).remotes]
+
+
+_backends = {}
+
+
+def get_git_backend(config_options):
+    requested = config_options.git_backend
+    if requested in _backends:
+        return _backends[requested]
+    name = requested
+    if name not in ('sh', 'pygit2', 'auto'):
+        logger.warning("Unknown git_backend %s, using sh" % name)
+        name = 'sh'
+    elif name in ('pygit2', 'auto'):
+        if pygit2 is not None:
+            name = 'pygit2'
+        else:
+            if name == 'pygit2':
+                logger.warning("The pygit2 module is not available, using "
+                               "the sh git backend")
+            name = 'sh'
+    if name == 'pygit2':
+        _backends[requested] = Pygit2GitBackend()
+    else:
+        _backends[requested] = ShGitBackend()
+    return _backends[requested]
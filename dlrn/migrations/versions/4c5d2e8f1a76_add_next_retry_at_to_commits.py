@@ -0,0 +1,40 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Add next_retry_at column and hashes index to commits
+
+Revision ID: 4c5d2e8f1a76
+Revises: 9e2c1b7a4f03
+Create Date: 2026-10-19 16:41:09.318254
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4c5d2e8f1a76'
+down_revision = '9e2c1b7a4f03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('commits', sa.Column('next_retry_at', sa.Integer()))
+    op.create_index('commits_hashes_idx', 'commits',
+                    ['commit_hash', 'distro_hash'])
+
+
+def downgrade():
+    op.drop_index('commits_hashes_idx', table_name='commits')
+    with op.batch_alter_table('commits') as batch_op:
+        batch_op.drop_column('next_retry_at')
@@ -0,0 +1,37 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Add timings column to commits
+
+Revision ID: 9e2c1b7a4f03
+Revises: 6a3d982b967b
+Create Date: 2026-10-19 10:12:31.524617
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9e2c1b7a4f03'
+down_revision = '6a3d982b967b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('commits', sa.Column('timings', sa.Text()))
+
+
+def downgrade():
+    with op.batch_alter_table('commits') as batch_op:
+        batch_op.drop_column('timings')
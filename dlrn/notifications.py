@@ -18,6 +18,7 @@ import sh
 import smtplib
 
 from dlrn.config import getConfigOptions
+from dlrn.drivers.pkginfo import getpackage
 from dlrn.reporting import get_commit_url
 from email.mime.text import MIMEText
 
@@ -32,12 +33,10 @@ def submit_review(commit, packages, env_vars):
 
     project_name = commit.project_name
 
-    for pkg in packages:
-        if project_name == pkg['name']:
-            break
-    else:
+    pkg = getpackage(packages, project_name)
+    if pkg is None:
         logger.error('Unable to find info for project'
-                     ' %s' % project)
+                     ' %s' % project_name)
         return
 
     url = (get_commit_url(commit, pkg) + commit.commit_hash)
@@ -67,9 +66,7 @@ def submit_review(commit, packages, env_vars):
 def sendnotifymail(packages, commit):
     config_options = getConfigOptions()
 
-    details = copy.copy(
-        [package for package in packages
-            if package["name"] == commit.project_name][0])
+    details = copy.copy(getpackage(packages, commit.project_name))
 
     email_to = details['maintainers']
     if not config_options.smtpserver:
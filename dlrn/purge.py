@@ -11,16 +11,20 @@
 # under the License.
 
 import argparse
-import glob
 import logging
 import os
 import shutil
 import sys
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
 from six.moves import configparser
 from six.moves import input
+from sqlalchemy import func
+from sqlalchemy import or_
 from time import mktime
 
 from dlrn.config import setup_logging
@@ -33,10 +37,23 @@ from dlrn.utils import get_component_list
 
 FLAG_PURGED = 0x2
 
+# Number of commits fetched from the database at a time by the purge planner
+PURGE_BATCH_SIZE = 1000
+
+# Purge plan actions
+KEEP_LATEST = 'keep-latest'
+KEEP_EXCLUDED = 'keep-excluded'
+KEEP_REBUILT = 'keep-rebuilt'
+REMOVE = 'remove'
+REMOVE_LATEST = 'remove-latest'
+# Actions flagging the commit as purged
+PURGE_ACTIONS = (REMOVE, REMOVE_LATEST, KEEP_REBUILT)
+
 logger = logging.getLogger("dlrn-purge")
 
 
-def is_commit_in_dirs(commit, dirlist, basedir, component_list=None):
+def is_commit_in_dirs(commit, dirlist, basedir, component_list=None,
+                      filenames=None):
     if dirlist is None:
         return False
     if commit.artifacts is None:
@@ -46,6 +63,11 @@ def is_commit_in_dirs(commit, dirlist, basedir, component_list=None):
     for rpm in commit.artifacts.split(','):
         rpms.append(rpm.split('/')[-1])
 
+    # If we already have the list of files from get_excluded_filenames(),
+    # there is no need to check each path
+    if filenames is not None:
+        return any(rpm in filenames for rpm in rpms)
+
     for rpm in rpms:
         for directory in directories:
             if os.path.exists(os.path.join(directory, rpm)):
@@ -61,48 +83,372 @@ def is_commit_in_dirs(commit, dirlist, basedir, component_list=None):
     return False
 
 
-def purge_promoted_hashes(config, timestamp, dry_run=True):
+def get_excluded_filenames(dirlist, basedir, component_list=None):
+    # Return the set of files found in the excluded directories, and their
+    # relative component paths when using components
+    filenames = set()
+    if dirlist is None:
+        return filenames
+    for directory in dirlist.split(','):
+        directories = [directory]
+        if component_list:
+            relpath = os.path.relpath(directory, basedir)
+            for component in component_list:
+                directories.append(os.path.join(basedir, 'component',
+                                                component, relpath))
+        for path in directories:
+            try:
+                filenames.update(os.listdir(path))
+            except OSError:
+                logger.debug("Cannot list excluded directory %s" % path)
+    return filenames
+
+
+def _iter_purge_candidates(session, before, batch_size=PURGE_BATCH_SIZE):
+    # Stream the commits built before the cutoff and not purged yet, newest
+    # first, fetching batch_size commits at a time
+    last_id = None
+    while True:
+        commits = getCommits(session, limit=0, before=before)
+        commits = commits.filter(or_(Commit.flags.is_(None),
+                                     Commit.flags.op('&')(FLAG_PURGED) == 0))
+        if last_id is not None:
+            commits = commits.filter(Commit.id < last_id)
+        batch = commits.limit(batch_size).all()
+        if not batch:
+            return
+        for commit in batch:
+            yield commit
+        last_id = batch[-1].id
+
+
+class PurgePlan(object):
+    """List of actions to take for each commit considered by dlrn-purge
+
+    Each action is a tuple of (action, commit id, project name, commit
+    directory), in the order they need to be executed.
+    """
+    def __init__(self):
+        self.actions = []
+
+    def add(self, action, commit, datadir):
+        self.actions.append((action, commit.id, commit.project_name,
+                             datadir))
+
+    def count(self, action):
+        return len([entry for entry in self.actions if entry[0] == action])
+
+    def to_purge(self):
+        # Commits to flag as purged
+        return [entry for entry in self.actions if entry[0] in PURGE_ACTIONS]
+
+    def summary(self):
+        return ('%d commits to purge, %d directories to remove\n'
+                '%d commits kept as the latest successful build of their '
+                'project\n'
+                '%d commits kept in the excluded directories\n'
+                '%d failed commits kept, as they were rebuilt successfully'
+                % (len(self.to_purge()),
+                   self.count(REMOVE) + self.count(REMOVE_LATEST),
+                   self.count(KEEP_LATEST), self.count(KEEP_EXCLUDED),
+                   self.count(KEEP_REBUILT)))
+
+
+def plan_purge(session, before, datadir, exclude_dirs=None, basedir=None,
+               component_list=None, batch_size=PURGE_BATCH_SIZE):
+    plan = PurgePlan()
+    # Newest successful build of each project
+    latest_success = dict(
+        session.query(Commit.project_name, func.max(Commit.dt_build)).
+        filter(Commit.type == 'rpm', Commit.status == 'SUCCESS').
+        group_by(Commit.project_name).all())
+    # Commits with at least one successful build
+    successful = set(
+        session.query(Commit.project_name, Commit.commit_hash).
+        filter(Commit.status == 'SUCCESS').distinct().all())
+    excluded = get_excluded_filenames(exclude_dirs, basedir,
+                                      component_list=component_list)
+
+    fullpurge = set()
+    for commit in _iter_purge_candidates(session, before, batch_size):
+        if is_commit_in_dirs(commit, exclude_dirs, basedir,
+                             component_list=component_list,
+                             filenames=excluded):
+            # The commit RPMs are in one of the directories
+            # that should not be touched.
+            logger.info("Ignoring commit %s for %s, it is in one of the"
+                        " excluded directories" % (commit.id,
+                                                   commit.project_name))
+            plan.add(KEEP_EXCLUDED, commit, None)
+            continue
+
+        commitdir = os.path.join(datadir, "repos",
+                                 commit.getshardedcommitdir())
+        if (commit.project_name not in fullpurge and
+                commit.status == "SUCCESS"):
+            # So we have not removed any commit from this project yet, and it
+            # is successful. Is it the newest one?
+            latest = latest_success.get(commit.project_name)
+            if (commit.dt_build is None or latest is None or
+                    commit.dt_build >= latest):
+                logger.info("Keeping old commit for %s" % commit.project_name)
+                # this is the newest commit for this project, keep it
+                plan.add(KEEP_LATEST, commit, None)
+                continue
+            fullpurge.add(commit.project_name)
+            plan.add(REMOVE_LATEST, commit, commitdir)
+        elif (commit.status != "SUCCESS" and
+              (commit.project_name, commit.commit_hash) in successful):
+            # If the commit was not successful, we need to be careful not to
+            # remove the directory if there was a successful build
+            plan.add(KEEP_REBUILT, commit, None)
+        else:
+            plan.add(REMOVE, commit, commitdir)
+    return plan
+
+
+class RateLimiter(object):
+    """Limit the rate of an operation shared by several threads
+
+    :param float rate: maximum number of operations per second
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = time.time()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Deleter(object):
+    """Remove directories from a pool of worker threads
+
+    :param int workers: number of directories removed in parallel
+    :param int files_per_second: maximum number of files and directories
+                                 removed per second by all workers, 0 means
+                                 no limit
+    :param str checkpoint: file where the removed directories are recorded,
+                           so they are skipped if the purge is interrupted
+                           and run again
+    :param bool dry_run: if True, only log what would be removed
+    """
+    def __init__(self, workers=1, files_per_second=0, checkpoint=None,
+                 dry_run=True):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.limiter = None
+        if files_per_second > 0:
+            self.limiter = RateLimiter(files_per_second)
+        self.checkpoint = checkpoint
+        self.dry_run = dry_run
+        self.pending = []
+        self.done = set()
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as fp:
+                self.done = set(line.strip() for line in fp)
+            logger.info("Resuming purge, %d directories already removed" %
+                        len(self.done))
+
+    def submit(self, path, func, *args):
+        # Run func(path, *args) from the worker pool
+        if path in self.done:
+            logger.info("Skipping %s, already removed" % path)
+            return
+        self.pending.append((path, self.executor.submit(func, path, *args)))
+
+    def wait(self):
+        # Wait for all pending removals, and record them in the checkpoint
+        pending, self.pending = self.pending, []
+        for path, future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning("Failed to remove %s: %s" % (path, e))
+                continue
+            self.done.add(path)
+            if self.checkpoint and not self.dry_run:
+                with open(self.checkpoint, 'a') as fp:
+                    fp.write(path + '\n')
+
+    def close(self):
+        # The purge is complete, there is nothing to resume
+        self.wait()
+        self.executor.shutdown()
+        if (self.checkpoint and not self.dry_run and
+                os.path.exists(self.checkpoint)):
+            os.remove(self.checkpoint)
+
+    def unlink(self, path):
+        if self.dry_run:
+            return
+        if self.limiter is not None:
+            self.limiter.wait()
+        os.unlink(path)
+
+    def rmtree(self, path, ignore_errors=False):
+        if self.dry_run:
+            return
+        if self.limiter is None:
+            shutil.rmtree(path, ignore_errors=ignore_errors)
+            return
+        # Remove the files one by one, to stay within the IO budget
+        try:
+            for root, dirs, files in os.walk(path, topdown=False):
+                for name in files:
+                    self.unlink(os.path.join(root, name))
+                for name in dirs:
+                    entry = os.path.join(root, name)
+                    self.limiter.wait()
+                    if os.path.islink(entry):
+                        os.unlink(entry)
+                    else:
+                        os.rmdir(entry)
+            self.limiter.wait()
+            os.rmdir(path)
+        except OSError:
+            if not ignore_errors:
+                raise
+
+
+def _purge_commit_dir(datadir, action, deleter):
+    if action == REMOVE_LATEST:
+        # The other symlinks not being purged may still be pointing to
+        # the rpm files of the most recent successful build of the project
+        try:
+            for entry in os.listdir(datadir):
+                entry = os.path.join(datadir, entry)
+                if entry.endswith(".rpm") and not os.path.islink(entry):
+                    logger.debug("Skipping dir or file %s" % entry)
+                    continue
+                if os.path.isdir(entry):
+                    logger.info("Remove %s" % entry)
+                    deleter.rmtree(entry)
+                else:
+                    logger.info("Delete %s" % entry)
+                    deleter.unlink(entry)
+        except OSError:
+            logger.warning("Cannot access directory %s for purge,"
+                           " ignoring." % datadir)
+    logger.info("Remove %s" % datadir)
+    deleter.rmtree(datadir, ignore_errors=True)
+
+
+def _flag_purged(session, commit_ids, batch_size=PURGE_BATCH_SIZE):
+    for i in range(0, len(commit_ids), batch_size):
+        session.query(Commit).filter(
+            Commit.id.in_(commit_ids[i:i + batch_size])).update(
+            {Commit.flags: func.coalesce(Commit.flags, 0).op('|')(
+                FLAG_PURGED)}, synchronize_session=False)
+
+
+def execute_purge_plan(plan, session, dry_run=True, deleter=None,
+                       batch_size=PURGE_BATCH_SIZE):
+    # The directories are removed in batches, and the commits of each batch
+    # are flagged as purged once it is complete, so an interrupted purge
+    # does not need to start over
+    own_deleter = deleter is None
+    if own_deleter:
+        deleter = Deleter(dry_run=dry_run)
+    purged = 0
+    for i in range(0, len(plan.actions), batch_size):
+        actions = plan.actions[i:i + batch_size]
+        for action, commit_id, project, datadir in actions:
+            if action in (REMOVE, REMOVE_LATEST):
+                deleter.submit(datadir, _purge_commit_dir, action, deleter)
+        deleter.wait()
+        commit_ids = [entry[1] for entry in actions
+                      if entry[0] in PURGE_ACTIONS]
+        purged += len(commit_ids)
+        if dry_run is False and commit_ids:
+            _flag_purged(session, commit_ids)
+            session.commit()
+            logger.info("Flagged %d/%d commits as purged" %
+                        (purged, len(plan.to_purge())))
+    if own_deleter:
+        deleter.close()
+
+
+def get_protected_paths(session, basedir, reponame, promotion_list):
+    # Return the set of aggregate directories that must not be purged: the
+    # ones the promotion symlinks point to, and the latest aggregate hash
+    # promoted for each promotion name and component
+    protected = set()
+    for prom in promotion_list:
+        repo_file = os.path.join(basedir, prom, reponame + '.repo')
+        if os.path.islink(repo_file):
+            protected.add(os.path.dirname(os.path.realpath(repo_file)))
+        else:
+            logger.warning('No symlinks at %s' % os.path.join(basedir, prom))
+
+    latest = session.query(func.max(Promotion.id)).group_by(
+        Promotion.promotion_name, Promotion.component)
+    for prom, aggregate_hash in session.query(
+            Promotion.promotion_name, Promotion.aggregate_hash).filter(
+            Promotion.id.in_(latest), Promotion.aggregate_hash.isnot(None)):
+        protected.add(os.path.realpath(os.path.join(
+            basedir, prom, aggregate_hash[:2], aggregate_hash[2:4],
+            aggregate_hash)))
+    return protected
+
+
+def _scandir_hashed(directory):
+    # We have to traverse a 3-level hash structure
+    # Not deleting the first two levels (xx/yy), just the final level,
+    # where the files are located
+    try:
+        first_level = [entry for entry in os.scandir(directory)
+                       if len(entry.name) == 2 and entry.is_dir()]
+    except OSError:
+        return
+    for first in first_level:
+        for second in os.scandir(first.path):
+            if len(second.name) != 2 or not second.is_dir():
+                continue
+            for entry in os.scandir(second.path):
+                if entry.is_dir():
+                    yield entry
+
+
+def purge_promoted_hashes(config, timestamp, dry_run=True, deleter=None):
     session = getSession(config.get('DEFAULT', 'database_connection'))
     basedir = os.path.join(config.get('DEFAULT', 'datadir'), 'repos')
     reponame = config.get('DEFAULT', 'reponame')
+    own_deleter = deleter is None
+    if own_deleter:
+        deleter = Deleter(dry_run=dry_run)
 
     # Get list of all promote names
-    all_promotions = session.query(Promotion).\
-        distinct(Promotion.promotion_name).\
-        group_by(Promotion.promotion_name).all()
-    closeSession(session)
-
     promotion_list = ['current', 'consistent']
-    for prom in all_promotions:
-        promotion_list.append(prom.promotion_name)
-
+    for prom, in session.query(Promotion.promotion_name).distinct().\
+            order_by(Promotion.promotion_name):
+        promotion_list.append(prom)
     logger.debug("Promotion list: %s" % promotion_list)
 
+    protected = get_protected_paths(session, basedir, reponame,
+                                    promotion_list)
+    closeSession(session)
+    logger.debug("Protected paths: %s" % sorted(protected))
+
     # Now go through all directories
     for prom in promotion_list:
         directory = os.path.join(basedir, prom)
         logger.info("Looking into directory: %s" % directory)
-        if os.path.islink(os.path.join(directory, reponame + '.repo')):
-            protected_path = os.path.dirname(
-                os.path.realpath(os.path.join(directory, reponame + '.repo')))
-        else:
-            logger.warning('No symlinks at %s' % directory)
-            protected_path = ''
-
-        logger.debug("Setting protected path: %s" % protected_path)
-        # We have to traverse a 3-level hash structure
-        # Not deleting the first two levels (xx/yy), just the final level,
-        # where the files are located
-        for path in glob.glob('%s/??/??/*' % directory):
-            if os.path.isdir(path):
-                dirstats = os.stat(path)
-                if timestamp > dirstats.st_mtime:
-                    if os.path.realpath(path) == protected_path:
-                        logger.info('Not deleting %s, it is protected' % path)
-                        continue
-                    logger.info("Remove %s" % path)
-                    if not dry_run:
-                        shutil.rmtree(path, ignore_errors=True)
+        for entry in _scandir_hashed(directory):
+            if timestamp > entry.stat().st_mtime:
+                if os.path.realpath(entry.path) in protected:
+                    logger.info('Not deleting %s, it is protected' %
+                                entry.path)
+                    continue
+                logger.info("Remove %s" % entry.path)
+                deleter.submit(entry.path, deleter.rmtree, True)
+    deleter.wait()
+    if own_deleter:
+        deleter.close()
 
 
 def purge():
@@ -124,6 +470,16 @@ def purge():
     parser.add_argument('--exclude-dirs', help="Do not remove commits whose"
                         " packages are included in one of the specifided"
                         " directories (comma-separated list).")
+    parser.add_argument('--delete-workers', type=int, default=1,
+                        help="Number of directories to remove in parallel."
+                             " Default: 1")
+    parser.add_argument('--files-per-second', type=int, default=0,
+                        help="Maximum number of files and directories to"
+                             " remove per second. Default: 0 (no limit)")
+    parser.add_argument('--checkpoint-file',
+                        help="Record the removed directories in this file,"
+                             " to resume an interrupted purge. It is"
+                             " removed once the purge is complete.")
     parser.add_argument('--debug', action='store_true',
                         help="Print debug logs")
 
@@ -160,87 +516,21 @@ def purge():
     # All repositories can have the repodata directory and symlinks purged
     # But we must keep the rpm files of the most recent successful build of
     # each project as other symlinks not being purged will be pointing to them.
-    topurge = getCommits(session,
-                         limit=0,
-                         before=int(mktime(timeparsed.timetuple()))
-                         ).all()
-
-    logger.debug("Commmits from %s days ago: %s" % (options.older_than,
-                                                    topurge))
-
-    fullpurge = []
-    for commit in topurge:
-        if commit.flags & FLAG_PURGED:
-            logger.debug("Commit %s was purged" % commit)
-            continue
-
-        if is_commit_in_dirs(commit, options.exclude_dirs, basedir,
-                             component_list=component_list):
-            # The commit RPMs are in one of the directories
-            # that should not be touched.
-            logger.info("Ignoring commit %s for %s, it is in one of the"
-                        " excluded directories" % (commit.id,
-                                                   commit.project_name))
-            continue
-
-        datadir = os.path.join(cp.get('DEFAULT', 'datadir'), "repos",
-                               commit.getshardedcommitdir())
-        if commit.project_name not in fullpurge and commit.status == "SUCCESS":
-            # So we have not removed any commit from this project yet, and it
-            # is successful. Is it the newest one?
-            previouscommits = getCommits(session,
-                                         project=commit.project_name,
-                                         since=commit.dt_build,
-                                         with_status='SUCCESS').count()
-
-            if previouscommits == 0:
-                logger.info("Keeping old commit for %s" % commit.project_name)
-                continue  # this is the newest commit for this project, keep it
-
-            try:
-                for entry in os.listdir(datadir):
-                    entry = os.path.join(datadir, entry)
-                    if entry.endswith(".rpm") and not os.path.islink(entry):
-                        logger.debug("Skipping dir or file %s" % entry)
-                        continue
-                    if os.path.isdir(entry):
-                        logger.info("Remove %s" % entry)
-                        if options.dry_run is False:
-                            shutil.rmtree(entry)
-                    else:
-                        logger.info("Delete %s" % entry)
-                        if options.dry_run is False:
-                            os.unlink(entry)
-            except OSError:
-                logger.warning("Cannot access directory %s for purge,"
-                               " ignoring." % datadir)
-            fullpurge.append(commit.project_name)
-            commit.flags |= FLAG_PURGED
-            logger.info("Remove %s" % datadir)
-            if options.dry_run is False:
-                shutil.rmtree(datadir, ignore_errors=True)
-        else:
-            # If the commit was not successful, we need to be careful not to
-            # remove the directory if there was a successful build
-            if commit.status != "SUCCESS":
-                othercommits = session.query(Commit).filter(
-                    Commit.project_name == commit.project_name,
-                    Commit.commit_hash == commit.commit_hash,
-                    Commit.status == 'SUCCESS').count()
-
-                if othercommits == 0:
-                    logger.info("Remove %s" % datadir)
-                    if options.dry_run is False:
-                        shutil.rmtree(datadir, ignore_errors=True)
-            else:
-                logger.info("Remove %s" % datadir)
-                if options.dry_run is False:
-                    shutil.rmtree(datadir, ignore_errors=True)
-            commit.flags |= FLAG_PURGED
-    if options.dry_run is False:
-        session.commit()
+    plan = plan_purge(session, int(mktime(timeparsed.timetuple())),
+                      cp.get('DEFAULT', 'datadir'),
+                      exclude_dirs=options.exclude_dirs, basedir=basedir,
+                      component_list=component_list)
+    print("Purge plan for commits built before %s:\n%s" %
+          (timeparsed.ctime(), plan.summary()))
+    deleter = Deleter(workers=options.delete_workers,
+                      files_per_second=options.files_per_second,
+                      checkpoint=options.checkpoint_file,
+                      dry_run=options.dry_run)
+    execute_purge_plan(plan, session, dry_run=options.dry_run,
+                       deleter=deleter)
     closeSession(session)
 
     if cp.getboolean('DEFAULT', 'use_components'):
         purge_promoted_hashes(cp, mktime(timeparsed.timetuple()),
-                              dry_run=options.dry_run)
+                              dry_run=options.dry_run, deleter=deleter)
+    deleter.close()
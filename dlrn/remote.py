@@ -12,19 +12,29 @@
 
 
 import argparse
+import bz2
+import gzip
+import hashlib
 import logging
+import lzma
 import os
 import requests
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from six.moves import configparser
 from tempfile import mkstemp
+from xml.etree import ElementTree
 
 from dlrn.config import ConfigOptions
 from dlrn.config import setup_logging
 from dlrn.db import closeSession
 from dlrn.db import getLastProcessedCommit
 from dlrn.db import getSession
+from dlrn.drivers.pkginfo import getpackage
+from dlrn.reporting import genreports
+from dlrn.shell import finish_sync
 from dlrn.shell import post_build
 from dlrn.shell import process_build_result
 from dlrn.utils import import_object
@@ -34,20 +44,127 @@ from dlrn.utils import lock_file
 
 logger = logging.getLogger("dlrn-remote")
 
+LOG_FILES = ['build.log', 'installed', 'mock.log', 'root.log',
+             'rpmbuild.log', 'state.log']
 
-def import_commit(repo_url, config_file, db_connection=None,
-                  local_info_repo=None):
-    cp = configparser.RawConfigParser()
-    cp.read(config_file)
-    config_options = ConfigOptions(cp)
-    pkginfo_driver = config_options.pkginfo_driver
-    pkginfo = import_object(pkginfo_driver, cfg_options=config_options)
-    packages = pkginfo.getpackages(local_info_repo=local_info_repo,
-                                   tags=config_options.tags,
-                                   dev_mode=False)
+REPO_NS = {'repo': 'http://linux.duke.edu/metadata/repo',
+           'common': 'http://linux.duke.edu/metadata/common'}
+
+DECOMPRESSORS = {'.gz': gzip.decompress, '.bz2': bz2.decompress,
+                 '.xz': lzma.decompress}
+
+
+class RemoteImportError(Exception):
+    # Raised once the other repos of a batch are imported, with the errors
+    # for each of the repos that could not be
+    def __init__(self, errors):
+        self.errors = errors
+        super(RemoteImportError, self).__init__(
+            'Could not import the commits from %s' % ', '.join(
+                '%s (%s)' % (url, error) for url, error in errors.items()))
+
+
+def _get_session(workers):
+    session = requests.Session()
+    # Keep a connection per worker to each of the remote hosts
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
+
+def _file_checksum(path, checksum_type):
+    if checksum_type == 'sha':
+        checksum_type = 'sha1'
+    checksum = hashlib.new(checksum_type)
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_repodata_checksums(session, repo_url):
+    # Return a dict of {rpm file name: (checksum type, checksum, size)} from
+    # the primary metadata of a remote repo. If the metadata cannot be read,
+    # return an empty dict, and the RPMs will not be verified
+    checksums = {}
+    try:
+        r = session.get(repo_url + '/repodata/repomd.xml', timeout=10)
+        r.raise_for_status()
+        repomd = ElementTree.fromstring(r.content)
+        location = repomd.find("repo:data[@type='primary']/repo:location",
+                               REPO_NS)
+        href = location.get('href')
+        decompress = DECOMPRESSORS.get(os.path.splitext(href)[1])
+        if decompress is None and not href.endswith('.xml'):
+            logger.debug('Unsupported compression for %s' % href)
+            return checksums
+        r = session.get(repo_url + '/' + href, timeout=45)
+        r.raise_for_status()
+        content = decompress(r.content) if decompress else r.content
+        primary = ElementTree.fromstring(content)
+    except Exception as e:
+        logger.debug('Could not read the repodata from %s: %s' %
+                     (repo_url, e))
+        return checksums
+
+    for package in primary.findall('common:package', REPO_NS):
+        checksum = package.find('common:checksum', REPO_NS)
+        location = package.find('common:location', REPO_NS)
+        size = package.find('common:size', REPO_NS)
+        if checksum is None or location is None:
+            continue
+        checksums[location.get('href').split('/')[-1]] = (
+            checksum.get('type'), checksum.text,
+            int(size.get('package')) if size is not None else None)
+    return checksums
+
+
+def download_file(session, url, path, checksum=None, timeout=45):
+    # Download url to path, streaming it to disk. If checksum is set, as a
+    # (checksum type, checksum, size) tuple, the file is verified, and not
+    # downloaded again if it already exists with the same checksum.
+    if checksum is not None:
+        checksum_type, checksum_value, size = checksum
+        if (os.path.exists(path) and
+                (size is None or os.path.getsize(path) == size) and
+                _file_checksum(path, checksum_type) == checksum_value):
+            logger.debug('Skipping %s, already downloaded' % url)
+            return
+    tmpfile = path + '.part'
+    r = session.get(url, timeout=timeout, stream=True)
+    try:
+        # Raise an exception in case of a failure
+        r.raise_for_status()
+        with open(tmpfile, 'wb') as fp:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                fp.write(chunk)
+        if checksum is not None:
+            if ((size is not None and os.path.getsize(tmpfile) != size) or
+                    _file_checksum(tmpfile, checksum_type) != checksum_value):
+                raise ValueError('Checksum mismatch for %s' % url)
+        os.rename(tmpfile, path)
+    except Exception:
+        # Do not leave partial downloads behind
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    finally:
+        r.close()
+
+
+def _download_log(session, url, path):
+    try:
+        download_file(session, url, path, timeout=10)
+    except (requests.exceptions.RequestException, IOError, OSError):
+        # Ignore errors, if the remote build failed there may be
+        # some missing files
+        pass
+
+
+def _get_commits(http_session, repo_url):
     remote_yaml = repo_url + '/' + 'commit.yaml'
-    contents = requests.get(remote_yaml, timeout=10)
+    contents = http_session.get(remote_yaml, timeout=10)
     # If we have an error code, this will raise an exception
     contents.raise_for_status()
     osfd, tmpfilename = mkstemp()
@@ -56,10 +173,6 @@ def import_commit(repo_url, config_file, db_connection=None,
 
     commits = loadYAML_list(tmpfilename)
     os.remove(tmpfilename)
-    datadir = os.path.realpath(config_options.datadir)
-    if not os.path.exists(datadir):
-        os.makedirs(datadir)
-
     for commit in commits:
         commit.id = None
         if commit.artifacts == 'None':
@@ -67,62 +180,147 @@ def import_commit(repo_url, config_file, db_connection=None,
         commit.dt_build = int(commit.dt_build)
         commit.dt_commit = float(commit.dt_commit)
         commit.dt_distro = int(commit.dt_distro)
-        # Check if the latest built commit for this project is newer
-        # than this one. In that case, we should ignore it
-        if db_connection:
-            session = getSession(db_connection)
-        else:
-            session = getSession(config_options.database_connection)
-        package = commit.project_name
-        old_commit = getLastProcessedCommit(session, package)
-        if old_commit:
-            if old_commit.dt_commit >= commit.dt_commit:
-                if old_commit.dt_distro >= commit.dt_distro:
-                    logger.info('Skipping commit %s, a newer commit is '
-                                'already built\n'
-                                'Old: %s %s, new: %s %s' %
-                                (commit.commit_hash, old_commit.dt_commit,
-                                 old_commit.dt_distro, commit.dt_commit,
-                                 commit.dt_distro))
-                    continue    # Skip
+    return commits
 
-        yumrepodir = os.path.join(datadir, "repos",
-                                  commit.getshardedcommitdir())
-        if not os.path.exists(yumrepodir):
-            os.makedirs(yumrepodir)
 
-        for logfile in ['build.log', 'installed', 'mock.log', 'root.log',
-                        'rpmbuild.log', 'state.log']:
-            logfile_url = repo_url + '/' + logfile
-            contents = None
+def _is_outdated(session, commit):
+    # Check if the latest built commit for this project is newer
+    # than this one. In that case, we should ignore it
+    old_commit = getLastProcessedCommit(session, commit.project_name)
+    if old_commit:
+        if old_commit.dt_commit >= commit.dt_commit:
+            if old_commit.dt_distro >= commit.dt_distro:
+                logger.info('Skipping commit %s, a newer commit is '
+                            'already built\n'
+                            'Old: %s %s, new: %s %s' %
+                            (commit.commit_hash, old_commit.dt_commit,
+                             old_commit.dt_distro, commit.dt_commit,
+                             commit.dt_distro))
+                return True
+    return False
+
+
+def _download_commit(executor, http_session, repo_url, commit, datadir):
+    yumrepodir = os.path.join(datadir, "repos",
+                              commit.getshardedcommitdir())
+    if not os.path.exists(yumrepodir):
+        os.makedirs(yumrepodir)
+
+    futures = []
+    for logfile in LOG_FILES:
+        futures.append(executor.submit(_download_log, http_session,
+                                       repo_url + '/' + logfile,
+                                       os.path.join(yumrepodir, logfile)))
+
+    if commit.artifacts:
+        checksums = get_repodata_checksums(http_session, repo_url)
+        for rpm in commit.artifacts.split(","):
+            if rpm == 'None':
+                continue
+            rpm_name = rpm.split('/')[-1]
+            # Unlike the logs, a missing or corrupted RPM makes the import
+            # of the whole repo fail
+            futures.append(executor.submit(download_file, http_session,
+                                           repo_url + '/' + rpm_name,
+                                           os.path.join(datadir, rpm),
+                                           checksum=checksums.get(rpm_name)))
+    return futures
+
+
+def _fetch_commits(http_session, repo_url, errors):
+    # Return the commits of a remote repo, or None if they cannot be fetched
+    try:
+        return _get_commits(http_session, repo_url)
+    except Exception as e:
+        logger.error('Failed to fetch the commits from %s: %s' %
+                     (repo_url, e))
+        errors[repo_url] = e
+        return None
+
+
+def import_commit(repo_url, config_file, db_connection=None,
+                  local_info_repo=None):
+    return import_commits([repo_url], config_file,
+                          db_connection=db_connection,
+                          local_info_repo=local_info_repo)
+
+
+def import_commits(repo_urls, config_file, db_connection=None,
+                   local_info_repo=None):
+    # Import the commits from a list of remote repos. All logs and RPMs are
+    # downloaded in parallel first, then the repos, database and reports
+    # are updated in a single pass, holding the remote update lock. If a
+    # repo cannot be fetched, the other ones are still imported, then
+    # RemoteImportError is raised
+    cp = configparser.RawConfigParser()
+    cp.read(config_file)
+    config_options = ConfigOptions(cp)
+    pkginfo_driver = config_options.pkginfo_driver
+    pkginfo = import_object(pkginfo_driver, cfg_options=config_options)
+    packages = pkginfo.getpackages(local_info_repo=local_info_repo,
+                                   tags=config_options.tags,
+                                   dev_mode=False)
+
+    workers = config_options.remote_download_workers
+    http_session = _get_session(workers)
+    datadir = os.path.realpath(config_options.datadir)
+    if not os.path.exists(datadir):
+        os.makedirs(datadir)
+
+    if db_connection:
+        session = getSession(db_connection)
+    else:
+        session = getSession(config_options.database_connection)
+
+    # Fetch the commit.yaml files first, so the repos that cannot be read
+    # are skipped before downloading anything
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        remote_commits = list(executor.map(
+            lambda url: _fetch_commits(http_session, url, errors), repo_urls))
+
+    to_import = []
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        downloads = []
+        for repo_url, commits in zip(repo_urls, remote_commits):
+            repo_commits = []
+            futures = []
+            for commit in commits or []:
+                key = (commit.commit_hash, commit.distro_hash,
+                       commit.extended_hash, commit.component)
+                if key in seen or _is_outdated(session, commit):
+                    continue    # Skip
+                seen.add(key)
+                futures.extend(_download_commit(executor, http_session,
+                                                repo_url, commit, datadir))
+                repo_commits.append(commit)
+            downloads.append((repo_url, repo_commits, futures))
+        for repo_url, repo_commits, futures in downloads:
             try:
-                contents = requests.get(logfile_url, timeout=10)
-            except requests.exceptions.RequestException:
-                # Ignore errors, if the remote build failed there may be
-                # some missing files
-                pass
-            if contents and contents.status_code == 200:
-                with open(os.path.join(yumrepodir, logfile), "w") as fp:
-                    fp.writelines(contents.text)
-
-        if commit.artifacts:
-            for rpm in commit.artifacts.split(","):
-                rpm_url = repo_url + '/' + rpm.split('/')[-1]
-                try:
-                    r = requests.get(rpm_url, timeout=45)
-                    # Raise an exception in case of a failure
-                    r.raise_for_status()
-                    with open(os.path.join(datadir, rpm), "wb") as fp:
-                        fp.write(r.content)
-                except requests.exceptions.RequestException:
-                    if rpm != 'None':
-                        logger.warning("Failed to download rpm file %s"
-                                       % rpm_url)
-        # Get remote update lock, to prevent any other remote operation
-        # while we are creating the repo and updating the database
-        logger.debug("Acquiring remote update lock")
-        with lock_file(os.path.join(datadir, 'remote.lck')):
-            logger.debug("Acquired lock")
+                for future in futures:
+                    future.result()
+            except Exception as e:
+                logger.error('Failed to download the files from %s: %s' %
+                             (repo_url, e))
+                errors[repo_url] = e
+                continue
+            to_import.extend(repo_commits)
+
+    # Process the commits in chronological order, so the current symlinks
+    # end up pointing to the newest ones
+    to_import.sort(key=lambda commit: (commit.dt_commit, commit.dt_distro))
+
+    # Get remote update lock, to prevent any other remote operation
+    # while we are creating the repos and updating the database
+    logger.debug("Acquiring remote update lock")
+    with lock_file(os.path.join(datadir, 'remote.lck')):
+        logger.debug("Acquired lock")
+        # Another import may have processed newer commits while we were
+        # downloading
+        to_import = [commit for commit in to_import
+                     if not _is_outdated(session, commit)]
+        for commit in to_import:
             if commit.status == 'SUCCESS':
                 built_rpms = []
                 for rpm in commit.artifacts.split(","):
@@ -130,7 +328,7 @@ def import_commit(repo_url, config_file, db_connection=None,
                 status = [commit, built_rpms, commit.notes, None]
                 post_build(status, packages, session)
             else:
-                pkg = [p for p in packages if p['name'] == package][0]
+                pkg = getpackage(packages, commit.project_name)
                 # Here we fire a refresh of the repositories
                 # (upstream and distgit) to be sure to have them in the
                 # data directory. We need that in the case the worker
@@ -144,10 +342,19 @@ def import_commit(repo_url, config_file, db_connection=None,
                 commit.repo_dir = os.path.join(
                     config_options.datadir, pkg['name'])
                 status = [commit, '', '', commit.notes]
-            process_build_result(status, packages, session, [])
-            closeSession(session)   # Keep one session per commit
-        logger.debug("Released lock")
-    return 0
+            process_build_result(status, packages, session, [],
+                                 reports=False)
+        # Wait for the repos queued for synchronization, if rsync_workers
+        # is set, and mark the ones that failed
+        sync_ok = finish_sync(packages, config_options, session=session)
+        # The reports only need to be generated once for the batch
+        if to_import:
+            genreports(packages, False, session, [])
+        closeSession(session)
+    logger.debug("Released lock")
+    if errors:
+        raise RemoteImportError(errors)
+    return 0 if sync_ok else 1
 
 
 def remote():
@@ -159,9 +366,11 @@ def remote():
     parser.add_argument('--config-file',
                         default='projects.ini',
                         help="Config file. Default: projects.ini")
-    parser.add_argument('--repo-url',
+    parser.add_argument('--repo-url', action='append',
                         help="Base repository URL for remotely generated repo "
-                             "(required)", required=True)
+                             "(required). Can be specified multiple times to "
+                             "import several repos in a single batch",
+                        required=True)
     parser.add_argument('--info-repo',
                         help="use a local rdoinfo repo instead of "
                              "fetching the default one using rdopkg. Only "
@@ -174,5 +383,9 @@ def remote():
 
     setup_logging(options.debug)
 
-    return import_commit(options.repo_url, options.config_file,
-                         local_info_repo=options.info_repo)
+    try:
+        return import_commits(options.repo_url, options.config_file,
+                              local_info_repo=options.info_repo)
+    except RemoteImportError as e:
+        logger.error(str(e))
+        return 1
@@ -132,7 +132,8 @@ def genreports(packages, head_only, session, all_commits):
     # then report on failures since then
     for package in packages:
         name = package["name"]
-        commits = getCommits(session, project=name, limit=1)
+        commits = getCommits(session, project=name,
+                             without_status="SKIPPED", limit=1)
 
         # No builds
         if commits.count() == 0:
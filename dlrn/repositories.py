@@ -10,6 +10,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
 import logging
 import os
 import re
@@ -17,18 +18,147 @@ import sh
 import shutil
 
 from dlrn.config import setup_logging
+from dlrn.gitbackend import get_git_backend
+from dlrn.utils import lock_file
 
 logger = logging.getLogger("dlrn-repositories")
 setup_logging()
 
 
+REFRESH_CACHE_FILE = 'dlrn-refresh.json'
+
+
+def _refresh_cache_path(path):
+    return os.path.join(path, '.git', REFRESH_CACHE_FILE)
+
+
+def getremotehash(url, branch):
+    # Return the hash a branch or tag points to in a remote repository, or
+    # None if it cannot be found. For annotated tags, return the hash of the
+    # tagged commit.
+    refs = {}
+    output = sh.git("ls-remote", url, "refs/heads/%s" % branch,
+                    "refs/tags/%s" % branch, "refs/tags/%s^{}" % branch,
+                    _tty_out=False, _timeout=300)
+    for line in str(output).splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            refs[fields[1]] = fields[0]
+    for ref in ["refs/heads/%s" % branch, "refs/tags/%s^{}" % branch,
+                "refs/tags/%s" % branch]:
+        if ref in refs:
+            return refs[ref]
+    return None
+
+
+def _check_unchanged(url, path, branch, git_path):
+    # Return the cached repo information if the remote branch has not changed
+    # since the last refresh and the local checkout was not modified,
+    # None otherwise
+    try:
+        with open(_refresh_cache_path(path)) as fp:
+            cache = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    if cache.get('url') != url or cache.get('branch') != branch:
+        return None
+    repoinfo = cache.get('repoinfo')
+    try:
+        if getremotehash(url, branch) != repoinfo[1]:
+            return None
+        git = sh.git.bake(_cwd=git_path, _tty_out=False, _timeout=300)
+        if str(git("rev-parse", "HEAD")).strip() != repoinfo[1]:
+            return None
+        if str(git.status("--porcelain", "--untracked-files=no")).strip():
+            return None
+    except Exception as e:
+        logger.debug("Could not check %s for changes: %s" % (path, e))
+        return None
+    return repoinfo
+
+
+def _save_refresh_cache(url, path, branch, repoinfo):
+    try:
+        with open(_refresh_cache_path(path), 'w') as fp:
+            json.dump({'url': url, 'branch': branch, 'repoinfo': repoinfo},
+                      fp)
+    except (IOError, OSError) as e:
+        logger.debug("Could not save refresh cache for %s: %s" % (path, e))
+
+
+def getmirrorpath(url, config_options):
+    # Return the path of the shared bare mirror for url, or None if mirrors
+    # are not enabled
+    if not config_options.git_mirror_dir:
+        return None
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', url.rstrip('/'))
+    if not name.endswith('.git'):
+        name += '.git'
+    return os.path.join(config_options.git_mirror_dir, name)
+
+
+def updatemirror(url, config_options):
+    # Create or update the shared bare mirror for url, and return its path.
+    # The mirror is locked, since several workers may be refreshing
+    # checkouts of the same remote at the same time.
+    mirror = getmirrorpath(url, config_options)
+    if not os.path.exists(config_options.git_mirror_dir):
+        os.makedirs(config_options.git_mirror_dir)
+    with lock_file(mirror + '.lck'):
+        if not os.path.isdir(mirror):
+            logger.info("Creating mirror of %s in %s" % (url, mirror))
+            shutil.rmtree(mirror + '.tmp', ignore_errors=True)
+            sh.git.clone("--mirror", url, mirror + '.tmp', _tty_out=False,
+                         _timeout=3600)
+            # Checkouts use the mirror objects through alternates, so they
+            # must never be pruned
+            git = sh.git.bake(_cwd=mirror + '.tmp', _tty_out=False)
+            git.config("gc.pruneExpire", "never")
+            os.rename(mirror + '.tmp', mirror)
+        else:
+            git = sh.git.bake(_cwd=mirror, _tty_out=False, _timeout=3600)
+            git.fetch("--prune", "origin")
+    return mirror
+
+
+def _clone(url, path, config_options, shallow=False, mirror=None):
+    args = []
+    if mirror:
+        args += ['--reference', mirror]
+    else:
+        if config_options.git_clone_filter:
+            args.append('--filter=%s' % config_options.git_clone_filter)
+        if shallow and config_options.distgit_clone_depth > 0:
+            args += ['--depth', str(config_options.distgit_clone_depth),
+                     '--no-single-branch']
+    args += [url, path]
+    sh.git.clone(*args)
+
+
 def refreshrepo(url, path, config_options, branch="master", local=False,
-                full_path=None):
+                full_path=None, shallow=False):
     logger.info("Getting %s to %s (%s)" % (url, path, branch))
     checkout_not_present = not os.path.exists(path)
+    requested_branch = branch
+    backend = get_git_backend(config_options)
+    if (config_options.skip_unchanged_repos and local is False and
+            checkout_not_present is False):
+        repoinfo = _check_unchanged(url, path, branch, full_path or path)
+        if repoinfo:
+            logger.info("No changes in %s (%s), skipping refresh" %
+                        (url, branch))
+            return repoinfo
+    mirror = None
+    if config_options.git_mirror_dir and (local is False or
+                                          checkout_not_present is True):
+        try:
+            mirror = updatemirror(url, config_options)
+        except Exception as e:
+            logger.error("Error updating mirror of %s: %s" % (url, e))
+            raise
     if checkout_not_present is True:
         try:
-            sh.git.clone(url, path)
+            _clone(url, path, config_options, shallow, mirror)
         except Exception as e:
             logger.error("Error cloning %s into %s: %s" % (url, path, e))
             raise
@@ -36,25 +166,17 @@ def refreshrepo(url, path, config_options, branch="master", local=False,
     elif local is False:
         # We need to cover a corner case here, where the repo URL has changed
         # since the last execution
-        git = sh.git.bake(_cwd=path, _tty_out=False, _timeout=3600)
         try:
-            remotes = git("remote", "-v").splitlines()
-            fetch_url = None
-            for remote in remotes:
-                if '(fetch)' in remote:
-                    line = remote.split()
-                    if line[1] == url:
-                        break
-                    else:
-                        fetch_url = line[1]
-            else:
+            fetch_urls = backend.remoteurls(path)
+            if url not in fetch_urls:
+                fetch_url = fetch_urls[-1] if fetch_urls else None
                 # URL changed, so remove directory
                 logger.warning("URL for %s changed from %s to %s, "
                                "cleaning directory and cloning again"
                                % (path, fetch_url, url))
                 shutil.rmtree(path, ignore_errors=True)
                 try:
-                    sh.git.clone(url, path)
+                    _clone(url, path, config_options, shallow, mirror)
                 except Exception as e:
                     logger.error("Error cloning %s into %s: %s" % (url, path,
                                                                    e))
@@ -65,14 +187,21 @@ def refreshrepo(url, path, config_options, branch="master", local=False,
             logger.warning("Directory %s does not contain a valid Git repo, "
                            "cleaning directory and cloning again" % path)
             shutil.rmtree(path)
-            sh.git.clone(url, path)
+            _clone(url, path, config_options, shallow, mirror)
 
     git_path = full_path or path
     git = sh.git.bake(_cwd=git_path, _tty_out=False, _timeout=3600)
 
     if local is False or checkout_not_present is True:
         try:
-            git.fetch("--prune", "origin")
+            if mirror:
+                # Fetch from the shared mirror instead of the remote, the
+                # mirror was just updated
+                git.fetch("--prune", mirror,
+                          "+refs/heads/*:refs/remotes/origin/*",
+                          "+refs/tags/*:refs/tags/*")
+            else:
+                git.fetch("--prune", "origin")
             _branches = git.branch("-vv")
             # We want to delete the branch locally if it's removed in remote.
             if _branches and "origin/%s: gone" % branch in _branches:
@@ -101,16 +230,16 @@ def refreshrepo(url, path, config_options, branch="master", local=False,
                     # allowed by config.
                     unm_branch = branch.replace('stable/', 'unmaintained/')
                     eol_tag = branch.replace('stable/', '') + '-eol'
-                    list_eol = git.tag('-l', eol_tag)
-                    if git.branch('--list', '--remote',
-                                  'origin/' + unm_branch):
+                    list_eol = backend.tagexists(git_path, eol_tag)
+                    if backend.branchexists(git_path, 'origin/' + unm_branch,
+                                            remote=True):
                         branch = unm_branch
                     elif list_eol:
                         branch = eol_tag
                     elif config_options.fallback_to_master:
-                        if git.branch('--list', 'master'):
+                        if backend.branchexists(git_path, 'master'):
                             branch = "master"
-                        elif git.branch('--list', 'main'):
+                        elif backend.branchexists(git_path, 'main'):
                             branch = "main"
                         else:
                             logger.error("Branch %s for %s does not exist and "
@@ -146,12 +275,28 @@ def refreshrepo(url, path, config_options, branch="master", local=False,
             # Maybe it was a tag, not a branch
             git.reset("--hard", "%s" % branch)
 
-    repoinfo = str(git.log("--pretty=format:%H %ct", "-1", "HEAD")).\
-        strip().split(" ")
+    repoinfo = backend.getlastcommit(git_path)
     repoinfo.insert(0, branch)
+    # Only cache the result if there was no fallback to another branch, so
+    # we notice when the requested branch is created
+    if (config_options.skip_unchanged_repos and local is False and
+            branch == requested_branch):
+        _save_refresh_cache(url, path, branch, repoinfo)
     return repoinfo
 
 
+def gettaggedcommits(path):
+    # Return the set of commit hashes pointed to by a tag in the repo at path.
+    # For annotated tags, %(*objectname) is the hash of the tagged commit.
+    git = sh.git.bake(_cwd=path, _tty_out=False)
+    refs = git("for-each-ref", "--format=%(objectname) %(*objectname)",
+               "refs/tags")
+    tagged = set()
+    for line in str(refs).splitlines():
+        tagged.update(line.split())
+    return tagged
+
+
 def getdistrobranch(package, default_branch=None):
     if 'distro-branch' in package:
         return package['distro-branch']
@@ -164,3 +309,10 @@ def getsourcebranch(package, default_branch=None):
         return package['source-branch']
     else:
         return default_branch
+
+
+def getcoalescepolicy(package, default_policy=None):
+    if 'coalesce-policy' in package:
+        return str(package['coalesce-policy'])
+    else:
+        return default_policy
@@ -0,0 +1,121 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# When a build fails with a known error, it is marked as RETRY and built
+# again in a later run. The retry policy decides how many times each known
+# error can be retried (maxretries, or the limit set for its pattern in
+# retry_limits), and how long to wait before the next attempt. The wait
+# grows exponentially with the number of retries, with some random jitter
+# so the builds failing at the same time are not all retried together, and
+# is stored in the next_retry_at column of the RETRY commit. The limits in
+# retry_limits are keyed by the exact known error pattern, so a warning is
+# logged for the ones not found in the current patterns.
+
+import logging
+import random
+import time
+
+from dlrn.db import Commit
+from dlrn.utils import get_known_errors
+from sqlalchemy import func
+
+logger = logging.getLogger("dlrn-retry")
+
+# Policy for the last configuration seen by get_retry_policy()
+_policy_cache = {}
+
+
+def parse_retry_limits(retry_limits):
+    # Convert a list of pattern:limit strings into a dictionary. The limit
+    # is after the last colon, as patterns may contain colons
+    limits = {}
+    for entry in retry_limits or []:
+        if not entry.strip():
+            continue
+        pattern, _sep, limit = entry.rpartition(':')
+        try:
+            limits[pattern.strip()] = int(limit)
+        except ValueError:
+            raise ValueError('Invalid retry_limits entry %s, it should be '
+                             'pattern:limit' % entry)
+    return limits
+
+
+class RetryPolicy(object):
+    def __init__(self, maxretries, backoff=0, backoff_max=0, limits=None):
+        self.maxretries = maxretries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.limits = limits or {}
+
+    @classmethod
+    def from_config(cls, config_options):
+        return cls(config_options.maxretries,
+                   backoff=config_options.retry_backoff,
+                   backoff_max=config_options.retry_backoff_max,
+                   limits=parse_retry_limits(config_options.retry_limits))
+
+    def max_retries(self, known_error):
+        return self.limits.get(known_error, self.maxretries)
+
+    def should_retry(self, known_error, retries):
+        # Only builds failing with a known error are retried
+        if not known_error:
+            return False
+        return retries < self.max_retries(known_error)
+
+    def delay(self, retries):
+        # Seconds to wait before the next attempt, after retries attempts
+        if self.backoff <= 0:
+            return 0
+        delay = self.backoff * 2 ** retries
+        if self.backoff_max > 0:
+            delay = min(delay, self.backoff_max)
+        # Wait at least half of the delay
+        return int(random.uniform(delay / 2.0, delay))
+
+    def next_retry_at(self, retries, now=None):
+        delay = self.delay(retries)
+        if not delay:
+            return None
+        if now is None:
+            now = time.time()
+        return int(now) + delay
+
+
+def get_retry_policy(config_options):
+    # Return the retry policy for config_options. The policy is only built
+    # again when the configuration or the known error patterns change
+    known_errors = get_known_errors(config_options.known_errors_file)
+    key = (config_options.maxretries, config_options.retry_backoff,
+           config_options.retry_backoff_max,
+           tuple(config_options.retry_limits or []), tuple(known_errors))
+    policy = _policy_cache.get(key)
+    if policy is None:
+        policy = RetryPolicy.from_config(config_options)
+        for pattern in sorted(set(policy.limits) - set(known_errors)):
+            logger.warning('The retry_limits pattern %s is not a known error '
+                           'pattern, its limit will not be used' % pattern)
+        _policy_cache.clear()
+        _policy_cache[key] = policy
+    return policy
+
+
+def get_next_retry_at(session, commit):
+    # Return the time before which the commit should not be retried, from
+    # its last attempt, or None if it can be built
+    return session.query(func.max(Commit.next_retry_at)).filter(
+        Commit.project_name == commit.project_name,
+        Commit.commit_hash == commit.commit_hash,
+        Commit.distro_hash == commit.distro_hash,
+        Commit.type == commit.type,
+        Commit.status == "RETRY").scalar()
@@ -10,66 +10,203 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+# The repo content is pushed to rsyncdest after each build by sync_repo,
+# and the current/consistent symlinks by sync_symlinks, once their target
+# has been pushed.
+#
+# If rsync_workers is set in projects.ini, both functions only queue the
+# transfer, and an RsyncQueue pushes the queued commit directories from a
+# background thread, in batches split among up to rsync_workers parallel
+# rsync processes. wait_for_sync() waits until everything queued has been
+# pushed, and get_failed_syncs() returns the commits whose directory could
+# not be pushed, so the caller can mark them as failed.
+
+import json
 import logging
 import os
+import re
 import sh
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from dlrn.config import getConfigOptions
+from dlrn.utils import lock_file
 
 logger = logging.getLogger("dlrn-rsync")
 
+REPORT_FILES = ['report.html', 'status_report.html', 'styles.css',
+                'queue.html', 'status_report.csv']
+
+# Totals for all the transfers, used by the /metrics API endpoint
+STATS_FILE = 'rsync-stats.json'
+
+_queue = None
+
+
+def _rsync(config_options, *args):
+    # Run rsync with the configured options, and log the duration and bytes
+    # sent by the transfer
+    options = list(config_options.rsync_options)
+    skip_compress = [suffix for suffix in config_options.rsync_skip_compress
+                     if suffix]
+    if skip_compress:
+        options.append('--skip-compress=%s' % '/'.join(skip_compress))
+    if config_options.rsync_whole_file:
+        options.append('--whole-file')
+    options.extend(['--stats', '-e', _rsh_command(config_options)])
+    start = time.time()
+    output = sh.rsync(options, *(args + (config_options.rsyncdest,)))
+    duration = time.time() - start
+    bytes_sent = 0
+    match = re.search(r'Total bytes sent: ([\d,.]+)', str(output))
+    if match:
+        bytes_sent = int(re.sub(r'[,.]', '', match.group(1)))
+    logger.info('Synchronized to %s in %.2f seconds, %d bytes sent' %
+                (config_options.rsyncdest, duration, bytes_sent))
+    _record_stats(config_options, duration, bytes_sent)
+
+
+def _record_stats(config_options, duration, bytes_sent):
+    stats_file = os.path.join(os.path.realpath(config_options.datadir),
+                              STATS_FILE)
+    try:
+        with lock_file(stats_file + '.lck'):
+            stats = get_stats(config_options)
+            stats['transfers'] += 1
+            stats['seconds'] += duration
+            stats['bytes_sent'] += bytes_sent
+            with open(stats_file + '.tmp', 'w') as fp:
+                json.dump(stats, fp)
+            os.rename(stats_file + '.tmp', stats_file)
+    except (IOError, OSError) as e:
+        logger.warning('Could not update %s: %s' % (stats_file, e))
+
+
+def get_stats(config_options):
+    # Return the number of transfers, total duration and bytes sent by rsync
+    stats = {'transfers': 0, 'seconds': 0.0, 'bytes_sent': 0}
+    stats_file = os.path.join(os.path.realpath(config_options.datadir),
+                              STATS_FILE)
+    try:
+        with open(stats_file) as fp:
+            stats.update(json.load(fp))
+    except (IOError, OSError, ValueError):
+        pass
+    return stats
+
+
+def _rsh_command(config_options):
+    rsh_command = ('ssh -p %s -o StrictHostKeyChecking=no' %
+                   config_options.rsyncport)
+    if config_options.rsync_ssh_multiplex:
+        # Reuse a single SSH connection for all transfers
+        rsh_command += (' -o ControlMaster=auto -o ControlPath=~/.ssh/'
+                        'dlrn-%C -o ControlPersist=60')
+    return rsh_command
+
+
+def _get_queue(config_options):
+    global _queue
+    if _queue is None or _queue.workers != config_options.rsync_workers:
+        if _queue is not None:
+            _queue.wait()
+        _queue = RsyncQueue(config_options)
+    return _queue
+
 
 def sync_repo(commit):
     config_options = getConfigOptions()
     rsyncdest = config_options.rsyncdest
-    rsyncport = config_options.rsyncport
     datadir = os.path.realpath(config_options.datadir)
 
     if rsyncdest != '':
-        # We are only rsyncing the current repo dir to rsyncdest
-        rsyncpaths = []
         # We are inserting a dot in the path after repos, this is used by
         # rsync -R (see man rsync)
         commitdir_abs = os.path.join(datadir, "repos", ".",
                                      commit.getshardedcommitdir())
-        rsyncpaths.append(commitdir_abs)
-        # We also need report.html, status_report.html, queue.html,
-        # styles.css and the consistent and current symlinks
-        for filename in ['report.html', 'status_report.html', 'styles.css',
-                         'queue.html', 'status_report.csv']:
+        if config_options.rsync_workers > 0:
+            _get_queue(config_options).add_repo(commitdir_abs,
+                                                commit_key(commit))
+            return
+        _sync_dirs([commitdir_abs], config_options)
+
+
+def _sync_dirs(commitdirs, config_options, reports=True):
+    rsyncdest = config_options.rsyncdest
+    datadir = os.path.realpath(config_options.datadir)
+    # We are only rsyncing the commit dirs to rsyncdest
+    rsyncpaths = list(commitdirs)
+    # We also need report.html, status_report.html, queue.html,
+    # styles.css and the consistent and current symlinks
+    if reports:
+        for filename in REPORT_FILES:
             filepath = os.path.join(datadir, "repos", ".", filename)
             rsyncpaths.append(filepath)
 
-        rsh_command = 'ssh -p %s -o StrictHostKeyChecking=no' % rsyncport
-        try:
-            sh.rsync('-avzR', '--delete-delay',
-                     '-e', rsh_command,
-                     rsyncpaths, rsyncdest)
-        except Exception as e:
-            logger.warn('Failed to rsync content to %s ,'
-                        'got error %s' % (rsyncdest, e))
-            # Raise exception, so it can be treated as an error
-            raise e
+    try:
+        _rsync(config_options, rsyncpaths)
+    except Exception as e:
+        logger.warn('Failed to rsync content to %s ,'
+                    'got error %s' % (rsyncdest, e))
+        # Raise exception, so it can be treated as an error
+        raise e
+
+
+def _symlink_paths(commit, config_options):
+    datadir = os.path.realpath(config_options.datadir)
+    rsyncpaths = []
+    for filename in ['consistent', 'current']:
+        if config_options.use_components:
+            filepath = os.path.join(datadir, "repos", ".", "component",
+                                    commit.component, filename)
+        else:
+            filepath = os.path.join(datadir, "repos", ".", filename)
+        rsyncpaths.append(filepath)
+    return rsyncpaths
 
 
 def sync_symlinks(commit):
     config_options = getConfigOptions()
+    if config_options.rsyncdest != '':
+        if config_options.rsync_workers > 0:
+            _get_queue(config_options).add_symlinks(commit)
+            return
+        _sync_symlinks(commit, config_options)
+
+
+def commit_key(commit):
+    # Identify a commit without keeping a reference to an object bound to
+    # a database session
+    return (commit.project_name, commit.commit_hash, commit.distro_hash,
+            commit.extended_hash, commit.type)
+
+
+def wait_for_sync():
+    # Wait until all queued transfers are done. Return False if any of them
+    # failed
+    if _queue is None:
+        return True
+    return _queue.wait()
+
+
+def get_failed_syncs():
+    # Return the keys of the commits whose directory could not be pushed by
+    # the last wait_for_sync(), and drop them from the queue
+    if _queue is None:
+        return []
+    return _queue.pop_failed()
+
+
+def _sync_symlinks(commit, config_options):
     rsyncdest = config_options.rsyncdest
-    rsyncport = config_options.rsyncport
     datadir = os.path.realpath(config_options.datadir)
     reponame = config_options.reponame
 
     if rsyncdest != '':
         # We want to sync the symlinks in a second pass, once all content
         # has been copied, to avoid a race condition it they are copied first
-        rsyncpaths = []
-        for filename in ['consistent', 'current']:
-            if config_options.use_components:
-                filepath = os.path.join(datadir, "repos", ".", "component",
-                                        commit.component, filename)
-            else:
-                filepath = os.path.join(datadir, "repos", ".", filename)
-            rsyncpaths.append(filepath)
+        rsyncpaths = _symlink_paths(commit, config_options)
 
         # If using components, current and consistent on the top-level dir
         # are not symlinks, but full directories
@@ -92,15 +229,10 @@ def sync_symlinks(commit):
                                           (filepath, reponame))
                 extra_include_list.append('%s/versions.csv' % filepath)
 
-        rsh_command = 'ssh -p %s -o StrictHostKeyChecking=no' % rsyncport
-
         if config_options.use_components:
             try:
                 # First, rsync everything except the top-level symlinks
-                sh.rsync('-avzR', '--delete-delay',
-                         '-e', rsh_command,
-                         exclude_list,
-                         rsyncpaths, rsyncdest)
+                _rsync(config_options, exclude_list, rsyncpaths)
             except Exception as e:
                 # We are not raising exceptions for symlink rsyncs, these will
                 # be fixed after another build
@@ -108,9 +240,7 @@ def sync_symlinks(commit):
                             'got error %s' % (rsyncdest, e))
             try:
                 # Then, the top-level symlinks
-                sh.rsync('-avzR', '--delete-delay',
-                         '-e', rsh_command,
-                         extra_include_list, rsyncdest)
+                _rsync(config_options, extra_include_list)
             except Exception as e:
                 # We are not raising exceptions for symlink rsyncs, these will
                 # be fixed after another build
@@ -118,11 +248,131 @@ def sync_symlinks(commit):
                             'got error %s' % (rsyncdest, e))
         else:
             try:
-                sh.rsync('-avzR', '--delete-delay',
-                         '-e', rsh_command,
-                         rsyncpaths, rsyncdest)
+                _rsync(config_options, rsyncpaths)
             except Exception as e:
                 # We are not raising exceptions for symlink rsyncs, these will
                 # be fixed after another build
                 logger.warn('Failed to rsync symlinks to %s ,'
                             'got error %s' % (rsyncdest, e))
+
+
+class RsyncQueue(object):
+
+    def __init__(self, config_options):
+        self.config_options = config_options
+        self.workers = config_options.rsync_workers
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.failed = False
+        # Commit directories waiting to be pushed
+        self.dirs = []
+        # Commit key for each directory
+        self.commits = {}
+        # Symlink sync requests, as (commit, {symlink: target})
+        self.links = []
+
+    def add_repo(self, commitdir, key=None):
+        with self.lock:
+            if commitdir not in self.dirs:
+                self.dirs.append(commitdir)
+            if key is not None:
+                self.commits[commitdir] = key
+            self._start()
+
+    def pop_failed(self):
+        # After a failed wait(), the directories still queued could not be
+        # pushed. Their symlinks will be pushed after another build
+        with self.lock:
+            if not self.failed:
+                return []
+            keys = [self.commits.pop(d) for d in self.dirs
+                    if d in self.commits]
+            self.dirs = []
+            self.links = []
+            self.failed = False
+            return keys
+
+    def add_symlinks(self, commit):
+        targets = {}
+        for path in _symlink_paths(commit, self.config_options):
+            if os.path.islink(path):
+                targets[path] = os.readlink(path)
+        with self.lock:
+            self.links.append((commit, targets))
+            self._start()
+
+    def wait(self):
+        with self.lock:
+            self.failed = False
+            if self.dirs or self.links:
+                self._start()
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+        return not self.failed
+
+    def _start(self):
+        # Must be called with the lock held
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                dirs, self.dirs = self.dirs, []
+                links, self.links = self.links, []
+                if not dirs and not links:
+                    self.thread = None
+                    return
+            if not self._sync_dirs(dirs):
+                logger.error('Could not rsync %s' % ', '.join(dirs))
+                # Keep everything for the next attempt, after the next build
+                # or when waiting for the transfers
+                with self.lock:
+                    self.dirs = dirs + [d for d in self.dirs
+                                        if d not in dirs]
+                    self.links = links + self.links
+                    self.failed = True
+                    self.thread = None
+                return
+            with self.lock:
+                for commitdir in dirs:
+                    self.commits.pop(commitdir, None)
+            self._sync_links(links)
+
+    def _sync_dirs(self, dirs):
+        if not dirs:
+            return True
+        # Split the directories among the workers, each one running a
+        # single rsync for its batch. The reports only need to be sent once
+        batches = [dirs[i::self.workers] for i in range(self.workers)]
+        futures = [self.executor.submit(_sync_dirs, batch,
+                                        self.config_options,
+                                        reports=(i == 0))
+                   for i, batch in enumerate(batches) if batch]
+        result = True
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                result = False
+        return result
+
+    def _sync_links(self, links):
+        # Only the most recent request matters for each set of symlinks
+        latest = {}
+        for commit, targets in links:
+            latest[commit.component if self.config_options.use_components
+                   else None] = (commit, targets)
+        for commit, targets in latest.values():
+            changed = [path for path, target in targets.items()
+                       if not os.path.islink(path) or
+                       os.readlink(path) != target]
+            if changed:
+                # The symlinks were updated after the request, and may point
+                # to content not pushed yet. There is a newer request for
+                # them, so skip this one
+                continue
+            _sync_symlinks(commit, self.config_options)
@@ -16,6 +16,7 @@ import argparse
 import logging
 import multiprocessing
 import os
+import signal
 import sys
 import tempfile
 import time
@@ -28,10 +29,13 @@ import sh
 from six.moves import configparser
 
 from dlrn.build import build_worker
+from dlrn.circuit_breaker import CircuitBreaker
 
 from dlrn.config import ConfigOptions
 from dlrn.config import getConfigOptions
 from dlrn.config import setup_logging
+from dlrn.daemon import PollScheduler
+from dlrn.daemon import TriggerServer
 
 from dlrn.db import CIVote
 from dlrn.db import closeSession
@@ -41,20 +45,37 @@ from dlrn.db import getLastBuiltCommit
 from dlrn.db import getLastProcessedCommit
 from dlrn.db import getSession
 from dlrn.db import Project
+from dlrn.drivers.pkginfo import getpackage
+from dlrn.drivers.pkginfo import getprojectnames
 from dlrn.notifications import sendnotifymail
 from dlrn.notifications import submit_review
 from dlrn.reporting import genreports
+from dlrn.repositories import getcoalescepolicy
 from dlrn.repositories import getsourcebranch
+from dlrn.repositories import gettaggedcommits
+from dlrn.retry import get_next_retry_at
+from dlrn.retry import get_retry_policy
 from dlrn.rpmspecfile import RpmSpecCollection
 from dlrn.rpmspecfile import RpmSpecFile
+from dlrn.rsync import commit_key
+from dlrn.rsync import get_failed_syncs
 from dlrn.rsync import sync_repo
 from dlrn.rsync import sync_symlinks
+from dlrn.rsync import wait_for_sync
+from dlrn.utils import add_timing
 from dlrn.utils import aggregate_repo_files
+from dlrn.utils import BUILD_PHASES
 from dlrn.utils import dumpshas2file
+from dlrn.utils import find_known_error
+from dlrn.utils import get_known_errors
+from dlrn.utils import get_timings
 from dlrn.utils import import_object
-from dlrn.utils import isknownerror
 from dlrn.utils import lock_file
+from dlrn.utils import record_known_error
+from dlrn.utils import record_timings
+from dlrn.utils import remove_timing
 from dlrn.utils import saveYAML_commit
+from dlrn.utils import timed_phase
 from dlrn.utils import timesretried
 from dlrn import version
 
@@ -69,7 +90,60 @@ def deprecation():
     main()
 
 
-def _add_commits(project_toprocess, toprocess, options, session):
+# Apply a commit coalescing policy to the list of pending commits for a
+# project, and return two lists: the commits to build and the commits to skip.
+# The most recent commit is always built. Valid policies are:
+# - head: only build the most recent commit
+# - tags: build the most recent commit, plus any tagged commit
+# - N (a positive integer): build the most recent commit, plus every Nth one
+def coalesce_commits(commits, policy):
+    if not policy or policy == 'all' or len(commits) < 2:
+        return commits, []
+
+    if policy == 'head':
+        def keep(index, commit):
+            return False
+    elif policy == 'tags':
+        tagged = {}
+
+        def keep(index, commit):
+            if commit.repo_dir not in tagged:
+                try:
+                    tagged[commit.repo_dir] = gettaggedcommits(
+                        commit.repo_dir)
+                except Exception as e:
+                    logger.warning("Could not list tags in %s: %s" %
+                                   (commit.repo_dir, e))
+                    tagged[commit.repo_dir] = set()
+            return commit.commit_hash in tagged[commit.repo_dir]
+    else:
+        try:
+            step = int(policy)
+        except ValueError:
+            step = 0
+        if step < 1:
+            logger.warning("Invalid coalescing policy %s, building all "
+                           "commits" % policy)
+            return commits, []
+
+        def keep(index, commit):
+            return (index + 1) % step == 0
+
+    tobuild = []
+    toskip = []
+    for index, commit in enumerate(commits[:-1]):
+        if keep(index, commit):
+            tobuild.append(commit)
+        else:
+            toskip.append(commit)
+    tobuild.append(commits[-1])
+    return tobuild, toskip
+
+
+def _add_commits(project_toprocess, toprocess, options, session,
+                 coalesce_policy=None):
+    candidates = []
+    now = time.time()
     # The first entry in the list of commits is a commit we have
     # already processed, we want to process it again only if in dev
     # mode or distro hash has changed, we can't simply check
@@ -100,7 +174,42 @@ def _add_commits(project_toprocess, toprocess, options, session):
                 Commit.extended_hash == commit_toprocess.extended_hash,
                 Commit.type == commit_toprocess.type,
                 Commit.status != "RETRY").all()):
-            toprocess.append(commit_toprocess)
+            if not (options.dev or options.run):
+                # Wait for the retry backoff of a failed build, and keep
+                # the following commits for later so they are built in order
+                next_retry_at = get_next_retry_at(session, commit_toprocess)
+                if next_retry_at and next_retry_at > now:
+                    logger.info("Deferring %s commit %s, will retry after "
+                                "%s" % (commit_toprocess.project_name,
+                                        commit_toprocess.commit_hash,
+                                        time.strftime(
+                                            '%Y-%m-%d %H:%M:%S',
+                                            time.localtime(next_retry_at))))
+                    break
+            candidates.append(commit_toprocess)
+
+    if coalesce_policy and not (options.dev or options.run):
+        candidates, skipped = coalesce_commits(candidates, coalesce_policy)
+        # Record the skipped commits, so they are not considered again in
+        # future runs
+        for commit in skipped:
+            commit.status = "SKIPPED"
+            commit.dt_build = int(time.time())
+            commit.notes = ("Skipped by coalescing policy %s, built %s "
+                            "instead" % (coalesce_policy,
+                                         candidates[-1].commit_hash))
+            session.add(commit)
+        if skipped:
+            logger.info("Skipping %d commits for %s due to coalescing "
+                        "policy %s" % (len(skipped),
+                                       skipped[0].project_name,
+                                       coalesce_policy))
+            session.commit()
+    # The repositories are refreshed once for all the commits of a package,
+    # so only the first one to be built keeps the refresh time
+    for commit in candidates[1:]:
+        remove_timing(commit, 'refresh')
+    toprocess.extend(candidates)
 
 
 def main():
@@ -186,6 +295,14 @@ def main():
                         "packages.")
     parser.add_argument('--debug', action='store_true',
                         help="Print debug logs")
+    parser.add_argument('--profile', action="store_true",
+                        help="Print a summary of the time spent on each "
+                             "build phase at the end of the run.")
+    parser.add_argument('--daemon', action="store_true",
+                        help="Keep running, polling the packages for new "
+                             "commits and building them continuously. "
+                             "Send SIGHUP to reload the configuration and "
+                             "the package list.")
 
     options = parser.parse_args(sys.argv[1:])
 
@@ -220,8 +337,7 @@ def main():
                                    dev_mode=options.dev)
 
     if options.project_name:
-        pkg_names = [p['name'] for p in packages
-                     if p['project'] in options.project_name]
+        pkg_names = getprojectnames(packages, options.project_name)
     elif options.package_name:
         pkg_names = options.package_name
     else:
@@ -231,7 +347,7 @@ def main():
         if not pkg_names:
             pkg_names = [p['name'] for p in packages]
         for name in pkg_names:
-            package = [p for p in packages if p['name'] == name][0]
+            package = getpackage(packages, name)
             for build_type in package.get('types', ['rpm']):
                 commit = getLastProcessedCommit(
                     session, name, 'invalid status',
@@ -292,7 +408,7 @@ def main():
         exit_recheck = 0
 
         for pkg_name in pkg_names:
-            package = [p for p in packages if p['name'] == pkg_name][0]
+            package = getpackage(packages, pkg_name)
             for build_type in package.get('types', ['rpm']):
                 commit = getLastProcessedCommit(session, pkg_name,
                                                 type=build_type)
@@ -307,16 +423,152 @@ def main():
                     exit_recheck = 1
         sys.exit(exit_recheck)
 
+    if options.daemon:
+        if options.dev or options.run:
+            logger.error('--daemon cannot be used with --dev or --run.')
+            sys.exit(1)
+        closeSession(session)
+        return run_daemon(options, cp, config_options, packages, pkg_names)
+
+    exit_code = process_packages(options, config_options, packages,
+                                 pkg_names, session)
+
+    if options.dev:
+        os.remove(tmpdb_path)
+    return exit_code
+
+
+# Keep building packages until SIGTERM or SIGINT is received. The package
+# list, the database engine and the worker pools are kept across polls, and
+# are only re-created when SIGHUP is received.
+def run_daemon(options, cp, config_options, packages, pkg_names=None):
+    names = set(pkg_names or [])
+    global pkginfo
+    current_cp = cp
+    state = {'reload': False, 'stop': False}
+
+    def _reload(signum, frame):
+        logger.info("Received SIGHUP, reloading after the current cycle")
+        state['reload'] = True
+
+    def _stop(signum, frame):
+        logger.info("Received signal %d, stopping after the current cycle" %
+                    signum)
+        state['stop'] = True
+
+    signal.signal(signal.SIGHUP, _reload)
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    scheduler = PollScheduler(config_options.daemon_poll_interval)
+    trigger_server = None
+    if config_options.daemon_socket:
+        trigger_server = TriggerServer(config_options.daemon_socket,
+                                       scheduler)
+        trigger_server.start()
+
+    def _create_pools(config_options):
+        getinfo_pool = multiprocessing.Pool()
+        if options.sequential:
+            build_pool = None
+        else:
+            build_pool = multiprocessing.Pool(config_options.workers)
+        return getinfo_pool, build_pool
+
+    def _close_pools(*pools):
+        for pool in pools:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    getinfo_pool, build_pool = _create_pools(config_options)
+    exit_code = 0
+    try:
+        while not state['stop']:
+            if state['reload']:
+                state['reload'] = False
+                cp = configparser.RawConfigParser()
+                cp.read(options.config_file)
+                try:
+                    new_options = ConfigOptions(
+                        cp, overrides=options.config_override)
+                    new_options.verbose_build = options.verbose_build
+                    new_pkginfo = import_object(new_options.pkginfo_driver,
+                                                cfg_options=new_options)
+                    packages = new_pkginfo.getpackages(
+                        local_info_repo=options.info_repo,
+                        tags=new_options.tags, dev_mode=False)
+                except Exception as e:
+                    logger.error("Failed to reload the configuration, "
+                                 "keeping the previous one: %s" % e)
+                    # ConfigOptions sets itself as the global configuration,
+                    # so we need to restore the previous one
+                    config_options = ConfigOptions(
+                        current_cp, overrides=options.config_override)
+                    config_options.verbose_build = options.verbose_build
+                    continue
+                current_cp = cp
+                config_options = new_options
+                pkginfo = new_pkginfo
+                scheduler.default_interval = \
+                    config_options.daemon_poll_interval
+                _close_pools(getinfo_pool, build_pool)
+                getinfo_pool, build_pool = _create_pools(config_options)
+                logger.info("Configuration reloaded, %d packages" %
+                            len(packages))
+
+            poll_packages = [p for p in packages
+                             if not pkg_names or p['name'] in names]
+            due = scheduler.due(poll_packages)
+            if due:
+                logger.info("Polling %d packages" % len(due))
+                session = getSession(config_options.database_connection)
+                try:
+                    exit_code = process_packages(options, config_options,
+                                                 packages, due, session,
+                                                 getinfo_pool=getinfo_pool,
+                                                 build_pool=build_pool)
+                except Exception as e:
+                    logger.exception("Error processing packages: %s" % e)
+                    exit_code = 1
+                scheduler.polled(poll_packages, due)
+            # Check for signals at least every few seconds
+            scheduler.wait(poll_packages, timeout=5)
+    finally:
+        if trigger_server is not None:
+            trigger_server.stop()
+        _close_pools(getinfo_pool, build_pool)
+    return exit_code
+
+
+# Process a list of packages: find the commits to build, build them, and
+# update the repositories and reports. If pkg_names is set, only those
+# packages are checked for new commits. Pools can be passed to reuse existing
+# worker processes across calls.
+def process_packages(options, config_options, packages, pkg_names, session,
+                     getinfo_pool=None, build_pool=None):
+    if pkg_names:
+        pkg_name = pkg_names[0]
+    else:
+        pkg_name = None
+
     # when we run a program instead of building we don't care about
     # the commits, we just want to run once per package
     if options.run:
         options.head_only = True
+    # Let the driver fetch any data shared by all packages once, before the
+    # driver object is passed to the getinfo workers
+    pkginfo.prefetch()
     # Build a list of commits we need to process
     toprocess = []
     skipped_list = []
 
-    if not pkg_name and not pkg_names:
-        pool = multiprocessing.Pool()   # This will use all the system cpus
+    if not pkg_name and not pkg_names or getinfo_pool is not None:
+        if getinfo_pool is None:
+            # This will use all the system cpus
+            pool = multiprocessing.Pool()
+        else:
+            pool = getinfo_pool
         # Use functools.partial to iterate on the packages to process,
         # while keeping a few options fixed
         getinfo_wrapper = partial(getinfo, local=options.local,
@@ -326,25 +578,28 @@ def main():
                                   database_connection,
                                   branch=config_options.source,
                                   pkginfo=pkginfo)
-        iterator = pool.imap(getinfo_wrapper, packages)
+        names = set(pkg_names or [])
+        iterator = pool.imap(getinfo_wrapper,
+                             [p for p in packages
+                              if not pkg_names or p['name'] in names])
         while True:
             try:
                 project_toprocess, updated_pkg, skipped = iterator.next()
-                for package in packages:
-                    if package['name'] == updated_pkg['name']:
-                        if package['upstream'] == 'Unknown':
-                            package['upstream'] = updated_pkg['upstream']
-                            logger.debug(
-                                "Updated upstream for package %s to %s",
-                                package['name'], package['upstream'])
-                        break
+                package = getpackage(packages, updated_pkg['name'])
+                if package and package['upstream'] == 'Unknown':
+                    package['upstream'] = updated_pkg['upstream']
+                    logger.debug("Updated upstream for package %s to %s",
+                                 package['name'], package['upstream'])
                 if skipped:
                     skipped_list.append(updated_pkg['name'])
-                _add_commits(project_toprocess, toprocess, options, session)
+                _add_commits(project_toprocess, toprocess, options, session,
+                             coalesce_policy=getcoalescepolicy(
+                                 updated_pkg, config_options.coalesce_policy))
             except StopIteration:
                 break
-        pool.close()
-        pool.join()
+        if getinfo_pool is None:
+            pool.close()
+            pool.join()
     else:
         for package in packages:
             if package['name'] in pkg_names:
@@ -357,7 +612,9 @@ def main():
                     pkginfo=pkginfo)
                 if skipped:
                     skipped_list.append(package['name'])
-                _add_commits(project_toprocess, toprocess, options, session)
+                _add_commits(project_toprocess, toprocess, options, session,
+                             coalesce_policy=getcoalescepolicy(
+                                 package, config_options.coalesce_policy))
     closeSession(session)   # Close session, will reopen during post_build
 
     # Store skip list
@@ -370,7 +627,10 @@ def main():
 
     # Check if there is any commit at all to process
     if len(toprocess) == 0:
-        if not pkg_name:
+        if options.daemon:
+            # The daemon polls the packages all the time
+            logger.debug("No commits to build.")
+        elif not pkg_name:
             # Use a shorter message if this was a full run
             logger.info("No commits to build.")
         else:
@@ -444,9 +704,17 @@ def main():
         toprocess.sort()
 
     exit_code = 0
+    processed = []
+    # Stop dispatching builds while the infrastructure is failing
+    breaker = CircuitBreaker.from_config(config_options)
+    # Build the retry policy before the first build result, to warn about
+    # any retry_limits pattern that will never be used
+    get_retry_policy(config_options)
     if options.sequential is True:
         toprocess_copy = deepcopy(toprocess)
         for commit in toprocess:
+            if not breaker.wait():
+                break
             status = build_worker(packages, commit, run_cmd=options.run,
                                   build_env=options.build_env,
                                   dev_mode=options.dev,
@@ -477,14 +745,24 @@ def main():
                                                   consistent=consistent,
                                                   failures=failures)
                 closeSession(session)
+            processed.append(status[0])
+            breaker.record(status[0])
 
             if exit_value != 0:
                 exit_code = exit_value
             if options.stop and exit_code != 0:
+                if not finish_sync(packages, config_options,
+                                   options.build_env):
+                    exit_code = 1
+                if options.profile:
+                    print_profile(processed)
                 return exit_code
     else:
         # Setup multiprocessing pool
-        pool = multiprocessing.Pool(config_options.workers)
+        if build_pool is None:
+            pool = multiprocessing.Pool(config_options.workers)
+        else:
+            pool = build_pool
         # Use functools.partial to iterate on the commits to process,
         # while keeping a few options fixed
         build_worker_wrapper = partial(build_worker, packages,
@@ -495,7 +773,14 @@ def main():
                                        order=options.order, sequential=False,
                                        config_options=config_options,
                                        pkginfo=pkginfo)
-        iterator = pool.imap(build_worker_wrapper, toprocess)
+        # A shared pool is always fed through the gate, so the builds not
+        # dispatched yet can be dropped when stopping
+        if breaker.enabled or build_pool is not None:
+            iterator = pool.imap(build_worker_wrapper,
+                                 breaker.gate(toprocess,
+                                              config_options.workers * 2))
+        else:
+            iterator = pool.imap(build_worker_wrapper, toprocess)
 
         while True:
             try:
@@ -527,14 +812,34 @@ def main():
                         consistent=consistent,
                         failures=failures)
                     closeSession(session)
+                processed.append(status[0])
+                breaker.record(status[0])
+                breaker.done()
                 if exit_value != 0:
                     exit_code = exit_value
                 if options.stop and exit_code != 0:
+                    breaker.stop()
+                    _stop_builds(pool, build_pool, iterator, breaker)
+                    if not finish_sync(packages, config_options,
+                                       options.build_env):
+                        exit_code = 1
+                    if options.profile:
+                        print_profile(processed)
                     return exit_code
             except StopIteration:
                 break
-        pool.close()
-        pool.join()
+        if build_pool is None:
+            pool.close()
+            pool.join()
+
+    if breaker.skipped and exit_code != 1:
+        # The skipped commits will be built in the next run
+        exit_code = 2
+
+    # Wait for the queued transfers before the final reports, so they show
+    # the commits that could not be synchronized as failed
+    if not finish_sync(packages, config_options, options.build_env):
+        exit_code = 1
 
     # If we were bootstrapping, set the packages that required it to RETRY
     session = getSession(config_options.database_connection)
@@ -547,11 +852,44 @@ def main():
     genreports(packages, options.head_only, session, [])
     closeSession(session)
 
-    if options.dev:
-        os.remove(tmpdb_path)
+    if options.profile:
+        print_profile(processed)
     return exit_code
 
 
+# Stop the builds still running after a failure with --stop. A pool created
+# for this run is terminated. A shared pool is kept for the next cycle, so we
+# wait for the builds already dispatched to it, and discard their results,
+# the commits will be built again.
+def _stop_builds(pool, build_pool, iterator, breaker):
+    if build_pool is None:
+        pool.terminate()
+        pool.join()
+        return
+    for status in iterator:
+        logger.info("Discarding the result of %s commit %s" %
+                    (status[0].project_name, status[0].commit_hash))
+        breaker.done()
+
+
+# Print the number of builds, total, mean and maximum time spent on each
+# build phase for a list of commits
+def print_profile(commits):
+    durations = {}
+    for commit in commits:
+        for phase, duration in get_timings(commit).items():
+            durations.setdefault(phase, []).append(duration)
+    phases = [phase for phase in BUILD_PHASES if phase in durations]
+    phases.extend(sorted(set(durations) - set(BUILD_PHASES)))
+    print("{:<12} {:>6} {:>10} {:>10} {:>10}".format(
+        'Phase', 'Builds', 'Total (s)', 'Mean (s)', 'Max (s)'))
+    for phase in phases:
+        values = durations[phase]
+        print("{:<12} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            phase, len(values), sum(values), sum(values) / len(values),
+            max(values)))
+
+
 def process_build_result(status, *args, **kwargs):
     if status[0].type == "rpm":
         return process_build_result_rpm(status, *args, **kwargs)
@@ -565,7 +903,7 @@ def process_build_result_container(
         status, packages, session, packages_to_process,
         dev_mode=False, run_cmd=False, stop=False,
         build_env=None, head_only=False, consistent=False,
-        failures=0):
+        failures=0, reports=True):
     raise NotImplementedError()
 
 
@@ -573,7 +911,7 @@ def process_build_result_rpm(
         status, packages, session, packages_to_process,
         dev_mode=False, run_cmd=False, stop=False,
         build_env=None, head_only=False, consistent=False,
-        failures=0):
+        failures=0, reports=True):
     config_options = getConfigOptions()
     commit = status[0]
     built_rpms = status[1]
@@ -615,13 +953,25 @@ def process_build_result_rpm(
             with open(logfile, "w") as fp:
                 fp.write(str(exception))
 
-        if (isknownerror(logfile) and
-            (timesretried(project, session, commit_hash, commit.distro_hash) <
-             config_options.maxretries)):
+        known_error = find_known_error(
+            logfile, get_known_errors(config_options.known_errors_file))
+        retries = 0
+        if known_error:
+            record_known_error(datadir, known_error)
+            retries = timesretried(project, session, commit_hash,
+                                   commit.distro_hash)
+        retry_policy = get_retry_policy(config_options)
+        if retry_policy.should_retry(known_error, retries):
             logger.exception("Known error building packages for %s,"
                              " will retry later" % project)
             commit.status = "RETRY"
             commit.notes = str(exception)
+            commit.next_retry_at = retry_policy.next_retry_at(retries)
+            if commit.next_retry_at:
+                logger.info("Not retrying %s before %s" %
+                            (project, time.strftime(
+                                '%Y-%m-%d %H:%M:%S',
+                                time.localtime(commit.next_retry_at))))
             # do not switch from an error exit code to a retry
             # exit code
             if exit_code != 1:
@@ -674,11 +1024,14 @@ def process_build_result_rpm(
     # Add commit to the session
     session.add(commit)
 
-    genreports(packages, head_only, session, packages_to_process)
+    if reports:
+        with timed_phase(commit, 'reports'):
+            genreports(packages, head_only, session, packages_to_process)
     # Export YAML file containing commit metadata
     export_commit_yaml(commit)
     try:
-        sync_repo(commit)
+        with timed_phase(commit, 'rsync'):
+            sync_repo(commit)
     except Exception as e:
         logger.error('Repo sync failed for project %s' % project)
         consistent = False  # If we were consistent before, we are not anymore
@@ -700,6 +1053,7 @@ def process_build_result_rpm(
                     logger.error('Unable to create review '
                                  'see review.log')
 
+    record_timings(config_options.datadir, commit)
     session.commit()
 
     # Generate the current and consistent symlinks
@@ -754,6 +1108,51 @@ def process_build_result_rpm(
     return exit_code
 
 
+def finish_sync(packages, config_options, build_env=None, session=None):
+    # Wait for the repos queued for synchronization when rsync_workers is
+    # set. The commits whose repo could not be synchronized are marked as
+    # failed, the same way process_build_result does when rsync_workers is
+    # not set. Return False if any transfer failed
+    if wait_for_sync():
+        return True
+    logger.error('Failed to rsync some repos to %s' %
+                 config_options.rsyncdest)
+    failed = get_failed_syncs()
+    if not failed:
+        return False
+    own_session = session is None
+    if own_session:
+        session = getSession(config_options.database_connection)
+    for commit in session.query(Commit).filter(
+            Commit.status == 'SUCCESS',
+            Commit.commit_hash.in_([key[1] for key in failed])):
+        if commit_key(commit) not in failed:
+            continue
+        logger.error('Repo sync failed for project %s' % commit.project_name)
+        commit.status = 'FAILED'
+        commit.notes = ('Failed to rsync the repo to %s' %
+                        config_options.rsyncdest)
+        session.add(commit)
+        project_info = session.query(Project).filter(
+            Project.project_name == commit.project_name).first()
+        if not project_info:
+            project_info = Project(project_name=commit.project_name,
+                                   last_email=0)
+        if not project_info.suppress_email():
+            sendnotifymail(packages, commit)
+            project_info.sent_email()
+            session.add(project_info)
+        if config_options.gerrit is not None:
+            try:
+                submit_review(commit, packages, list(build_env or []))
+            except Exception:
+                logger.error('Unable to create review see review.log')
+    session.commit()
+    if own_session:
+        closeSession(session)
+    return False
+
+
 def export_commit_yaml(commit):
     config_options = getConfigOptions()
     # Export YAML file containing commit metadata
@@ -786,6 +1185,7 @@ def post_build_rpm(status, packages, session, build_repo=True):
     yumrepodir = os.path.join("repos", commit.getshardedcommitdir())
     yumrepodir_abs = os.path.join(datadir, yumrepodir)
 
+    post_build_start = time.time()
     shafile = open(os.path.join(yumrepodir_abs, "versions.csv"), "w")
     shafile.write("Project,Source Repo,Source Sha,Dist Repo,Dist Sha,"
                   "Status,Last Success Timestamp,Component,Extended Sha,"
@@ -810,6 +1210,7 @@ def post_build_rpm(status, packages, session, build_repo=True):
                                   with_status="SUCCESS",
                                   type=commit.type).first()
         last_processed = getCommits(session, project=otherprojectname,
+                                    without_status="SKIPPED",
                                     type=commit.type).first()
 
         if last_success:
@@ -837,6 +1238,7 @@ def post_build_rpm(status, packages, session, build_repo=True):
         else:
             failures += 1
     shafile.close()
+    add_timing(commit, 'post_build', time.time() - post_build_start)
 
     if build_repo:
         # Use createrepo_c when available
@@ -846,10 +1248,11 @@ def post_build_rpm(status, packages, session, build_repo=True):
         except ImportError:
             pass
 
-        if config_options.include_srpm_in_repo:
-            sh.createrepo(yumrepodir_abs)
-        else:
-            sh.createrepo('-x', '*.src.rpm', yumrepodir_abs)
+        with timed_phase(commit, 'createrepo'):
+            if config_options.include_srpm_in_repo:
+                sh.createrepo(yumrepodir_abs)
+            else:
+                sh.createrepo('-x', '*.src.rpm', yumrepodir_abs)
 
         with open(os.path.join(
                 yumrepodir_abs, "%s.repo" % config_options.reponame),
@@ -900,15 +1303,19 @@ def getinfo(package, local=False, dev_mode=False, head_only=False,
                 # In any case, we just want to build the last commit, if any
                 head_only = True
 
+    start = time.time()
     project_toprocess, skipped = pkginfo.getinfo(
         project=project, package=package,
         since=since, local=local,
         dev_mode=dev_mode, type=type)
+    refresh_time = time.time() - start
 
     closeSession(session)
     # If since == -1, then we only want to trigger a build for the
     # most recent change
     if since == "-1" or head_only:
         del project_toprocess[:-1]
+    for commit in project_toprocess:
+        add_timing(commit, 'refresh', refresh_time)
 
     return project_toprocess, package, skipped
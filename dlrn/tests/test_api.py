@@ -73,12 +73,13 @@ def mocked_session(*args, **kwargs):
     return wrapper
 
 
-def mocked_get(url, timeout=None):
+def mocked_get(url, timeout=None, **kwargs):
     mock_resp = mock.Mock()
     with open('./dlrn/tests/samples/commits_remote.yaml', 'rb') as fp:
         mock_resp.status_code = 200
         mock_resp.content = fp.read()
         mock_resp.text = mock_resp.content.decode('utf-8')
+        mock_resp.iter_content.return_value = [mock_resp.content]
     return mock_resp
 
 
@@ -765,6 +766,104 @@ class TestPromoteBatch(DLRNAPITestCase):
         self.assertEqual(sl_mock.call_args_list, expected)
         self.assertEqual(ag_mock.call_count, 1)
 
+    @mock.patch('dlrn.drivers.rdoinfo.RdoInfoDriver.getpackages',
+                return_value=[])
+    @mock.patch('dlrn.api.dlrn_api.aggregate_repo_files', side_effect=mock_ag)
+    @mock.patch('dlrn.api.dlrn_api._get_config_options', side_effect=mock_opt)
+    @mock.patch('os.symlink')
+    def test_promote_batch_several_names_cmp(self, sl_mock, co_mock, ag_mock,
+                                             gp_mock, db2_mock, db_mock):
+        req_data = json.dumps([dict(commit_hash='1c67b1ab8c6fe273d4e'
+                                                '175a14f0df5d3cbbd0edc',
+                                    distro_hash='8170b8686c38bafb6021'
+                                                'd998e2fb268ab26ccf65',
+                                    promote_name='foo-ci'),
+                               dict(commit_hash='17234e9ab9dfab4cf560'
+                                                '0f67f1d24db5064f1025',
+                                    distro_hash='024e24f0cf4366c2290c'
+                                                '22f24e42de714d1addd1',
+                                    promote_name='bar-ci'),
+                               dict(commit_hash='17234e9ab9dfab4cf560'
+                                                '0f67f1d24db5064f1025',
+                                    distro_hash='024e24f0cf4366c2290c'
+                                                '22f24e42de714d1addd1',
+                                    promote_name='foo-ci')])
+        response = self.app.post('/api/promote-batch',
+                                 data=req_data,
+                                 headers=self.headers,
+                                 content_type='application/json')
+
+        # The symlinks are grouped by promote_name
+        expected = [mock.call('1c/67/1c67b1ab8c6fe273d4e175a'
+                              '14f0df5d3cbbd0edc_8170b868',
+                              '/tmp/component/None/foo-ci'),
+                    mock.call('17/23/17234e9ab9dfab4cf5600f67f1d24db5064'
+                              'f1025_024e24f0',
+                              '/tmp/component/tripleo/foo-ci'),
+                    mock.call('17/23/17234e9ab9dfab4cf5600f67f1d24db5064'
+                              'f1025_024e24f0',
+                              '/tmp/component/tripleo/bar-ci')]
+
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(data['promote_name'], 'foo-ci')
+        self.assertEqual(data['aggregate_hash'], 'abc123')
+        self.assertEqual(sl_mock.call_args_list, expected)
+        # Each aggregate is computed once
+        self.assertEqual([call[0][0] for call in ag_mock.call_args_list],
+                         ['foo-ci', 'bar-ci'])
+
+    @mock.patch('dlrn.drivers.rdoinfo.RdoInfoDriver.getpackages',
+                return_value=[])
+    @mock.patch('dlrn.api.dlrn_api.aggregate_repo_files',
+                side_effect=['abc123', Exception('aggregation failed')])
+    @mock.patch('dlrn.api.dlrn_api._get_config_options', side_effect=mock_opt)
+    @mock.patch('os.readlink', return_value='ab/cd/abcd/delorean.repo')
+    @mock.patch('os.path.islink', return_value=True)
+    @mock.patch('os.remove')
+    @mock.patch('os.symlink')
+    def test_promote_batch_rollback_aggregate(self, sl_mock, rm_mock,
+                                              il_mock, rl_mock, co_mock,
+                                              ag_mock, gp_mock, db2_mock,
+                                              db_mock):
+        req_data = json.dumps([dict(commit_hash='1c67b1ab8c6fe273d4e'
+                                                '175a14f0df5d3cbbd0edc',
+                                    distro_hash='8170b8686c38bafb6021'
+                                                'd998e2fb268ab26ccf65',
+                                    promote_name='foo-ci'),
+                               dict(commit_hash='17234e9ab9dfab4cf560'
+                                                '0f67f1d24db5064f1025',
+                                    distro_hash='024e24f0cf4366c2290c'
+                                                '22f24e42de714d1addd1',
+                                    promote_name='bar-ci')])
+        response = self.app.post('/api/promote-batch',
+                                 data=req_data,
+                                 headers=self.headers,
+                                 content_type='application/json')
+
+        self.assertEqual(response.status_code, 500)
+        datadir = ag_mock.call_args_list[0][0][1]
+        # The top-level files of foo-ci, aggregated before the failure,
+        # are restored too
+        restored = [call[0][1] for call in sl_mock.call_args_list[2:]]
+        for filename in ['delorean.repo', 'delorean.repo.md5',
+                         'versions.csv']:
+            self.assertIn(os.path.join(datadir, 'repos/foo-ci', filename),
+                          restored)
+            self.assertIn(os.path.join(datadir, 'repos/bar-ci', filename),
+                          restored)
+        # The commit symlinks are rolled back last
+        self.assertEqual(rm_mock.call_args_list[-2:],
+                         [mock.call('/tmp/component/tripleo/bar-ci'),
+                          mock.call('/tmp/component/None/foo-ci')])
+
+    def test_promote_batch_empty(self, db2_mock, db_mock):
+        response = self.app.post('/api/promote-batch',
+                                 data=json.dumps([]),
+                                 headers=self.headers,
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
 
 @mock.patch('dlrn.api.dlrn_api.getSession', side_effect=mocked_session())
 @mock.patch('dlrn.api.drivers.dbauthentication.getSession',
@@ -888,7 +987,7 @@ class TestRemoteImport(DLRNAPITestCase):
     @mock.patch('dlrn.drivers.rdoinfo.RdoInfoDriver.getpackages')
     @mock.patch.object(sh.Command, '__call__', autospec=True)
     @mock.patch('dlrn.remote.post_build')
-    @mock.patch('dlrn.remote.requests.get', side_effect=mocked_get)
+    @mock.patch('dlrn.remote.requests.Session.get', side_effect=mocked_get)
     def test_post_remote_import_success(self, get_mock, build_mock, sh_mock,
                                         db2_mock, db_mock, gp_mock, sl_mock,
                                         rn_mock):
@@ -907,6 +1006,77 @@ class TestRemoteImport(DLRNAPITestCase):
         data = json.loads(response.data)
         self.assertEqual(data['repo_url'], 'http://example.com/1/')
 
+    def test_post_remote_import_batch_needs_auth(self, db2_mock, db_mock):
+        response = self.app.post('/api/remote/import/batch')
+        self.assertEqual(response.status_code, 401)
+
+    def test_post_remote_import_batch_empty(self, db2_mock, db_mock):
+        req_data = json.dumps(dict(repo_urls=[]))
+        header = {'Authorization': 'Basic %s' % (
+                  base64.b64encode(b'foo:bar').decode('ascii'))}
+
+        response = self.app.post('/api/remote/import/batch',
+                                 data=req_data,
+                                 headers=header,
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('os.rename')
+    @mock.patch('os.symlink')
+    @mock.patch('dlrn.drivers.rdoinfo.RdoInfoDriver.getpackages')
+    @mock.patch.object(sh.Command, '__call__', autospec=True)
+    @mock.patch('dlrn.remote.post_build')
+    @mock.patch('dlrn.remote.requests.Session.get', side_effect=mocked_get)
+    def test_post_remote_import_batch_success(self, get_mock, build_mock,
+                                              sh_mock, db2_mock, db_mock,
+                                              gp_mock, sl_mock, rn_mock):
+        repo_urls = ['http://example.com/1/', 'http://example.com/2/']
+        req_data = json.dumps(dict(repo_urls=repo_urls))
+
+        header = {'Authorization': 'Basic %s' % (
+                  base64.b64encode(b'foo:bar').decode('ascii'))}
+
+        response = self.app.post('/api/remote/import/batch',
+                                 data=req_data,
+                                 headers=header,
+                                 content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['repo_urls'], repo_urls)
+
+    @mock.patch('os.rename')
+    @mock.patch('os.symlink')
+    @mock.patch('dlrn.drivers.rdoinfo.RdoInfoDriver.getpackages')
+    @mock.patch.object(sh.Command, '__call__', autospec=True)
+    @mock.patch('dlrn.remote.post_build')
+    @mock.patch('dlrn.remote.requests.Session.get')
+    def test_post_remote_import_batch_failed_repo(self, get_mock, build_mock,
+                                                  sh_mock, db2_mock, db_mock,
+                                                  gp_mock, sl_mock, rn_mock):
+        def _get(url, timeout=None, **kwargs):
+            if url.startswith('http://example.com/1/'):
+                raise IOError('down')
+            return mocked_get(url, timeout=timeout, **kwargs)
+
+        get_mock.side_effect = _get
+        repo_urls = ['http://example.com/1/', 'http://example.com/2/']
+        req_data = json.dumps(dict(repo_urls=repo_urls))
+
+        header = {'Authorization': 'Basic %s' % (
+                  base64.b64encode(b'foo:bar').decode('ascii'))}
+
+        response = self.app.post('/api/remote/import/batch',
+                                 data=req_data,
+                                 headers=header,
+                                 content_type='application/json')
+
+        # The second repo is imported, and the first one reported
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('http://example.com/1/ (down)',
+                      json.loads(response.data)['message'])
+        self.assertTrue(build_mock.called)
+
 
 @mock.patch('dlrn.api.dlrn_api.render_template', side_effect=' ')
 @mock.patch('dlrn.api.dlrn_api.getSession', side_effect=mocked_session())
@@ -70,6 +70,8 @@ class TestBuild(base.TestCase):
             del os.environ['RELEASE_NUMBERING']
         if 'RELEASE_MINOR' in os.environ:
             del os.environ['RELEASE_MINOR']
+        if 'DLRN_WARM_CHROOT' in os.environ:
+            del os.environ['DLRN_WARM_CHROOT']
 
     @mock.patch('os.listdir', side_effect=mocked_listdir)
     def test_build_rpm_wrapper(self, ld_mock, sh_mock, env_mock, rc_mock):
@@ -87,6 +89,8 @@ class TestBuild(base.TestCase):
         self.assertEqual(rc_mock.call_count, 1)
         self.assertTrue(os.path.exists(os.path.join(self.config.datadir,
                                                     "dlrn-1.cfg")))
+        self.assertEqual(sorted(utils.get_timings(commit)),
+                         ['build', 'preprocess', 'srpm'])
 
     @mock.patch('dlrn.build.fetch_remote_file')
     @mock.patch('os.listdir', side_effect=mocked_listdir)
@@ -135,6 +139,22 @@ class TestBuild(base.TestCase):
         self.assertEqual(os.environ['RELEASE_NUMBERING'], 'minor.date.hash')
         self.assertEqual(os.environ['RELEASE_MINOR'], '2')
 
+    @mock.patch('os.listdir', side_effect=mocked_listdir)
+    def test_build_rpm_wrapper_warm_chroot(self, ld_mock, sh_mock, env_mock,
+                                           rc_mock):
+        self.configfile.set('DEFAULT', 'build_driver',
+                            'dlrn.drivers.mockdriver.MockBuildDriver')
+        self.configfile.set('mockbuild_driver', 'warm_chroot', 'True')
+        self.config = ConfigOptions(self.configfile)
+        commit = db.getCommits(self.session)[-1]
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        self.assertEqual(os.environ['DLRN_WARM_CHROOT'], '1')
+        self.config.warm_chroot = False
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        self.assertNotIn('DLRN_WARM_CHROOT', os.environ)
+
     @mock.patch('os.listdir', side_effect=mocked_listdir)
     def test_build(self, ld_mock, sh_mock, env_mock, rc_mock):
         self.configfile.set('DEFAULT', 'build_driver',
@@ -158,16 +178,68 @@ class TestBuild(base.TestCase):
         shutil.copyfile(os.path.join("scripts", "centos-stream-9.cfg"),
                         os.path.join(configdir, "centos9.cfg"))
         commit = db.getCommits(self.session)[-1]
-        expected = [mock.call('%s/centos9.cfg' % configdir,
-                              '%s/dlrn-1.cfg.new' % self.config.datadir),
-                    mock.call('%s/dlrn-1.cfg.new' % self.config.datadir,
-                              '%s/dlrn-1.cfg' % self.config.datadir)]
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        with open('%s/dlrn-1.cfg' % self.config.datadir) as fp:
+            contents = fp.read()
+        self.assertIn("config_opts['root'] = 'dlrn-centos9stream-x86_64-1'",
+                      contents)
 
-        with mock.patch('shutil.copyfile',
-                        side_effect=shutil.copyfile) as cp_mock:
+    @mock.patch('dlrn.build.fetch_remote_file')
+    @mock.patch('os.listdir', side_effect=mocked_listdir)
+    def test_build_rpm_wrapper_mock_config_unchanged(self, ld_mock, url_mock,
+                                                     sh_mock, env_mock,
+                                                     rc_mock):
+        self.configfile.set('DEFAULT', 'build_driver',
+                            'dlrn.drivers.mockdriver.MockBuildDriver')
+        self.config = ConfigOptions(self.configfile)
+        url_mock.return_value = ['[deps]\n', 'baseurl=http://deps\n']
+        commit = db.getCommits(self.session)[-1]
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        cfg = '%s/dlrn-1.cfg' % self.config.datadir
+        with open(cfg) as fp:
+            contents = fp.read()
+        self.assertIn('baseurl=http://deps\n\n"""', contents)
+        self.assertTrue(contents.endswith('\n"""'))
+
+        with mock.patch('dlrn.build._generate_mock_config') as gen_mock:
             build_rpm_wrapper(commit, False, False, False, None, True,
                               self.config, FakePkgInfo())
-            self.assertEqual(expected, cp_mock.call_args_list)
+            self.assertEqual(gen_mock.call_count, 0)
+
+        # The deps repo changed, so the configuration is regenerated
+        url_mock.return_value = ['[deps]\n', 'baseurl=http://deps2\n']
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        with open(cfg) as fp:
+            self.assertIn('baseurl=http://deps2\n\n"""', fp.read())
+
+    @mock.patch('dlrn.build.time', return_value=1000)
+    @mock.patch('dlrn.build.fetch_remote_file')
+    @mock.patch('os.listdir', side_effect=mocked_listdir)
+    def test_build_rpm_wrapper_deps_cache_ttl(self, ld_mock, url_mock,
+                                              time_mock, sh_mock, env_mock,
+                                              rc_mock):
+        self.configfile.set('DEFAULT', 'build_driver',
+                            'dlrn.drivers.mockdriver.MockBuildDriver')
+        self.configfile.set('DEFAULT', 'deps_cache_ttl', '60')
+        self.config = ConfigOptions(self.configfile)
+        url_mock.return_value = ['[deps]\n']
+        commit = db.getCommits(self.session)[-1]
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        expected = [mock.call('file://%s/delorean-deps.repo' %
+                              self.configfile.get('DEFAULT', 'datadir'),
+                              cache_dir=self.config.datadir)]
+        self.assertEqual(expected, url_mock.call_args_list)
+        # Once the TTL expires, the file is fetched again
+        time_mock.return_value = 1061
+        build_rpm_wrapper(commit, False, False, False, None, True,
+                          self.config, FakePkgInfo())
+        self.assertEqual(url_mock.call_count, 2)
 
     @mock.patch('dlrn.drivers.kojidriver.KojiBuildDriver.build_package')
     @mock.patch('os.listdir', side_effect=mocked_listdir)
@@ -0,0 +1,121 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import requests_mock
+import shutil
+import tempfile
+import threading
+
+from dlrn import circuit_breaker
+from dlrn import db
+from dlrn.tests import base
+
+
+def _commit(status):
+    return db.Commit(project_name='foo', commit_hash='1234',
+                     distro_hash='5678', status=status)
+
+
+class TestProbeUrl(base.TestCase):
+    @requests_mock.Mocker()
+    def test_probe_http(self, req_mock):
+        req_mock.head('http://example.com/delorean-deps.repo',
+                      status_code=200)
+        req_mock.head('http://example.com/repos', status_code=403)
+        req_mock.head('http://example.com/down', status_code=503)
+        self.assertTrue(circuit_breaker.probe_url(
+            'http://example.com/delorean-deps.repo'))
+        self.assertTrue(circuit_breaker.probe_url('http://example.com/repos'))
+        self.assertFalse(circuit_breaker.probe_url('http://example.com/down'))
+
+    @requests_mock.Mocker()
+    def test_probe_http_error(self, req_mock):
+        req_mock.head('http://example.com/repos',
+                      exc=circuit_breaker.requests.exceptions.ConnectTimeout)
+        self.assertFalse(circuit_breaker.probe_url('http://example.com/repos'))
+
+    def test_probe_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.assertTrue(circuit_breaker.probe_url('file://%s' % tmpdir))
+        shutil.rmtree(tmpdir)
+        self.assertFalse(circuit_breaker.probe_url('file://%s' % tmpdir))
+
+
+class TestCircuitBreaker(base.TestCase):
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        self.breaker = circuit_breaker.CircuitBreaker(
+            2, endpoints=['http://example.com/repos'], probe_interval=0,
+            timeout=0)
+
+    def test_disabled(self):
+        breaker = circuit_breaker.CircuitBreaker(0)
+        for i in range(5):
+            breaker.record(_commit('RETRY'))
+        self.assertFalse(breaker.open)
+        self.assertTrue(breaker.wait())
+
+    def test_trip(self):
+        self.breaker.record(_commit('RETRY'))
+        self.breaker.record(_commit('SUCCESS'))
+        self.breaker.record(_commit('RETRY'))
+        self.assertFalse(self.breaker.open)
+        self.breaker.record(_commit('RETRY'))
+        self.assertTrue(self.breaker.open)
+
+    @mock.patch('dlrn.circuit_breaker.probe_url', return_value=True)
+    def test_wait_resume(self, probe_mock):
+        self.breaker.open = True
+        self.assertTrue(self.breaker.wait())
+        self.assertFalse(self.breaker.open)
+        probe_mock.assert_called_with('http://example.com/repos')
+        # A single known error pauses the builds again
+        self.breaker.record(_commit('RETRY'))
+        self.assertTrue(self.breaker.open)
+
+    @mock.patch('dlrn.circuit_breaker.probe_url',
+                side_effect=[False, False, True])
+    def test_wait_backoff(self, probe_mock):
+        self.breaker.timeout = 60
+        self.breaker.open = True
+        self.assertTrue(self.breaker.wait())
+        self.assertEqual(probe_mock.call_count, 3)
+
+    @mock.patch('dlrn.circuit_breaker.probe_url', return_value=False)
+    def test_wait_timeout(self, probe_mock):
+        self.breaker.open = True
+        self.assertFalse(self.breaker.wait())
+        self.assertTrue(self.breaker.skipped)
+        # Once skipped, no more builds are dispatched
+        self.assertEqual(list(self.breaker.gate(['a', 'b'], 1)), [])
+
+    def test_gate(self):
+        gate = self.breaker.gate(['a', 'b', 'c'], 2)
+        self.assertEqual(next(gate), 'a')
+        self.assertEqual(next(gate), 'b')
+        # The third commit waits for the result of a previous one
+        result = []
+        thread = threading.Thread(target=lambda: result.extend(gate))
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(result, [])
+        self.breaker.done()
+        thread.join()
+        self.assertEqual(result, ['c'])
+
+    def test_gate_stop(self):
+        gate = self.breaker.gate(['a', 'b'], 1)
+        self.assertEqual(next(gate), 'a')
+        self.breaker.stop()
+        self.assertEqual(list(gate), [])
+        self.assertFalse(self.breaker.skipped)
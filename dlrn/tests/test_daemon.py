@@ -0,0 +1,128 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import mock
+import os
+import shutil
+import signal
+import socket
+import tempfile
+
+from dlrn.config import ConfigOptions
+from dlrn.daemon import PollScheduler
+from dlrn.daemon import TriggerServer
+from dlrn import shell
+from dlrn.tests import base
+
+from six.moves import configparser
+
+
+class TestPollScheduler(base.TestCase):
+    def setUp(self):
+        super(TestPollScheduler, self).setUp()
+        self.packages = [{'name': 'foo'},
+                         {'name': 'bar', 'poll-interval': '60'}]
+        self.scheduler = PollScheduler(300)
+
+    def test_all_due_first_time(self):
+        self.assertEqual(self.scheduler.due(self.packages, now=1000),
+                         ['foo', 'bar'])
+
+    def test_per_package_interval(self):
+        self.scheduler.polled(self.packages, ['foo', 'bar'], now=1000)
+        self.assertEqual(self.scheduler.due(self.packages, now=1030), [])
+        self.assertEqual(self.scheduler.due(self.packages, now=1060),
+                         ['bar'])
+        self.assertEqual(self.scheduler.due(self.packages, now=1300),
+                         ['foo', 'bar'])
+
+    def test_trigger(self):
+        self.scheduler.polled(self.packages, ['foo', 'bar'], now=1000)
+        self.scheduler.trigger('foo')
+        self.scheduler.trigger('unknown')
+        self.assertEqual(self.scheduler.due(self.packages, now=1001),
+                         ['foo'])
+        # Triggers are only used once
+        self.assertEqual(self.scheduler.due(self.packages, now=1002), [])
+
+    def test_wait_keeps_trigger(self):
+        self.scheduler.polled(self.packages, ['foo', 'bar'], now=1000)
+        self.scheduler.trigger('bar')
+        self.scheduler.wait(self.packages, timeout=5)
+        self.assertEqual(self.scheduler.due(self.packages, now=1001),
+                         ['bar'])
+
+
+class TestTriggerServer(base.TestCase):
+    def setUp(self):
+        super(TestTriggerServer, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dlrn.sock')
+        self.scheduler = PollScheduler(300)
+        self.server = TriggerServer(self.path, self.scheduler)
+        self.server.start()
+
+    def tearDown(self):
+        super(TestTriggerServer, self).tearDown()
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_trigger(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        client.sendall(b'foo\n')
+        self.assertEqual(client.recv(3), b'OK\n')
+        client.close()
+        self.scheduler.polled([{'name': 'foo'}], ['foo'], now=1000)
+        self.assertEqual(self.scheduler.due([{'name': 'foo'}], now=1001),
+                         ['foo'])
+
+
+@mock.patch('dlrn.shell.multiprocessing.Pool')
+@mock.patch('dlrn.shell.getSession')
+class TestRunDaemon(base.TestCase):
+    def setUp(self):
+        super(TestRunDaemon, self).setUp()
+        self.cp = configparser.RawConfigParser()
+        self.cp.read("projects.ini")
+        self.config = ConfigOptions(self.cp)
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--sequential', action="store_true")
+        self.options = parser.parse_args([])
+        self.packages = [{'name': 'foo'}, {'name': 'bar'}]
+        self.orig_handlers = [signal.getsignal(s) for s in
+                              (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)]
+
+    def tearDown(self):
+        super(TestRunDaemon, self).tearDown()
+        for sig, handler in zip((signal.SIGHUP, signal.SIGTERM,
+                                 signal.SIGINT), self.orig_handlers):
+            signal.signal(sig, handler)
+
+    @mock.patch('dlrn.shell.process_packages', return_value=0)
+    def test_run_daemon(self, pp_mock, gs_mock, pool_mock):
+        def _stop(*args, **kwargs):
+            os.kill(os.getpid(), signal.SIGTERM)
+            return 0
+
+        pp_mock.side_effect = _stop
+        result = shell.run_daemon(self.options, self.cp, self.config,
+                                  self.packages)
+        self.assertEqual(result, 0)
+        self.assertEqual(pp_mock.call_count, 1)
+        self.assertEqual(pp_mock.call_args[0][3], ['foo', 'bar'])
+        self.assertEqual(pp_mock.call_args[1]['build_pool'],
+                         pool_mock.return_value)
+        # Pools are created once, and closed on exit
+        self.assertEqual(pool_mock.call_count, 2)
+        self.assertEqual(pool_mock.return_value.close.call_count, 2)
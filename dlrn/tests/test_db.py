@@ -71,6 +71,28 @@ class TestGetLastProcessedCommit(TestsWithData):
         commit = db.getLastProcessedCommit(self.session, 'python-newproject')
         self.assertEqual(commit, None)
 
+    def test_skipped(self):
+        commit = db.getLastProcessedCommit(self.session, 'python-pysaml2')
+        skipped = db.Commit(project_name='python-pysaml2', type='rpm',
+                            commit_hash='1234', distro_hash='5678',
+                            commit_branch=commit.commit_branch,
+                            dt_commit=commit.dt_commit + 1,
+                            dt_distro=commit.dt_distro,
+                            dt_build=commit.dt_build + 1, status='SKIPPED')
+        self.session.add(skipped)
+        self.session.commit()
+        # Skipped commits were never built
+        self.assertEqual(
+            db.getLastProcessedCommit(self.session, 'python-pysaml2'),
+            commit)
+        self.assertEqual(
+            db.getLastBuiltCommit(self.session, 'python-pysaml2',
+                                  commit.commit_branch), commit)
+        # Unless they are asked for
+        self.assertEqual(
+            db.getLastProcessedCommit(self.session, 'python-pysaml2',
+                                      not_status='RETRY'), skipped)
+
     def test_oldercommit_with_newer_id(self):
         # The latest puppet-stdlib commit is older than the previous one,
         # but has a newer id, so it has to be returned
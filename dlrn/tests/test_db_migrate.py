@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import os
+import shutil
+import sys
+import tempfile
+
+from dlrn.tests import base
+
+from dlrn import db
+from dlrn import db_migrate
+from dlrn import utils
+
+
+class TestDBMigrate(base.TestCase):
+    def setUp(self):
+        super(TestDBMigrate, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = "sqlite:///%s" % os.path.join(self.tmpdir, 'source.db')
+        self.dest = "sqlite:///%s" % os.path.join(self.tmpdir, 'dest.db')
+        self.session = db.getSession(self.source)
+        utils.loadYAML(self.session, './dlrn/tests/samples/commits_2.yaml')
+
+    def tearDown(self):
+        super(TestDBMigrate, self).tearDown()
+        db.closeSession(self.session)
+        shutil.rmtree(self.tmpdir)
+
+    def _assert_same(self, session):
+        for table in db.Base.metadata.sorted_tables:
+            source_rows = self.session.execute(
+                table.select().order_by(*table.primary_key.columns)).all()
+            dest_rows = session.execute(
+                table.select().order_by(*table.primary_key.columns)).all()
+            self.assertEqual(source_rows, dest_rows)
+
+    def test_migrate_db(self):
+        total = db_migrate.migrate_db(self.source, self.dest, chunk_size=2)
+        session = db.getSession(self.dest)
+        self.assertEqual(total, 18)
+        self._assert_same(session)
+        db.closeSession(session)
+
+    def test_migrate_db_resume(self):
+        db_migrate.migrate_db(self.source, self.dest,
+                              tables=['users', 'commits'])
+        commit = db.Commit(project_name='python-foo', commit_hash='1234',
+                           distro_hash='5678', status='SUCCESS',
+                           dt_commit=1, dt_distro=1, dt_build=1)
+        self.session.add(commit)
+        self.session.commit()
+        # Only the new commit and the other tables are copied
+        total = db_migrate.migrate_db(self.source, self.dest, chunk_size=2)
+        self.assertEqual(total, 13)
+        session = db.getSession(self.dest)
+        self._assert_same(session)
+        db.closeSession(session)
+
+    def test_db_migrate_cli(self):
+        testargs = ["dlrn-db-migrate", "--source", self.source,
+                    "--dest", self.dest, "--chunk-size", "3"]
+        with mock.patch.object(sys, 'argv', testargs):
+            self.assertEqual(db_migrate.db_migrate(), 0)
+        session = db.getSession(self.dest)
+        self._assert_same(session)
+        db.closeSession(session)
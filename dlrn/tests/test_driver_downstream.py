@@ -83,6 +83,32 @@ class TestDriverDownstream(base.TestCase):
         assert nv[1] == 'c9de185ea1ac1e8d4435c5863b2ad7cefdb28c76', nv[1]
         assert nv[3] == '118992921c733bc0079e34dbde59cc8b3c1312dc', nv[3]
 
+    @mock.patch('dlrn.drivers.downstream.DownstreamInfoDriver._distgit_setup',
+                return_value=True)
+    @mock.patch('dlrn.drivers.downstream.refreshrepo',
+                side_effect=_mocked_refreshrepo)
+    def test_versions_prefetch(self, rr_mock, ds_mock, uo_mock):
+        driver = DownstreamInfoDriver(cfg_options=self.config)
+        driver.prefetch()
+        self.assertEqual(uo_mock.call_count, 1)
+        package = {
+            'name': 'openstack-nova',
+            'project': 'nova',
+            'upstream': 'git://git.openstack.org/openstack/nova',
+            'distgit': 'git://git.example.com/rpms/nova',
+            'master-distgit': 'git://git.example.com/rpms/nova',
+            'ds-patches': 'git://git.example.com/downstream/nova',
+        }
+        for i in range(2):
+            pkginfo, skipped = driver.getinfo(package=package,
+                                              project='nova', dev_mode=False)
+            self.assertEqual(len(pkginfo), 1)
+        # versions.csv is only fetched once
+        self.assertEqual(uo_mock.call_count, 1)
+        self.assertEqual(uo_mock.call_args,
+                         mock.call(self.config.versions_url,
+                                   cache_dir=self.config.cache_dir))
+
     @mock.patch('dlrn.drivers.downstream.DownstreamInfoDriver._distgit_setup',
                 return_value=True)
     @mock.patch('dlrn.drivers.downstream.refreshrepo',
@@ -117,7 +143,7 @@ class TestDriverDownstream(base.TestCase):
                               self.config, 'testbranch',
                               full_path=self.temp_dir + '/openstack-nova_'
                                                         'distro/',
-                              local=None),
+                              local=None, shallow=True),
                     mock.call('git://git.example.com/rpms/nova',
                               self.temp_dir + '/openstack-nova_distro_'
                                               'upstream',
@@ -228,7 +254,7 @@ class TestDriverDownstream(base.TestCase):
                               self.config, 'testbranch',
                               full_path=self.temp_dir + '/openstack-nova_'
                                                         'distro/',
-                              local=None),
+                              local=None, shallow=True),
                     mock.call('git://git.example.com/downstream/nova',
                               self.temp_dir + '/openstack-nova_downstream',
                               self.config, 'dsbranch',
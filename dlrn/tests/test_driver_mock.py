@@ -114,6 +114,28 @@ class TestDriverMock(base.TestCase):
         self.assertEqual(rc_mock.call_count, 1)
         self.assertEqual(env_mock.call_args_list, expected)
 
+    def test_build_package_warm_chroot(self, ld_mock, env_mock, rc_mock):
+        os.environ['MOCK_CONFIG'] = 'dlrn-1.cfg'
+        config_options = self.config
+        config_options.warm_chroot = True
+        config_options.datadir = self.temp_dir
+        driver = MockBuildDriver(cfg_options=config_options)
+        driver.build_package(output_directory=self.temp_dir,
+                             package_name='python-pysaml2')
+
+        datadir = os.path.realpath(self.temp_dir)
+        expected = [mock.call('/usr/bin/mock', '-v', '-r',
+                              '%s/dlrn-1.cfg' % datadir,
+                              '--resultdir', self.temp_dir,
+                              '--no-clean',
+                              '--rebuild',
+                              '%s/python-pysaml2-3.0-1a.el7.centos.src.rpm' %
+                              self.temp_dir,
+                              _err=driver._process_mock_output,
+                              _out=driver._process_mock_output,
+                              postinstall=True)]
+        self.assertEqual(env_mock.call_args_list, expected)
+
     def test_driver_config(self, ld_mock, env_mock, rc_mock):
         cp = configparser.RawConfigParser()
         cp.read("projects.ini")
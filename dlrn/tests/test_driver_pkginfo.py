@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import os
+import pickle
+import shutil
+import tempfile
+
+from dlrn.config import ConfigOptions
+from dlrn.drivers.pkginfo import getcachedpackages
+from dlrn.drivers.pkginfo import getpackage
+from dlrn.drivers.pkginfo import getprojectnames
+from dlrn.drivers.pkginfo import PackageList
+from dlrn.tests import base
+from six.moves import configparser
+
+
+class TestPackageList(base.TestCase):
+    def setUp(self):
+        super(TestPackageList, self).setUp()
+        self.packages = [{'name': 'python-foo', 'project': 'foo'},
+                         {'name': 'python-bar', 'project': 'bar'},
+                         {'name': 'python-foo-tests', 'project': 'foo'}]
+        self.pkglist = PackageList(self.packages)
+
+    def test_getpackage(self):
+        self.assertEqual(self.pkglist.get('python-bar'), self.packages[1])
+        self.assertEqual(getpackage(self.pkglist, 'python-bar'),
+                         self.packages[1])
+        self.assertEqual(getpackage(self.packages, 'python-bar'),
+                         self.packages[1])
+        self.assertIsNone(getpackage(self.pkglist, 'python-baz'))
+        self.assertIsNone(getpackage(self.packages, 'python-baz'))
+
+    def test_getprojectnames(self):
+        expected = ['python-foo', 'python-bar', 'python-foo-tests']
+        self.assertEqual(getprojectnames(self.pkglist, ['bar', 'foo']),
+                         expected)
+        self.assertEqual(getprojectnames(self.packages, ['bar', 'foo']),
+                         expected)
+
+    def test_modify(self):
+        self.pkglist.append({'name': 'python-baz', 'project': 'baz'})
+        self.assertEqual(self.pkglist.get('python-baz')['project'], 'baz')
+        del self.pkglist[0]
+        self.assertIsNone(self.pkglist.get('python-foo'))
+        self.assertEqual(self.pkglist.project_names(['foo']),
+                         ['python-foo-tests'])
+
+    def test_pickle(self):
+        pkglist = pickle.loads(pickle.dumps(self.pkglist))
+        self.assertIsInstance(pkglist, PackageList)
+        self.assertEqual(pkglist, self.packages)
+        self.assertIs(pkglist.get('python-bar'), pkglist[1])
+
+
+class TestGetCachedPackages(base.TestCase):
+    def setUp(self):
+        super(TestGetCachedPackages, self).setUp()
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        config.set("DEFAULT", "pkginfo_driver",
+                   "dlrn.drivers.rdoinfo.RdoInfoDriver")
+        self.temp_dir = tempfile.mkdtemp()
+        self.config = ConfigOptions(config)
+        self.config.cache_packages = True
+        self.config.cache_dir = self.temp_dir
+        self.heads = {'https://info': 'a1', 'https://remote': 'b1'}
+        self.inforepo = mock.MagicMock(info_files=['foo.yml'])
+        self.inforepo.get_info.return_value = {
+            'packages': [{'name': 'python-foo', 'tags': {'master': None}},
+                         {'name': 'python-bar', 'tags': {}}],
+            'remote-info': {'remote': {'remote_git_info': 'https://remote'}}}
+        patcher = mock.patch('dlrn.gitbackend.GitBackend.remotehead',
+                             side_effect=lambda url: self.heads[url])
+        self.remotehead = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        super(TestGetCachedPackages, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def _get(self, repo_url='https://info'):
+        return getcachedpackages(self.inforepo, self.config, 'master',
+                                 repo_url=repo_url)
+
+    def _pickles(self):
+        return [f for f in os.listdir(os.path.join(self.temp_dir,
+                                                   'dlrn-packages'))
+                if f.endswith('.pickle')]
+
+    def test_cache_hit(self):
+        packages = self._get()
+        self.assertEqual([p['name'] for p in packages], ['python-foo'])
+        self.assertEqual(self._get(), packages)
+        self.assertEqual(self.inforepo.get_info.call_count, 1)
+        self.assertEqual(len(self._pickles()), 1)
+
+    def test_info_head_changed(self):
+        self._get()
+        self.heads['https://info'] = 'a2'
+        self._get()
+        self.assertEqual(self.inforepo.get_info.call_count, 2)
+        self.assertEqual(len(self._pickles()), 1)
+
+    def test_remote_head_changed(self):
+        self._get()
+        self.heads['https://remote'] = 'b2'
+        self._get()
+        self.assertEqual(self.inforepo.get_info.call_count, 2)
+        self._get()
+        self.assertEqual(self.inforepo.get_info.call_count, 2)
+        self.assertEqual(len(self._pickles()), 1)
+
+    def test_remote_not_git(self):
+        self.inforepo.get_info.return_value['remote-info'] = {
+            'remote': {'remote_info': '/some/path'}}
+        self._get()
+        self._get()
+        self.assertEqual(self.inforepo.get_info.call_count, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir,
+                                                     'dlrn-packages')))
+
+    def test_no_repo_url(self):
+        self._get(repo_url=None)
+        self._get(repo_url=None)
+        self.assertEqual(self.inforepo.get_info.call_count, 2)
+        self.remotehead.assert_not_called()
+
+    def test_cache_disabled(self):
+        self.config.cache_packages = False
+        self._get()
+        self._get()
+        self.assertEqual(self.inforepo.get_info.call_count, 2)
+        self.remotehead.assert_not_called()
@@ -17,6 +17,7 @@ import os
 import shutil
 import tempfile
 
+
 from dlrn.config import ConfigOptions
 from dlrn.drivers.rdoinfo import RdoInfoDriver
 from dlrn.tests import base
@@ -89,6 +90,7 @@ class TestDriverRdoInfo(base.TestCase):
 
         expected = [mock.call(info_files=['foo.yml'],
                               remote_git_info='http:/github.com/foo',
+                              cache_ttl=3600,
                               cache_base_path=None)]
 
         self.assertEqual(di_mock.call_args_list, expected)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+import testtools
+
+from six.moves import configparser
+
+from dlrn.config import ConfigOptions
+from dlrn import gitbackend
+from dlrn.tests import base
+
+
+@mock.patch('sh.git', create=True)
+class TestShGitBackend(base.TestCase):
+    def setUp(self):
+        super(TestShGitBackend, self).setUp()
+        self.backend = gitbackend.ShGitBackend()
+
+    def test_getcommits(self, git_mock):
+        git_mock.bake().log.return_value = ["'1000 aaa'", "'2000 bbb'"]
+        result = self.backend.getcommits('path', '--after=1000')
+        self.assertEqual(result, [('1000', 'aaa'), ('2000', 'bbb')])
+        git_mock.bake().log.assert_called_with("--pretty=format:'%ct %H'",
+                                               '--after=1000',
+                                               '--first-parent', '--reverse')
+
+    def test_getcommits_tags_only(self, git_mock):
+        git_mock.bake().log.return_value = ["'1000 aaa  (tag: 1.0)'",
+                                            "'2000 bbb  (HEAD -> master)'"]
+        result = self.backend.getcommits('path', '-2', ref='master',
+                                         tags_only=True)
+        self.assertEqual(result, [('1000', 'aaa')])
+        git_mock.bake().log.assert_called_with('--simplify-by-decoration',
+                                               "--pretty=format:'%ct %H %d'",
+                                               '-2', '--first-parent',
+                                               '--reverse', 'master')
+
+    def test_getlastcommit(self, git_mock):
+        git_mock.bake().log.return_value = 'aaa 1000'
+        self.assertEqual(self.backend.getlastcommit('path', subdir=True),
+                         ['aaa', '1000'])
+        git_mock.bake().log.assert_called_with('--pretty=format:%H %ct', '-1',
+                                               '.')
+
+    def test_remoteurls(self, git_mock):
+        git_mock.bake().return_value = ('origin\turl1 (fetch)\n'
+                                        'origin\turl1 (push)\n'
+                                        'other\turl2 (fetch)\n')
+        self.assertEqual(self.backend.remoteurls('path'), ['url1', 'url2'])
+
+
+@testtools.skipIf(gitbackend.pygit2 is None, 'pygit2 is not installed')
+class TestPygit2GitBackend(base.TestCase):
+    def setUp(self):
+        super(TestPygit2GitBackend, self).setUp()
+        pygit2 = gitbackend.pygit2
+        self.backend = gitbackend.Pygit2GitBackend()
+        self.path = tempfile.mkdtemp()
+        repo = pygit2.init_repository(self.path)
+        self.commits = []
+        parents = []
+        for i, subdir in enumerate(['a', 'b', 'a', 'b']):
+            with open(os.path.join(self.path, subdir + '.txt'), 'w') as fp:
+                fp.write(str(i))
+            # Keep the files in two directories, to check subdir lookups
+            os.makedirs(os.path.join(self.path, subdir), exist_ok=True)
+            with open(os.path.join(self.path, subdir, 'f'), 'w') as fp:
+                fp.write(str(i))
+            repo.index.add_all()
+            repo.index.write()
+            tree = repo.index.write_tree()
+            sig = pygit2.Signature('a', 'a@b', 1000 * (i + 1), 0)
+            commit = repo.create_commit('HEAD', sig, sig, 'commit %d' % i,
+                                        tree, parents)
+            parents = [commit]
+            self.commits.append(str(commit))
+        repo.create_reference('refs/tags/1.0', self.commits[1])
+        repo.remotes.create('origin', 'https://example.com/repo')
+
+    def tearDown(self):
+        super(TestPygit2GitBackend, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def test_getcommits_limit(self):
+        result = self.backend.getcommits(self.path, '-2')
+        self.assertEqual(result, [('3000', self.commits[2]),
+                                  ('4000', self.commits[3])])
+
+    def test_getcommits_after(self):
+        result = self.backend.getcommits(self.path, '--after=2000')
+        self.assertEqual(result, [('2000', self.commits[1]),
+                                  ('3000', self.commits[2]),
+                                  ('4000', self.commits[3])])
+
+    def test_getcommits_tags_only(self):
+        result = self.backend.getcommits(self.path, '-2', ref='master',
+                                         tags_only=True)
+        self.assertEqual(result, [('2000', self.commits[1])])
+
+    def test_getlastcommit(self):
+        self.assertEqual(self.backend.getlastcommit(self.path),
+                         [self.commits[3], '4000'])
+        self.assertEqual(self.backend.getlastcommit(
+            os.path.join(self.path, 'a'), subdir=True),
+            [self.commits[2], '3000'])
+
+    def test_refs(self):
+        self.assertTrue(self.backend.tagexists(self.path, '1.0'))
+        self.assertFalse(self.backend.tagexists(self.path, '2.0'))
+        self.assertTrue(self.backend.branchexists(self.path, 'master'))
+        self.assertFalse(self.backend.branchexists(self.path, 'origin/master',
+                                                   remote=True))
+        self.assertEqual(self.backend.remoteurls(self.path),
+                         ['https://example.com/repo'])
+
+
+class TestGetGitBackend(base.TestCase):
+    def setUp(self):
+        super(TestGetGitBackend, self).setUp()
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        self.config = ConfigOptions(config)
+
+    def test_default(self):
+        self.assertIsInstance(gitbackend.get_git_backend(self.config),
+                              gitbackend.ShGitBackend)
+
+    @mock.patch('dlrn.gitbackend._backends', {})
+    @mock.patch('dlrn.gitbackend.pygit2', None)
+    def test_pygit2_missing(self):
+        self.config.git_backend = 'pygit2'
+        self.assertIsInstance(gitbackend.get_git_backend(self.config),
+                              gitbackend.ShGitBackend)
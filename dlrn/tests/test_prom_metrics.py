@@ -12,6 +12,7 @@
 
 import mock
 import os
+import shutil
 import tempfile
 
 from dlrn.api import app
@@ -73,3 +74,69 @@ class TestBasic(DLRNPrometheusMetricsTestCase):
                       '"http://localhost/worker"} 5.0', response.data.decode())
         self.assertIn('dlrn_builds_total{baseurl="http://'
                       'localhost/worker"} 25.0', response.data.decode())
+
+    def test_build_phases(self, db_mock, co_mock):
+        datadir = tempfile.mkdtemp()
+
+        def _opt(config_file):
+            co = mock_opt(config_file)
+            co.datadir = datadir
+            return co
+
+        co_mock.side_effect = _opt
+        utils.record_timings(datadir, db.Commit(
+            timings='{"build": 42.0, "srpm": 3.5}'))
+        utils.record_timings(datadir, db.Commit(timings='{"build": 400.0}'))
+        response = self.app.get('/metrics')
+        shutil.rmtree(datadir)
+        self.assertEqual(response.status_code, 200)
+        data = response.data.decode()
+        self.assertIn('dlrn_build_phase_seconds_bucket{baseurl="http://'
+                      'localhost/worker",le="60",phase="build"} 1.0', data)
+        self.assertIn('dlrn_build_phase_seconds_count{baseurl="http://'
+                      'localhost/worker",phase="build"} 2.0', data)
+        self.assertIn('dlrn_build_phase_seconds_sum{baseurl="http://'
+                      'localhost/worker",phase="srpm"} 3.5', data)
+
+    def test_rsync_stats(self, db_mock, co_mock):
+        datadir = tempfile.mkdtemp()
+
+        def _opt(config_file):
+            co = mock_opt(config_file)
+            co.datadir = datadir
+            return co
+
+        co_mock.side_effect = _opt
+        with open(os.path.join(datadir, 'rsync-stats.json'), 'w') as fp:
+            fp.write('{"transfers": 3, "seconds": 4.5, "bytes_sent": 1024}')
+        response = self.app.get('/metrics')
+        shutil.rmtree(datadir)
+        self.assertEqual(response.status_code, 200)
+        data = response.data.decode()
+        self.assertIn('dlrn_rsync_transfers_total{baseurl="http://'
+                      'localhost/worker"} 3.0', data)
+        self.assertIn('dlrn_rsync_seconds_total{baseurl="http://'
+                      'localhost/worker"} 4.5', data)
+        self.assertIn('dlrn_rsync_bytes_sent_total{baseurl="http://'
+                      'localhost/worker"} 1024.0', data)
+
+    def test_known_errors(self, db_mock, co_mock):
+        datadir = tempfile.mkdtemp()
+
+        def _opt(config_file):
+            co = mock_opt(config_file)
+            co.datadir = datadir
+            return co
+
+        co_mock.side_effect = _opt
+        utils.record_known_error(datadir, 'No route to host')
+        utils.record_known_error(datadir, 'No route to host')
+        utils.record_known_error(datadir, 'Connection timed out')
+        response = self.app.get('/metrics')
+        shutil.rmtree(datadir)
+        self.assertEqual(response.status_code, 200)
+        data = response.data.decode()
+        self.assertIn('dlrn_known_errors_total{baseurl="http://localhost/'
+                      'worker",pattern="No route to host"} 2.0', data)
+        self.assertIn('dlrn_known_errors_total{baseurl="http://localhost/'
+                      'worker",pattern="Connection timed out"} 1.0', data)
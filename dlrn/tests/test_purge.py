@@ -58,7 +58,8 @@ def mocked_islink(path):
     return False
 
 
-def mocked_is_commit_in_dirs(commit, dirlist, basedir, component_list=None):
+def mocked_is_commit_in_dirs(commit, dirlist, basedir, component_list=None,
+                             filenames=None):
     # We are making one of the commit hashes be in the excluded dir list
     if commit.commit_hash == '6abf557aa1d8fff0aa21f8eba6cd18302c2c86ff':
         return True
@@ -90,6 +91,46 @@ class TestPurge(base.TestCase):
                 expected.append(mock.call(repo, ignore_errors=True))
             self.assertEqual(sh_mock.call_args_list, expected)
 
+    def test_plan_purge(self, icid_mock, sh_mock, db_mock, lst_mock,
+                        il_mock):
+        session = mocked_session('sqlite://')
+        before = int(time.mktime(datetime(2015, 9, 30, 14, 20).timetuple()))
+        plan = purge.plan_purge(session, before, './data', batch_size=3)
+        self.assertEqual(plan.count(purge.KEEP_EXCLUDED), 1)
+        self.assertEqual([entry[3] for entry in plan.actions
+                          if entry[3] is not None], expected_repos)
+        # Nothing is touched until the plan is executed
+        self.assertEqual(sh_mock.call_count, 0)
+
+    def test_execute_purge_plan(self, icid_mock, sh_mock, db_mock, lst_mock,
+                                il_mock):
+        session = mocked_session('sqlite://')
+        before = int(time.mktime(datetime(2015, 9, 30, 14, 20).timetuple()))
+        plan = purge.plan_purge(session, before, './data')
+        purge.execute_purge_plan(plan, session, dry_run=False)
+        purged = session.query(db.Commit).filter(
+            db.Commit.flags.op('&')(purge.FLAG_PURGED) != 0).count()
+        self.assertEqual(purged, len(plan.to_purge()))
+        # Purged commits are not considered again
+        plan = purge.plan_purge(session, before, './data')
+        self.assertEqual(plan.to_purge(), [])
+
+    def test_execute_purge_plan_batches(self, icid_mock, sh_mock, db_mock,
+                                        lst_mock, il_mock):
+        session = mocked_session('sqlite://')
+        before = int(time.mktime(datetime(2015, 9, 30, 14, 20).timetuple()))
+        plan = purge.plan_purge(session, before, './data')
+        deleter = purge.Deleter(workers=4, dry_run=False)
+        with mock.patch.object(session, 'commit') as commit_mock:
+            purge.execute_purge_plan(plan, session, dry_run=False,
+                                     deleter=deleter, batch_size=2)
+        deleter.close()
+        # The flags are committed after each batch, not once at the end
+        self.assertGreater(commit_mock.call_count, 1)
+        self.assertEqual(sorted(call[0][0] for call in
+                                sh_mock.call_args_list),
+                         sorted(expected_repos))
+
 
 @mock.patch('os.path.exists', side_effect=mocked_exists_false)
 class TestIsCommitInDirs(base.TestCase):
@@ -124,6 +165,37 @@ class TestIsCommitInDirs(base.TestCase):
         self.assertEqual(ex_mock.call_args_list, expected)
 
 
+class TestExcludedFilenames(base.TestCase):
+    def setUp(self):
+        super(TestExcludedFilenames, self).setUp()
+        self.basedir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.basedir, 'consistent'))
+        os.makedirs(os.path.join(self.basedir, 'component', 'bar', 'foo-ci'))
+        open(os.path.join(self.basedir, 'consistent', 'foo-1.0.0.rpm'),
+             'w').close()
+        open(os.path.join(self.basedir, 'component', 'bar', 'foo-ci',
+                          'bar-1.0.0.rpm'), 'w').close()
+
+    def tearDown(self):
+        super(TestExcludedFilenames, self).tearDown()
+        shutil.rmtree(self.basedir)
+
+    def test_get_excluded_filenames(self):
+        dirlist = '%s/consistent,%s/foo-ci' % (self.basedir, self.basedir)
+        filenames = purge.get_excluded_filenames(dirlist, self.basedir,
+                                                 component_list=['bar'])
+        self.assertEqual(filenames, set(['foo-1.0.0.rpm', 'bar-1.0.0.rpm']))
+        commit = db.Commit(project_name='bar', artifacts='repos/1c/67/'
+                           '1c67b1ab_c31d1b18/bar-1.0.0.rpm')
+        self.assertTrue(purge.is_commit_in_dirs(commit, dirlist,
+                                                self.basedir,
+                                                filenames=filenames))
+        commit.artifacts = 'repos/1c/67/1c67b1ab_c31d1b18/bar-2.0.0.rpm'
+        self.assertFalse(purge.is_commit_in_dirs(commit, dirlist,
+                                                 self.basedir,
+                                                 filenames=filenames))
+
+
 @mock.patch('shutil.rmtree')
 @mock.patch('dlrn.purge.getSession', side_effect=mocked_session_2)
 class TestAggPurge(base.TestCase):
@@ -135,6 +207,8 @@ class TestAggPurge(base.TestCase):
         self.config.set('DEFAULT', 'datadir', self.temp_dir)
         os.makedirs(os.path.join(self.temp_dir, 'repos',
                                  'another-ci/12/34/12345678'))
+        os.makedirs(os.path.join(self.temp_dir, 'repos',
+                                 'another-ci/ab/cd/abcdabcd'))
         os.makedirs(os.path.join(self.temp_dir, 'repos',
                                  'foo-ci/90/ab/90abcdef'))
 
@@ -146,6 +220,26 @@ class TestAggPurge(base.TestCase):
         purge.purge_promoted_hashes(self.config, time.time(), dry_run=False)
         self.assertEqual(rm_mock.call_count, 2)
 
+    def test_purge_promoted_protected_promotion(self, db_mock, rm_mock):
+        # another-ci/12/34/12345678 is the latest aggregate hash promoted
+        # as another-ci in the database
+        purge.purge_promoted_hashes(self.config, time.time(), dry_run=False)
+        removed = sorted(call[0][0] for call in rm_mock.call_args_list)
+        self.assertEqual(removed, [
+            os.path.join(self.temp_dir, 'repos', 'another-ci/ab/cd/abcdabcd'),
+            os.path.join(self.temp_dir, 'repos', 'foo-ci/90/ab/90abcdef')])
+
+    def test_get_protected_paths(self, db_mock, rm_mock):
+        basedir = os.path.join(self.temp_dir, 'repos')
+        session = mocked_session_2('sqlite://')
+        protected = purge.get_protected_paths(
+            session, basedir, 'delorean',
+            ['current', 'consistent', 'another-ci', 'foo-ci', 'test-ci'])
+        self.assertEqual(protected, set([
+            os.path.join(basedir, 'another-ci/12/34/12345678'),
+            os.path.join(basedir, 'foo-ci/ab/cd/abcd1234'),
+            os.path.join(basedir, 'test-ci/ab/cd/abcdef00')]))
+
     def test_purge_promoted_only_one(self, db_mock, rm_mock):
         current_time = time.time()
         time.sleep(1)
@@ -166,3 +260,66 @@ class TestAggPurge(base.TestCase):
         os.symlink(orig_path, dst_path)
         purge.purge_promoted_hashes(self.config, time.time(), dry_run=False)
         self.assertEqual(rm_mock.call_count, 1)
+
+
+class TestDeleter(base.TestCase):
+    def setUp(self):
+        super(TestDeleter, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.temp_dir, 'purge.checkpoint')
+        self.dirs = []
+        for name in ['12/34/12345678', '90/ab/90abcdef']:
+            path = os.path.join(self.temp_dir, name)
+            os.makedirs(os.path.join(path, 'repodata'))
+            for filename in ['foo.rpm', 'repodata/repomd.xml']:
+                open(os.path.join(path, filename), 'w').close()
+            os.symlink('repodata', os.path.join(path, 'link'))
+            self.dirs.append(path)
+
+    def tearDown(self):
+        super(TestDeleter, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def test_rate_limited_rmtree(self):
+        deleter = purge.Deleter(workers=2, files_per_second=1000,
+                                dry_run=False)
+        for path in self.dirs:
+            deleter.submit(path, deleter.rmtree)
+        deleter.close()
+        for path in self.dirs:
+            self.assertFalse(os.path.exists(path))
+
+    def test_rate_limiter(self):
+        limiter = purge.RateLimiter(20)
+        start = time.time()
+        for i in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_checkpoint(self):
+        deleter = purge.Deleter(checkpoint=self.checkpoint, dry_run=False)
+        deleter.submit(self.dirs[0], deleter.rmtree)
+        deleter.wait()
+        with open(self.checkpoint) as fp:
+            self.assertEqual(fp.read(), self.dirs[0] + '\n')
+
+        # An interrupted purge skips the directories already removed
+        deleter = purge.Deleter(checkpoint=self.checkpoint, dry_run=False)
+        with mock.patch.object(deleter, 'rmtree') as rm_mock:
+            for path in self.dirs:
+                deleter.submit(path, rm_mock)
+            deleter.wait()
+        self.assertEqual(rm_mock.call_args_list, [mock.call(self.dirs[1])])
+        # Once complete, the checkpoint file is removed
+        deleter.close()
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_dry_run(self):
+        deleter = purge.Deleter(workers=2, checkpoint=self.checkpoint,
+                                dry_run=True)
+        for path in self.dirs:
+            deleter.submit(path, deleter.rmtree)
+        deleter.close()
+        for path in self.dirs:
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(self.checkpoint))
@@ -12,8 +12,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import gzip
+import hashlib
 import mock
+import os
+import requests_mock
 import sh
+import shutil
 import sys
 import tempfile
 
@@ -31,12 +36,13 @@ def mocked_session(url):
     return session
 
 
-def mocked_get(url, timeout=None):
+def mocked_get(url, timeout=None, **kwargs):
     mock_resp = mock.Mock()
     with open('./dlrn/tests/samples/commits_remote.yaml', 'rb') as fp:
         mock_resp.status_code = 200
         mock_resp.content = fp.read()
         mock_resp.text = mock_resp.content.decode('utf-8')
+        mock_resp.iter_content.return_value = [mock_resp.content]
     return mock_resp
 
 
@@ -46,7 +52,7 @@ def mocked_get(url, timeout=None):
 @mock.patch.object(sh.Command, '__call__', autospec=True)
 @mock.patch('dlrn.remote.post_build')
 @mock.patch('dlrn.remote.getSession', side_effect=mocked_session)
-@mock.patch('dlrn.remote.requests.get', side_effect=mocked_get)
+@mock.patch('dlrn.remote.requests.Session.get', side_effect=mocked_get)
 class TestRemote(base.TestCase):
     def test_remote(self, req_mock, db_mock, build_mock, sh_mock, gp_mock,
                     sl_mock, rn_mock):
@@ -58,3 +64,165 @@ class TestRemote(base.TestCase):
         with mock.patch.object(sys, 'argv', testargs):
             remote.remote()
             build_mock.assert_called_once()
+
+    @mock.patch('dlrn.remote.genreports')
+    def test_remote_batch(self, gr_mock, req_mock, db_mock, build_mock,
+                          sh_mock, gp_mock, sl_mock, rn_mock):
+        testargs = ["dlrn-remote", "--config-file", "projects.ini",
+                    "--repo-url", "http://example.com/1/",
+                    "--repo-url", "http://example.com/2/"]
+        # Both repos contain the same commits, so the new one is only
+        # imported once, and the reports generated once for the batch
+        with mock.patch.object(sys, 'argv', testargs):
+            remote.remote()
+            build_mock.assert_called_once()
+            gr_mock.assert_called_once()
+        # A single database session is used for the batch
+        db_mock.assert_called_once()
+
+    @mock.patch('dlrn.remote.genreports')
+    def test_remote_batch_failed_repo(self, gr_mock, req_mock, db_mock,
+                                      build_mock, sh_mock, gp_mock, sl_mock,
+                                      rn_mock):
+        def _get(url, timeout=None, **kwargs):
+            if url.startswith('http://example.com/1/'):
+                raise remote.requests.exceptions.ConnectionError('down')
+            return mocked_get(url, timeout=timeout, **kwargs)
+
+        req_mock.side_effect = _get
+        testargs = ["dlrn-remote", "--config-file", "projects.ini",
+                    "--repo-url", "http://example.com/1/",
+                    "--repo-url", "http://example.com/2/"]
+        # The second repo is imported, but the failure is reported
+        with mock.patch.object(sys, 'argv', testargs):
+            self.assertEqual(remote.remote(), 1)
+            build_mock.assert_called_once()
+            gr_mock.assert_called_once()
+
+    @mock.patch('dlrn.remote.genreports')
+    def test_remote_bad_checksum(self, gr_mock, req_mock, db_mock,
+                                 build_mock, sh_mock, gp_mock, sl_mock,
+                                 rn_mock):
+        primary = PRIMARY.replace('foo-1.0-1.noarch.rpm',
+                                  'python-pysaml2-3.0-1a.el7.centos.'
+                                  'noarch.rpm') % ('0' * 64, 1)
+
+        def _get(url, timeout=None, **kwargs):
+            if url.endswith('repomd.xml'):
+                content = REPOMD
+            elif url.endswith('primary.xml.gz'):
+                content = gzip.compress(primary.encode('utf-8'))
+            else:
+                return mocked_get(url, timeout=timeout, **kwargs)
+            mock_resp = mock.Mock(status_code=200, content=content)
+            return mock_resp
+
+        req_mock.side_effect = _get
+        testargs = ["dlrn-remote", "--config-file", "projects.ini",
+                    "--repo-url", "http://example.com/1/"]
+        # The RPM does not match the repodata, so the repo is not imported
+        with mock.patch.object(sys, 'argv', testargs), \
+                mock.patch('dlrn.remote.logger') as log_mock:
+            self.assertEqual(remote.remote(), 1)
+        self.assertIn('Checksum mismatch', log_mock.error.call_args[0][0])
+        build_mock.assert_not_called()
+        gr_mock.assert_not_called()
+
+
+REPOMD = b"""<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="1">
+  <package type="rpm">
+    <checksum type="sha256" pkgid="YES">%s</checksum>
+    <size package="%d"/>
+    <location href="foo-1.0-1.noarch.rpm"/>
+  </package>
+</metadata>
+"""
+
+
+class TestDownload(base.TestCase):
+    def setUp(self):
+        super(TestDownload, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.session = remote._get_session(2)
+        self.rpm = b'rpm content'
+        self.checksum = ('sha256', hashlib.sha256(self.rpm).hexdigest(),
+                         len(self.rpm))
+
+    def tearDown(self):
+        super(TestDownload, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_repodata_checksums(self):
+        primary = PRIMARY % (self.checksum[1], len(self.rpm))
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/1/repodata/repomd.xml', content=REPOMD)
+            m.get('http://example.com/1/repodata/primary.xml.gz',
+                  content=gzip.compress(primary.encode('utf-8')))
+            checksums = remote.get_repodata_checksums(
+                self.session, 'http://example.com/1')
+        self.assertEqual(checksums, {'foo-1.0-1.noarch.rpm': self.checksum})
+
+    def test_get_repodata_checksums_missing(self):
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/1/repodata/repomd.xml', status_code=404)
+            checksums = remote.get_repodata_checksums(
+                self.session, 'http://example.com/1')
+        self.assertEqual(checksums, {})
+
+    def test_download_file(self):
+        path = os.path.join(self.tmpdir, 'foo.rpm')
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/1/foo.rpm', content=self.rpm)
+            remote.download_file(self.session, 'http://example.com/1/foo.rpm',
+                                 path, checksum=self.checksum)
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), self.rpm)
+
+    def test_download_file_bad_checksum(self):
+        path = os.path.join(self.tmpdir, 'foo.rpm')
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/1/foo.rpm', content=b'truncated')
+            self.assertRaises(ValueError, remote.download_file, self.session,
+                              'http://example.com/1/foo.rpm', path,
+                              checksum=self.checksum)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_download_file_http_error(self):
+        path = os.path.join(self.tmpdir, 'foo.rpm')
+        with requests_mock.Mocker() as m:
+            m.get('http://example.com/1/foo.rpm', status_code=404)
+            self.assertRaises(remote.requests.exceptions.HTTPError,
+                              remote.download_file, self.session,
+                              'http://example.com/1/foo.rpm', path)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_download_file_stream_error(self):
+        path = os.path.join(self.tmpdir, 'foo.rpm')
+        response = mock.MagicMock()
+        response.iter_content.side_effect = \
+            remote.requests.exceptions.ChunkedEncodingError('reset')
+        session = mock.MagicMock()
+        session.get.return_value = response
+        self.assertRaises(remote.requests.exceptions.ChunkedEncodingError,
+                          remote.download_file, session,
+                          'http://example.com/1/foo.rpm', path)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        response.close.assert_called_once_with()
+
+    def test_download_file_skip_existing(self):
+        path = os.path.join(self.tmpdir, 'foo.rpm')
+        with open(path, 'wb') as fp:
+            fp.write(self.rpm)
+        with requests_mock.Mocker() as m:
+            remote.download_file(self.session, 'http://example.com/1/foo.rpm',
+                                 path, checksum=self.checksum)
+            self.assertEqual(m.call_count, 0)
@@ -11,8 +11,12 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import json
 import mock
+import os
 import sh
+import shutil
+import tempfile
 
 from dlrn.config import ConfigOptions
 from dlrn import repositories
@@ -367,3 +371,172 @@ class TestRefreshRepo(base.TestCase):
                          expected_git_fetch)
         self.assertEqual(git_mock.bake().checkout.call_args_list,
                          expected_git_checkout)
+
+
+@mock.patch('sh.git', create=True)
+class TestGetTaggedCommits(base.TestCase):
+    def test_gettaggedcommits(self, git_mock):
+        git_mock.bake().return_value = ('1111 \n'
+                                        '2222 3333\n')
+        result = repositories.gettaggedcommits('path')
+        self.assertEqual(result, set(['1111', '2222', '3333']))
+        expected = [mock.call.bake()('for-each-ref',
+                                     '--format=%(objectname) '
+                                     '%(*objectname)', 'refs/tags')]
+        self.assertEqual(git_mock.bake().call_args_list, expected)
+
+
+@mock.patch('sh.git', create=True)
+class TestSkipUnchangedRepos(base.TestCase):
+    def setUp(self):
+        super(TestSkipUnchangedRepos, self).setUp()
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        config.set("DEFAULT", "skip_unchanged_repos", "true")
+        self.config = ConfigOptions(config)
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, '.git'))
+        self.cache = os.path.join(self.path, '.git', 'dlrn-refresh.json')
+        with open(self.cache, 'w') as fp:
+            json.dump({'url': 'url', 'branch': 'branch',
+                       'repoinfo': ['branch', 'abc', '123']}, fp)
+
+    def tearDown(self):
+        super(TestSkipUnchangedRepos, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def _git_cmd(self, *args):
+        if args[0] == 'rev-parse':
+            return 'abc\n'
+        if args[0] == 'remote':
+            return 'origin\turl (fetch)\norigin\turl (push)\n'
+
+    def test_skip_unchanged(self, git_mock):
+        git_mock.return_value = ('abc\trefs/heads/branch\n')
+        git_mock.bake().side_effect = self._git_cmd
+        git_mock.bake().status.return_value = ''
+        result = repositories.refreshrepo('url', self.path, self.config,
+                                          branch='branch')
+        self.assertEqual(result, ['branch', 'abc', '123'])
+        self.assertEqual(git_mock.call_args_list,
+                         [mock.call('ls-remote', 'url',
+                                    'refs/heads/branch', 'refs/tags/branch',
+                                    'refs/tags/branch^{}', _tty_out=False,
+                                    _timeout=300)])
+        self.assertEqual(git_mock.bake().fetch.call_count, 0)
+        self.assertEqual(git_mock.bake().reset.call_count, 0)
+
+    def test_refresh_modified_checkout(self, git_mock):
+        git_mock.return_value = ('abc\trefs/heads/branch\n')
+        git_mock.bake().side_effect = self._git_cmd
+        git_mock.bake().status.return_value = ' M foo.spec\n'
+        git_mock.bake().log.return_value = 'abc 123'
+        repositories.refreshrepo('url', self.path, self.config,
+                                 branch='branch')
+        self.assertEqual(git_mock.bake().fetch.call_count, 1)
+        self.assertEqual(git_mock.bake().reset.call_count, 1)
+
+    def test_refresh_changed(self, git_mock):
+        git_mock.return_value = ('def\trefs/heads/branch\n')
+        git_mock.bake().side_effect = self._git_cmd
+        git_mock.bake().log.return_value = 'def 456'
+        result = repositories.refreshrepo('url', self.path, self.config,
+                                          branch='branch')
+        self.assertEqual(result, ['branch', 'def', '456'])
+        self.assertEqual(git_mock.bake().fetch.call_count, 1)
+        with open(self.cache) as fp:
+            cache = json.load(fp)
+        self.assertEqual(cache['repoinfo'], ['branch', 'def', '456'])
+
+    def test_annotated_tag(self, git_mock):
+        git_mock.return_value = ('aaa\trefs/tags/branch\n'
+                                 'bbb\trefs/tags/branch^{}\n')
+        self.assertEqual(repositories.getremotehash('url', 'branch'), 'bbb')
+
+
+@mock.patch('sh.git', create=True)
+class TestGitMirror(base.TestCase):
+    def setUp(self):
+        super(TestGitMirror, self).setUp()
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        self.mirror_dir = tempfile.mkdtemp()
+        config.set("DEFAULT", "git_mirror_dir", self.mirror_dir)
+        self.config = ConfigOptions(config)
+        self.mirror = os.path.join(self.mirror_dir,
+                                   'https___example.com_repo.git')
+
+    def tearDown(self):
+        super(TestGitMirror, self).tearDown()
+        shutil.rmtree(self.mirror_dir)
+
+    def test_getmirrorpath(self, git_mock):
+        self.assertEqual(repositories.getmirrorpath('https://example.com/repo',
+                                                    self.config),
+                         self.mirror)
+        self.config.git_mirror_dir = ''
+        self.assertEqual(repositories.getmirrorpath('https://example.com/repo',
+                                                    self.config), None)
+
+    @mock.patch('os.rename')
+    def test_clone_with_new_mirror(self, rename_mock, git_mock):
+        repositories.refreshrepo('https://example.com/repo', 'path',
+                                 self.config, branch='branch')
+        expected_git_clone = [
+            mock.call.clone('--mirror', 'https://example.com/repo',
+                            self.mirror + '.tmp', _tty_out=False,
+                            _timeout=3600),
+            mock.call.clone('--reference', self.mirror,
+                            'https://example.com/repo', 'path')]
+        expected_git_fetch = [mock.call.fetch(
+            '--prune', self.mirror, '+refs/heads/*:refs/remotes/origin/*',
+            '+refs/tags/*:refs/tags/*')]
+        self.assertEqual(git_mock.clone.call_args_list, expected_git_clone)
+        self.assertEqual(git_mock.bake().config.call_args_list,
+                         [mock.call('gc.pruneExpire', 'never')])
+        self.assertEqual(git_mock.bake().fetch.call_args_list,
+                         expected_git_fetch)
+        rename_mock.assert_called_once_with(self.mirror + '.tmp', self.mirror)
+
+    def test_clone_with_existing_mirror(self, git_mock):
+        os.mkdir(self.mirror)
+        repositories.refreshrepo('https://example.com/repo', 'path',
+                                 self.config, branch='branch')
+        expected_git_clone = [
+            mock.call.clone('--reference', self.mirror,
+                            'https://example.com/repo', 'path')]
+        # The mirror is fetched from the remote, the checkout from the mirror
+        expected_git_fetch = [
+            mock.call.fetch('--prune', 'origin'),
+            mock.call.fetch('--prune', self.mirror,
+                            '+refs/heads/*:refs/remotes/origin/*',
+                            '+refs/tags/*:refs/tags/*')]
+        self.assertEqual(git_mock.clone.call_args_list, expected_git_clone)
+        self.assertEqual(git_mock.bake().fetch.call_args_list,
+                         expected_git_fetch)
+
+
+@mock.patch('os.path.exists', return_value=False)
+@mock.patch('sh.git', create=True)
+class TestPartialClone(base.TestCase):
+    def setUp(self):
+        super(TestPartialClone, self).setUp()
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        config.set("DEFAULT", "git_clone_filter", "blob:none")
+        config.set("DEFAULT", "distgit_clone_depth", "10")
+        self.config = ConfigOptions(config)
+
+    def test_clone_filter(self, git_mock, path_mock):
+        repositories.refreshrepo('url', 'path', self.config, branch='branch')
+        self.assertEqual(git_mock.clone.call_args_list,
+                         [mock.call.clone('--filter=blob:none', 'url',
+                                          'path')])
+
+    def test_clone_shallow(self, git_mock, path_mock):
+        repositories.refreshrepo('url', 'path', self.config, branch='branch',
+                                 shallow=True)
+        self.assertEqual(git_mock.clone.call_args_list,
+                         [mock.call.clone('--filter=blob:none', '--depth',
+                                          '10', '--no-single-branch', 'url',
+                                          'path')])
@@ -0,0 +1,89 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from dlrn.config import ConfigOptions
+from dlrn import retry
+from dlrn.tests import base
+from six.moves import configparser
+
+
+class TestRetryPolicy(base.TestCase):
+    def test_parse_retry_limits(self):
+        limits = retry.parse_retry_limits(
+            ['No route to host:10', '',
+             'distroinfo.exception.CommandFailed: Command failed:1'])
+        self.assertEqual(limits, {
+            'No route to host': 10,
+            'distroinfo.exception.CommandFailed: Command failed': 1})
+        self.assertRaises(ValueError, retry.parse_retry_limits,
+                          ['No route to host'])
+
+    def test_should_retry(self):
+        policy = retry.RetryPolicy(3, limits={'No route to host': 5})
+        self.assertFalse(policy.should_retry(None, 0))
+        self.assertTrue(policy.should_retry('Connection timed out', 2))
+        self.assertFalse(policy.should_retry('Connection timed out', 3))
+        self.assertTrue(policy.should_retry('No route to host', 4))
+        self.assertFalse(policy.should_retry('No route to host', 5))
+
+    def test_no_backoff(self):
+        policy = retry.RetryPolicy(3)
+        self.assertEqual(policy.delay(2), 0)
+        self.assertIsNone(policy.next_retry_at(2))
+
+    @mock.patch('dlrn.retry.random.uniform', side_effect=lambda a, b: b)
+    def test_backoff(self, rand_mock):
+        policy = retry.RetryPolicy(3, backoff=60, backoff_max=300)
+        self.assertEqual(policy.delay(0), 60)
+        self.assertEqual(policy.delay(1), 120)
+        self.assertEqual(policy.delay(2), 240)
+        self.assertEqual(policy.delay(3), 300)
+        self.assertEqual(policy.next_retry_at(1, now=1000), 1120)
+        rand_mock.assert_called_with(60.0, 120)
+
+    def test_backoff_jitter(self):
+        policy = retry.RetryPolicy(3, backoff=60)
+        for i in range(20):
+            self.assertTrue(120 <= policy.delay(2) <= 240)
+
+
+class TestGetRetryPolicy(base.TestCase):
+    def setUp(self):
+        super(TestGetRetryPolicy, self).setUp()
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        config.set('DEFAULT', 'retry_limits',
+                   'No route to host:10,Unknown error:2')
+        self.config = ConfigOptions(config)
+
+    @mock.patch('dlrn.retry.logger')
+    def test_get_retry_policy(self, log_mock):
+        policy = retry.get_retry_policy(self.config)
+        self.assertEqual(policy.limits, {'No route to host': 10,
+                                         'Unknown error': 2})
+        log_mock.warning.assert_called_once_with(
+            'The retry_limits pattern Unknown error is not a known error '
+            'pattern, its limit will not be used')
+        # The policy is only built once for the same configuration
+        self.assertIs(retry.get_retry_policy(self.config), policy)
+        self.assertEqual(log_mock.warning.call_count, 1)
+        self.config.retry_limits = ['No route to host:5']
+        self.assertEqual(retry.get_retry_policy(self.config).limits,
+                         {'No route to host': 5})
+
+    def test_invalid_retry_limits(self):
+        config = configparser.RawConfigParser()
+        config.read("projects.ini")
+        config.set('DEFAULT', 'retry_limits', 'No route to host')
+        self.assertRaises(RuntimeError, ConfigOptions, config)
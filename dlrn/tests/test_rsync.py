@@ -22,6 +22,11 @@ from dlrn.tests import base
 from six.moves import configparser
 
 
+RSYNC_OPTIONS = ['-avzR', '--delete-delay',
+                 '--skip-compress=rpm/gz/xz/zst/bz2', '--stats', '-e',
+                 'ssh -p 30000 -o StrictHostKeyChecking=no']
+
+
 @mock.patch('sh.rsync', create=True)
 class TestSyncRepo(base.TestCase):
     def setUp(self):
@@ -48,6 +53,7 @@ class TestSyncRepo(base.TestCase):
 
     def tearDown(self):
         super(TestSyncRepo, self).tearDown()
+        rsync._queue = None
         shutil.rmtree(self.config.datadir)
         shutil.rmtree(self.config.scriptsdir)
 
@@ -57,8 +63,7 @@ class TestSyncRepo(base.TestCase):
         repodir = os.path.join(self.config.datadir, 'repos', '.')
 
         rsync.sync_repo(self.commit)
-        expected = [mock.call('-avzR', '--delete-delay', '-e',
-                              'ssh -p 30000 -o StrictHostKeyChecking=no',
+        expected = [mock.call(RSYNC_OPTIONS,
                               [yumdir,
                                os.path.join(repodir, 'report.html'),
                                os.path.join(repodir, 'status_report.html'),
@@ -76,8 +81,7 @@ class TestSyncRepo(base.TestCase):
         repodir = os.path.join(self.config.datadir, 'repos', '.')
 
         rsync.sync_repo(self.commit)
-        expected = [mock.call('-avzR', '--delete-delay', '-e',
-                              'ssh -p 30000 -o StrictHostKeyChecking=no',
+        expected = [mock.call(RSYNC_OPTIONS,
                               [yumdir,
                                os.path.join(repodir, 'report.html'),
                                os.path.join(repodir, 'status_report.html'),
@@ -91,8 +95,7 @@ class TestSyncRepo(base.TestCase):
         repodir = os.path.join(self.config.datadir, 'repos', '.')
 
         rsync.sync_symlinks(self.commit)
-        expected = [mock.call('-avzR', '--delete-delay', '-e',
-                              'ssh -p 30000 -o StrictHostKeyChecking=no',
+        expected = [mock.call(RSYNC_OPTIONS,
                               [os.path.join(repodir, 'consistent'),
                                os.path.join(repodir, 'current')],
                               'user@host:/directory')]
@@ -104,8 +107,7 @@ class TestSyncRepo(base.TestCase):
         repodir = os.path.join(self.config.datadir, 'repos', '.')
 
         rsync.sync_symlinks(self.commit)
-        expected = [mock.call('-avzR', '--delete-delay', '-e',
-                              'ssh -p 30000 -o StrictHostKeyChecking=no',
+        expected = [mock.call(RSYNC_OPTIONS,
                               ['--exclude', 'consistent/delorean.repo',
                                '--exclude', 'consistent/delorean.repo.md5',
                                '--exclude', 'consistent/versions.csv',
@@ -119,8 +121,7 @@ class TestSyncRepo(base.TestCase):
                                os.path.join(repodir, 'consistent'),
                                os.path.join(repodir, 'current')],
                               'user@host:/directory'),
-                    mock.call('-avzR', '--delete-delay', '-e',
-                              'ssh -p 30000 -o StrictHostKeyChecking=no',
+                    mock.call(RSYNC_OPTIONS,
                               ['%s/delorean.repo' %
                                os.path.join(repodir, 'consistent'),
                                '%s/delorean.repo.md5' %
@@ -135,3 +136,104 @@ class TestSyncRepo(base.TestCase):
                                os.path.join(repodir, 'current')],
                               'user@host:/directory')]
         self.assertEqual(sh_mock.call_args_list, expected)
+
+    def test_sync_repo_multiplex(self, sh_mock):
+        self.config.rsync_ssh_multiplex = True
+        rsync.sync_repo(self.commit)
+        self.assertEqual(sh_mock.call_args_list[0][0][0][-1],
+                         'ssh -p 30000 -o StrictHostKeyChecking=no '
+                         '-o ControlMaster=auto -o ControlPath=~/.ssh/'
+                         'dlrn-%C -o ControlPersist=60')
+
+    def _make_commit_dirs(self):
+        repodir = os.path.join(self.config.datadir, 'repos')
+        other = db.Commit(dt_commit=124, project_name='bar',
+                          commit_hash='2c67b1ab8c6fe273d4e175a14f0df5'
+                                      'd3cbbd0edf',
+                          distro_hash='d31d1b18eb5ab5aed6721fc4fad06c9'
+                                      'bd242490f')
+        for commit in (self.commit, other):
+            os.makedirs(os.path.join(repodir,
+                                     commit.getshardedcommitdir()))
+        return repodir, other
+
+    def test_sync_repo_queue(self, sh_mock):
+        self.config.rsync_workers = 1
+        repodir, other = self._make_commit_dirs()
+        for name in ('current', 'consistent'):
+            os.symlink(other.getshardedcommitdir(),
+                       os.path.join(repodir, name))
+
+        with mock.patch.object(rsync.RsyncQueue, '_start'):
+            # Queue the transfers, without starting the background thread
+            rsync.sync_repo(self.commit)
+            rsync.sync_repo(other)
+            rsync.sync_symlinks(other)
+        self.assertEqual(sh_mock.call_count, 0)
+        self.assertTrue(rsync.wait_for_sync())
+
+        yumdir = os.path.join(repodir, '.')
+        self.assertEqual(sh_mock.call_count, 2)
+        # Both commit dirs are sent in a single transfer, then the symlinks
+        self.assertEqual(
+            sh_mock.call_args_list[0][0][1][:2],
+            [os.path.join(yumdir, self.commit.getshardedcommitdir()),
+             os.path.join(yumdir, other.getshardedcommitdir())])
+        self.assertEqual(sh_mock.call_args_list[1][0][1],
+                         [os.path.join(yumdir, 'consistent'),
+                          os.path.join(yumdir, 'current')])
+
+    def test_sync_repo_queue_newer_symlinks(self, sh_mock):
+        self.config.rsync_workers = 2
+        repodir, other = self._make_commit_dirs()
+        os.symlink(self.commit.getshardedcommitdir(),
+                   os.path.join(repodir, 'current'))
+
+        with mock.patch.object(rsync.RsyncQueue, '_start'):
+            rsync.sync_repo(self.commit)
+            rsync.sync_symlinks(self.commit)
+            # The symlink now points to a commit not queued yet
+            os.remove(os.path.join(repodir, 'current'))
+            os.symlink(other.getshardedcommitdir(),
+                       os.path.join(repodir, 'current'))
+        self.assertTrue(rsync.wait_for_sync())
+        # The symlinks were not sent
+        self.assertEqual(sh_mock.call_count, 1)
+
+    def test_sync_repo_queue_failed(self, sh_mock):
+        self.config.rsync_workers = 2
+        repodir, other = self._make_commit_dirs()
+        sh_mock.side_effect = Exception('Connection refused')
+
+        with mock.patch.object(rsync.RsyncQueue, '_start'):
+            rsync.sync_repo(self.commit)
+            rsync.sync_repo(other)
+        self.assertFalse(rsync.wait_for_sync())
+        # One transfer per worker
+        self.assertEqual(sh_mock.call_count, 2)
+        # The failed dirs are kept for the next attempt
+        self.assertEqual(len(rsync._queue.dirs), 2)
+        # Until the caller gets the failed commits
+        self.assertEqual(sorted(rsync.get_failed_syncs()),
+                         sorted([rsync.commit_key(self.commit),
+                                 rsync.commit_key(other)]))
+        self.assertEqual(rsync._queue.dirs, [])
+        self.assertEqual(rsync.get_failed_syncs(), [])
+
+    def test_sync_repo_options(self, sh_mock):
+        self.config.rsync_options = ['-aR', '--delete-after']
+        self.config.rsync_skip_compress = ['']
+        self.config.rsync_whole_file = True
+        sh_mock.return_value = ('Number of files: 10\n'
+                                'Total bytes sent: 1,234,567\n'
+                                'Total bytes received: 1,234\n')
+
+        rsync.sync_repo(self.commit)
+        self.assertEqual(sh_mock.call_args_list[0][0][0],
+                         ['-aR', '--delete-after', '--whole-file', '--stats',
+                          '-e', 'ssh -p 30000 -o StrictHostKeyChecking=no'])
+        stats = rsync.get_stats(self.config)
+        self.assertEqual(stats['transfers'], 1)
+        self.assertEqual(stats['bytes_sent'], 1234567)
+        rsync.sync_repo(self.commit)
+        self.assertEqual(rsync.get_stats(self.config)['transfers'], 2)
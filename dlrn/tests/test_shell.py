@@ -16,7 +16,9 @@ import os
 import shutil
 import sys
 import tempfile
+import time
 
+from dlrn.circuit_breaker import CircuitBreaker
 from dlrn.config import ConfigOptions
 from dlrn import db
 from dlrn.drivers.rdoinfo import RdoInfoDriver
@@ -24,6 +26,7 @@ from dlrn import shell
 from dlrn.tests import base
 from dlrn import utils
 
+from multiprocessing.pool import ThreadPool
 from six.moves import configparser
 
 
@@ -91,13 +94,14 @@ class TestProcessBuildResult(base.TestCase):
         shutil.rmtree(self.config.scriptsdir)
         os.close(self.db_fd)
 
+    @mock.patch('dlrn.shell.record_timings')
     @mock.patch('os.rename')
     @mock.patch('os.symlink')
     @mock.patch('dlrn.shell.export_commit_yaml')
     @mock.patch('dlrn.shell.genreports')
     @mock.patch('dlrn.shell.sync_repo')
     def test_successful_build(self, rs_mock, gr_mock, ec_mock, sl_mock,
-                              rn_mock):
+                              rn_mock, rt_mock):
         built_rpms = ['foo-1.2.3.rpm']
         status = [self.commit, built_rpms, 'OK', None]
         output = shell.process_build_result(status, self.packages,
@@ -108,6 +112,7 @@ class TestProcessBuildResult(base.TestCase):
         self.assertEqual(ec_mock.call_count, 1)
         self.assertEqual(sl_mock.call_count, 1)
         self.assertEqual(rn_mock.call_count, 1)
+        rt_mock.assert_called_once_with(self.config.datadir, self.commit)
 
     @mock.patch('dlrn.shell.export_commit_yaml')
     @mock.patch('dlrn.shell.sendnotifymail')
@@ -140,13 +145,14 @@ class TestProcessBuildResult(base.TestCase):
         self.assertEqual(sm_mock.call_count, 1)
         self.assertEqual(sr_mock.call_count, 1)
 
+    @mock.patch('dlrn.shell.record_timings')
     @mock.patch('os.rename')
     @mock.patch('os.symlink')
     @mock.patch('dlrn.shell.export_commit_yaml')
     @mock.patch('dlrn.shell.genreports')
     @mock.patch('dlrn.shell.sync_repo')
     def test_successful_build_component(self, rs_mock, gr_mock, ec_mock,
-                                        sl_mock, rn_mock):
+                                        sl_mock, rn_mock, rt_mock):
         built_rpms = ['foo-1.2.3.rpm']
         self.config.use_components = True
         self.commit.component = 'foo'
@@ -161,6 +167,66 @@ class TestProcessBuildResult(base.TestCase):
         self.assertEqual(sl_mock.call_count, 4)
         self.assertEqual(rn_mock.call_count, 4)
 
+    @mock.patch('dlrn.shell.export_commit_yaml')
+    @mock.patch('dlrn.shell.sendnotifymail')
+    @mock.patch('dlrn.shell.genreports')
+    @mock.patch('dlrn.shell.sync_repo')
+    def test_known_error_retry_backoff(self, rs_mock, gr_mock, sm_mock,
+                                       ec_mock):
+        self.config.retry_backoff = 60
+        status = [self.commit, '', '', 'Error: Nothing to do']
+        now = time.time()
+        output = shell.process_build_result(status, self.packages,
+                                            self.session, [])
+        self.assertEqual(output, 2)
+        self.assertEqual(self.commit.status, 'RETRY')
+        self.assertEqual(sm_mock.call_count, 0)
+        # First retry, between half and the whole backoff time
+        self.assertGreaterEqual(self.commit.next_retry_at, int(now) + 30)
+        self.assertLessEqual(self.commit.next_retry_at, int(now) + 61)
+        self.assertEqual(
+            utils.get_known_error_stats(self.config.datadir),
+            {'Error: Nothing to do': 1})
+
+    @mock.patch('dlrn.shell.export_commit_yaml')
+    @mock.patch('dlrn.shell.sendnotifymail')
+    @mock.patch('dlrn.shell.genreports')
+    @mock.patch('dlrn.shell.sync_repo')
+    def test_known_error_retry_limit(self, rs_mock, gr_mock, sm_mock,
+                                     ec_mock):
+        self.config.retry_limits = ['Error: Nothing to do:0']
+        status = [self.commit, '', '', 'Error: Nothing to do']
+        output = shell.process_build_result(status, self.packages,
+                                            self.session, [])
+        self.assertEqual(output, 1)
+        self.assertEqual(self.commit.status, 'FAILED')
+        self.assertIsNone(self.commit.next_retry_at)
+        self.assertEqual(sm_mock.call_count, 1)
+
+    @mock.patch('dlrn.shell.submit_review')
+    @mock.patch('dlrn.shell.sendnotifymail')
+    @mock.patch('dlrn.shell.get_failed_syncs')
+    @mock.patch('dlrn.shell.wait_for_sync', return_value=False)
+    def test_finish_sync_failed(self, ws_mock, gf_mock, sm_mock, sr_mock):
+        self.config.gerrit = 'yes'
+        commit = self.session.query(db.Commit).filter(
+            db.Commit.status == 'SUCCESS').first()
+        gf_mock.return_value = [(commit.project_name, commit.commit_hash,
+                                 commit.distro_hash, commit.extended_hash,
+                                 commit.type)]
+        self.assertFalse(shell.finish_sync(self.packages, self.config,
+                                           session=self.session))
+        self.assertEqual(commit.status, 'FAILED')
+        self.assertEqual(sm_mock.call_count, 1)
+        self.assertEqual(sr_mock.call_count, 1)
+
+    @mock.patch('dlrn.shell.get_failed_syncs')
+    @mock.patch('dlrn.shell.wait_for_sync', return_value=True)
+    def test_finish_sync(self, ws_mock, gf_mock):
+        self.assertTrue(shell.finish_sync(self.packages, self.config,
+                                          session=self.session))
+        self.assertEqual(gf_mock.call_count, 0)
+
 
 @mock.patch('sh.createrepo_c', create=True)
 class TestPostBuild(base.TestCase):
@@ -222,6 +288,9 @@ class TestPostBuild(base.TestCase):
         expected = [mock.call(yumdir)]
         self.assertEqual(sh_mock.call_args_list, expected)
         self.assertEqual(output, 1)     # 1 non-successfully built package
+        timings = utils.get_timings(self.commit)
+        self.assertIn('post_build', timings)
+        self.assertIn('createrepo', timings)
 
     def test_successful_build_no_failures(self, sh_mock):
         packages = [{'upstream': 'https://github.com/openstack/foo',
@@ -317,6 +386,50 @@ class TestPostBuild(base.TestCase):
         self.assertEqual(output, 0)
 
 
+class TestPrintProfile(base.TestCase):
+    @mock.patch('dlrn.shell.print')
+    def test_print_profile(self, print_mock):
+        commits = [db.Commit(timings='{"build": 10.0, "refresh": 1.0}'),
+                   db.Commit(timings='{"build": 20.0, "custom": 2.0}'),
+                   db.Commit()]
+        shell.print_profile(commits)
+        lines = [c[0][0].split() for c in print_mock.call_args_list]
+        self.assertEqual(lines[1], ['refresh', '1', '1.00', '1.00', '1.00'])
+        self.assertEqual(lines[2], ['build', '2', '30.00', '15.00',
+                                    '20.00'])
+        self.assertEqual(lines[3], ['custom', '1', '2.00', '2.00', '2.00'])
+
+
+class TestStopBuilds(base.TestCase):
+    def test_stop_builds_own_pool(self):
+        pool = mock.MagicMock()
+        shell._stop_builds(pool, None, iter([]), mock.MagicMock())
+        pool.terminate.assert_called_once_with()
+        pool.join.assert_called_once_with()
+
+    def test_stop_builds_shared_pool(self):
+        pool = ThreadPool(1)
+        breaker = CircuitBreaker(0)
+        commits = [db.Commit(project_name='foo', commit_hash='%d' % i)
+                   for i in range(10)]
+        built = []
+
+        def _build(commit):
+            built.append(commit)
+            return [commit]
+
+        iterator = pool.imap(_build, breaker.gate(commits, 2))
+        next(iterator)
+        breaker.done()
+        breaker.stop()
+        shell._stop_builds(pool, pool, iterator, breaker)
+        # The builds not dispatched yet are dropped, and the pool is kept
+        self.assertLess(len(built), len(commits))
+        self.assertEqual(pool.apply(len, ([1, 2],)), 2)
+        pool.close()
+        pool.join()
+
+
 class TestRecheck(base.TestCase):
     def setUp(self):
         super(TestRecheck, self).setUp()
@@ -486,6 +599,62 @@ class TestAddCommits(base.TestCase):
                            self.session)
         self.assertEqual(len(self.toprocess), 2)
 
+    def test_add_commits_refresh_time(self):
+        commits = []
+        for i in range(2):
+            commits.append(db.Commit(dt_commit=123 + i, project_name='foo',
+                                     type="rpm", commit_hash='%d' % i * 40,
+                                     distro_hash='c31d1b18eb5ab5aed6721fc4f'
+                                                 'ad06c9bd242490f',
+                                     timings='{"refresh": 2.5}'))
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session)
+        # The refresh time is only counted once
+        self.assertEqual(utils.get_timings(self.toprocess[0]),
+                         {'refresh': 2.5})
+        self.assertEqual(utils.get_timings(self.toprocess[1]), {})
+
+    def _retry_commits(self, next_retry_at):
+        commits = []
+        for i in range(2):
+            commits.append(db.Commit(dt_commit=123 + i, project_name='foo',
+                                     type="rpm", commit_hash='%d' % i * 40,
+                                     repo_dir='/home/dlrn/data/foo',
+                                     distro_hash='c31d1b18eb5ab5aed6721fc4f'
+                                                 'ad06c9bd242490f',
+                                     dt_distro=123,
+                                     distgit_dir='/home/dlrn/data/foo_distro',
+                                     commit_branch='master'))
+        retried = db.Commit(dt_commit=123, project_name='foo', type="rpm",
+                            commit_hash=commits[0].commit_hash,
+                            distro_hash=commits[0].distro_hash,
+                            dt_distro=123, commit_branch='master',
+                            dt_build=1441245153, status='RETRY',
+                            next_retry_at=next_retry_at)
+        self.session.add(retried)
+        self.session.commit()
+        return commits
+
+    def test_retry_backoff(self):
+        # The retried commit and the ones after it wait for the backoff
+        commits = self._retry_commits(int(time.time()) + 600)
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session)
+        self.assertEqual(self.toprocess, [])
+
+    def test_retry_backoff_expired(self):
+        commits = self._retry_commits(int(time.time()) - 1)
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session)
+        self.assertEqual(self.toprocess, commits)
+
+    def test_retry_backoff_dev(self):
+        commits = self._retry_commits(int(time.time()) + 600)
+        self.options.dev = True
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session)
+        self.assertEqual(self.toprocess, commits)
+
     def test_commit_already_processed(self):
         commit = db.Commit(dt_commit=1441634092, project_name='python-pysaml2',
                            type="rpm",
@@ -580,3 +749,58 @@ class TestAddCommits(base.TestCase):
         shell._add_commits([commit], self.toprocess, self.options,
                            self.session)
         self.assertEqual(len(self.toprocess), 1)
+
+    def _pending_commits(self, count):
+        commits = []
+        for i in range(count):
+            commits.append(db.Commit(dt_commit=1600000000 + i,
+                                     project_name='foo', type="rpm",
+                                     commit_hash='%040d' % i,
+                                     repo_dir='/home/dlrn/data/foo',
+                                     distro_hash='%040d' % 99,
+                                     dt_distro=1600000000,
+                                     distgit_dir='/home/dlrn/data/foo_distro',
+                                     commit_branch='master'))
+        return commits
+
+    def test_coalesce_head(self):
+        commits = self._pending_commits(4)
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session, coalesce_policy='head')
+        self.assertEqual(self.toprocess, [commits[-1]])
+        skipped = self.session.query(db.Commit).filter(
+            db.Commit.status == 'SKIPPED').all()
+        self.assertEqual(len(skipped), 3)
+        self.assertIn(commits[-1].commit_hash, skipped[0].notes)
+
+    def test_coalesce_every_n(self):
+        commits = self._pending_commits(7)
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session, coalesce_policy='3')
+        self.assertEqual(self.toprocess,
+                         [commits[2], commits[5], commits[6]])
+        skipped = self.session.query(db.Commit).filter(
+            db.Commit.status == 'SKIPPED').count()
+        self.assertEqual(skipped, 4)
+
+    @mock.patch('dlrn.shell.gettaggedcommits')
+    def test_coalesce_tags(self, tc_mock):
+        commits = self._pending_commits(4)
+        tc_mock.return_value = set([commits[1].commit_hash])
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session, coalesce_policy='tags')
+        self.assertEqual(self.toprocess, [commits[1], commits[3]])
+        self.assertEqual(tc_mock.call_count, 1)
+
+    def test_coalesce_invalid_policy(self):
+        commits = self._pending_commits(3)
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session, coalesce_policy='foo')
+        self.assertEqual(self.toprocess, commits)
+
+    def test_coalesce_dev_mode(self):
+        self.options.dev = True
+        commits = self._pending_commits(3)
+        shell._add_commits(commits, self.toprocess, self.options,
+                           self.session, coalesce_policy='head')
+        self.assertEqual(self.toprocess, commits)
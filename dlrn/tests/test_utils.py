@@ -87,6 +87,92 @@ class TestIsKnownError(base.TestCase):
         self.assertFalse(utils.isknownerror(self.logfile),
                          msg="isknownerror found unknown error")
 
+    def test_find_known_error_chunks(self):
+        with open(self.logfile, "w") as fp:
+            fp.write("Could not resolve host: example.com\n")
+            for i in range(100):
+                fp.write("line %d\n" % i)
+            fp.write("Error: No route to host\n")
+            for i in range(100):
+                fp.write("line %d\n" % i)
+        # Errors are looked for from the end of the file, and the chunk
+        # boundaries do not split the lines
+        for chunk_size in (7, 64, 4096):
+            self.assertEqual(utils.find_known_error(self.logfile,
+                                                    chunk_size=chunk_size),
+                             'No route to host')
+
+    def test_find_known_error_patterns(self):
+        with open(self.logfile, "w") as fp:
+            fp.write("Error: Nothing to do\nmirror 503 Service Unavailable")
+        self.assertEqual(utils.find_known_error(self.logfile,
+                                                [r'mirror \d+ Service',
+                                                 'Nothing to do']),
+                         r'mirror \d+ Service')
+        self.assertIsNone(utils.find_known_error(self.logfile, ['Timeout']))
+
+    def test_find_known_error_binary(self):
+        with open(self.logfile, "wb") as fp:
+            fp.write(b"\xff\xfe invalid utf-8\nConnection timed out\n")
+        self.assertEqual(utils.find_known_error(self.logfile),
+                         'Connection timed out')
+
+    def test_get_known_errors(self):
+        self.assertEqual(utils.get_known_errors(), utils.KNOWN_ERRORS)
+        self.assertEqual(utils.get_known_errors('/unknownfile'),
+                         utils.KNOWN_ERRORS)
+        with open(self.logfile, "w") as fp:
+            fp.write("# Comment\n\nmirror \\d+ Service\nTimeout\n")
+        self.assertEqual(utils.get_known_errors(self.logfile),
+                         [r'mirror \d+ Service', 'Timeout'])
+
+    def test_get_known_errors_invalid(self):
+        with open(self.logfile, "w") as fp:
+            fp.write("ba(r\n(?i)foo\nTimeout\n")
+        self.assertEqual(utils.get_known_errors(self.logfile), ['Timeout'])
+        with open(self.logfile, "w") as fp:
+            fp.write("ba(r\n")
+        self.assertEqual(utils.get_known_errors(self.logfile),
+                         utils.KNOWN_ERRORS)
+
+    def test_find_known_error_invalid(self):
+        with open(self.logfile, "w") as fp:
+            fp.write("Connection timed out\n")
+        self.assertIsNone(utils.find_known_error(self.logfile,
+                                                 ['ba(r', 'Timeout']))
+        self.assertEqual(utils.find_known_error(self.logfile, ['ba(r']),
+                         'Connection timed out')
+
+    def test_record_known_error(self):
+        datadir = tempfile.mkdtemp()
+        self.assertEqual(utils.get_known_error_stats(datadir), {})
+        utils.record_known_error(datadir, 'Timeout')
+        utils.record_known_error(datadir, 'Timeout')
+        utils.record_known_error(datadir, 'No route to host')
+        self.assertEqual(utils.get_known_error_stats(datadir),
+                         {'Timeout': 2, 'No route to host': 1})
+        shutil.rmtree(datadir)
+
+    def test_record_timings(self):
+        datadir = tempfile.mkdtemp()
+        self.assertEqual(utils.get_phase_stats(datadir), {})
+        utils.record_timings(datadir, db.Commit(
+            timings='{"build": 42.0, "srpm": 3.5}'))
+        utils.record_timings(datadir, db.Commit(timings='{"build": 400.0}'))
+        utils.record_timings(datadir, db.Commit())
+        stats = utils.get_phase_stats(datadir)
+        shutil.rmtree(datadir)
+        self.assertEqual(stats['build']['count'], 2)
+        self.assertEqual(stats['build']['sum'], 442.0)
+        self.assertEqual(stats['build']['buckets'],
+                         [0, 0, 0, 0, 1, 1, 1, 2, 2, 2, 2])
+        self.assertEqual(stats['srpm']['buckets'][:2], [0, 1])
+
+    def test_remove_timing(self):
+        commit = db.Commit(timings='{"build": 42.0, "refresh": 3.5}')
+        utils.remove_timing(commit, 'refresh')
+        self.assertEqual(utils.get_timings(commit), {'build': 42.0})
+
 
 class TestAggregateRepo(base.TestCase):
     def setUp(self):
@@ -134,6 +220,74 @@ class TestAggregateRepo(base.TestCase):
             contents = fp.read()
         assert contents == 'TESTING ONE TWO THREE\n'
 
+    @patch('os.symlink', wraps=os.symlink)
+    def test_aggregate_repo_files_unchanged(self, sl_mock):
+        with open('./dlrn/tests/samples/rdo.yml') as f:
+            packages = yaml.load(f, Loader=SafeLoader)['packages']
+        utils.aggregate_repo_files('test1', self.datadir, self.session,
+                                   'delorean', packages, hashed_dir=True)
+        self.assertEqual(sl_mock.call_count, 3)
+        file_hash = hashlib.md5(b'TESTING ONE TWO THREE\n').hexdigest()
+        target = os.path.join(self.datadir, 'repos', 'test1', file_hash[:2],
+                              file_hash[2:4], file_hash, 'delorean.repo')
+        mtime = os.stat(target).st_mtime_ns
+        # Nothing is written if the aggregate did not change
+        with patch('dlrn.utils.open', create=True,
+                   side_effect=open) as open_mock:
+            result = utils.aggregate_repo_files('test1', self.datadir,
+                                                self.session, 'delorean',
+                                                packages, hashed_dir=True)
+        self.assertEqual(result, file_hash)
+        self.assertEqual(sl_mock.call_count, 3)
+        self.assertEqual(os.stat(target).st_mtime_ns, mtime)
+        for args, kwargs in open_mock.call_args_list:
+            self.assertEqual(args[1], 'r')
+        # The component repo file was not read again
+        self.assertNotIn(call(os.path.join(self.repodir, 'delorean.repo'),
+                              'r'), open_mock.call_args_list)
+
+    def test_aggregate_repo_files_component_changed(self):
+        with open('./dlrn/tests/samples/rdo.yml') as f:
+            packages = yaml.load(f, Loader=SafeLoader)['packages']
+        utils.aggregate_repo_files('test1', self.datadir, self.session,
+                                   'delorean', packages, hashed_dir=True)
+        # Add a commit for a new component
+        commit = db.Commit(project_name='openstack-nova',
+                           commit_hash='1234', distro_hash='5678',
+                           status='SUCCESS', component='compute',
+                           dt_commit=1, dt_distro=1, dt_build=1)
+        self.session.add(commit)
+        self.session.commit()
+        repodir = os.path.join(self.datadir, 'repos/component/compute/test1')
+        os.makedirs(repodir)
+        with open(os.path.join(repodir, "delorean.repo"), 'w') as fp:
+            fp.write("COMPUTE")
+        result = utils.aggregate_repo_files('test1', self.datadir,
+                                            self.session, 'delorean',
+                                            packages, hashed_dir=True)
+        self.assertEqual(result, hashlib.md5(
+            b'COMPUTE\nTESTING ONE TWO THREE\n').hexdigest())
+        with open(os.path.join(self.datadir, 'repos', 'test1',
+                               'delorean.repo')) as fp:
+            self.assertEqual(fp.read(), 'COMPUTE\nTESTING ONE TWO THREE\n')
+
+    def test_get_component_list(self):
+        self.assertEqual(utils.get_component_list(self.session),
+                         ['tripleo'])
+        commit = db.Commit(project_name='openstack-nova',
+                           commit_hash='1234', distro_hash='5678',
+                           status='SUCCESS', component='compute',
+                           dt_commit=1, dt_distro=1, dt_build=1)
+        self.session.add(commit)
+        self.session.commit()
+        self.assertEqual(utils.get_component_list(self.session),
+                         ['compute', 'tripleo'])
+        # Components are dropped along with their commits
+        self.session.delete(commit)
+        self.session.commit()
+        self.assertEqual(utils.get_component_list(self.session),
+                         ['tripleo'])
+
 
 class TestFetchRemoteFile(base.TestCase):
     def setUp(self):
@@ -159,6 +313,24 @@ class TestFetchRemoteFile(base.TestCase):
         results = utils.fetch_remote_file('http://example.com')
         assert results == expected_results
 
+    @requests_mock.Mocker()
+    def test_fetch_url_cached(self, url):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        url.get('http://example.com', text='Line1\nLine2\n',
+                headers={'ETag': '"abc"'})
+        results = utils.fetch_remote_file('http://example.com',
+                                          cache_dir=cache_dir)
+        assert results == ["Line1\n", "Line2\n"]
+        assert 'If-None-Match' not in url.last_request.headers
+
+        url.get('http://example.com', status_code=304)
+        results = utils.fetch_remote_file('http://example.com',
+                                          cache_dir=cache_dir)
+        assert results == ["Line1\n", "Line2\n"]
+        assert url.last_request.headers['If-None-Match'] == '"abc"'
+        assert url.call_count == 2
+
 
 class TestRenameOutputDir(base.TestCase):
     @patch('dlrn.db.Commit.getshardedcommitdir')
@@ -188,6 +360,82 @@ class TestRenameOutputDir(base.TestCase):
         assert results == expected_results
 
 
+class TestTimings(base.TestCase):
+    @patch('time.time', side_effect=[10.0, 12.5, 20.0, 21.0])
+    def test_timed_phase(self, time_mock):
+        commit = db.Commit()
+        self.assertEqual(utils.get_timings(commit), {})
+        with utils.timed_phase(commit, 'build'):
+            pass
+        with utils.timed_phase(commit, 'build'):
+            pass
+        utils.add_timing(commit, 'srpm', 3)
+        self.assertEqual(utils.get_timings(commit),
+                         {'build': 3.5, 'srpm': 3})
+
+    def test_timings_yaml(self):
+        commit = db.Commit(type='rpm', timings='{"build": 1.5}')
+        tmpdir = tempfile.mkdtemp()
+        yamlfile = os.path.join(tmpdir, 'commit.yaml')
+        utils.saveYAML_commit(commit, yamlfile)
+        loaded = utils.loadYAML_list(yamlfile)[0]
+        self.assertEqual(utils.get_timings(loaded), {'build': 1.5})
+        commit.timings = None
+        utils.saveYAML_commit(commit, yamlfile)
+        self.assertIsNone(utils.loadYAML_list(yamlfile)[0].timings)
+        shutil.rmtree(tmpdir)
+
+
+class TestYAML(base.TestCase):
+    def setUp(self):
+        super(TestYAML, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.session = db.getSession("sqlite:///%s" %
+                                     os.path.join(self.tmpdir, 'src.db'))
+        utils.loadYAML(self.session, './dlrn/tests/samples/commits_2.yaml',
+                       batch_size=2)
+
+    def tearDown(self):
+        super(TestYAML, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_load(self):
+        yamlfile = os.path.join(self.tmpdir, 'db.yaml')
+        utils.saveYAML(self.session, yamlfile, batch_size=2)
+        with open(yamlfile) as fp:
+            data = yaml.load(fp, Loader=SafeLoader)
+        self.assertEqual(sorted(data.keys()),
+                         ['civotes', 'civotes_agg', 'commits', 'projects',
+                          'promotions', 'users'])
+        self.assertEqual(data['projects'], [])
+        self.assertEqual(len(data['commits']),
+                         self.session.query(db.Commit).count())
+
+        session = db.getSession("sqlite:///%s" %
+                                os.path.join(self.tmpdir, 'dest.db'))
+        utils.loadYAML(session, yamlfile)
+        for name, model in utils.YAML_TABLES:
+            self.assertEqual(session.query(model).count(),
+                             self.session.query(model).count())
+        vote = session.query(db.CIVote).filter(db.CIVote.id == 1).first()
+        self.assertIs(vote.ci_vote, True)
+        commit = session.query(db.Commit).filter(
+            db.Commit.extended_hash.is_(None)).first()
+        self.assertIsNotNone(commit)
+        # Saving the database again gives the same file
+        utils.saveYAML(session, yamlfile + '.2')
+        with open(yamlfile) as fp1, open(yamlfile + '.2') as fp2:
+            self.assertEqual(fp1.read(), fp2.read())
+
+    @patch('dlrn.utils.yaml.dump', side_effect=yaml.dump)
+    def test_save_streaming(self, dump_mock):
+        utils.saveYAML(self.session, os.path.join(self.tmpdir, 'db.yaml'))
+        # One call per row
+        rows = sum(self.session.query(model).count()
+                   for name, model in utils.YAML_TABLES)
+        self.assertEqual(dump_mock.call_count, rows)
+
+
 class TestRunExternalPreprocess(base.TestCase):
     @patch('sh.env', create=True)
     def test_all_args_except_user(self, mock_sh):
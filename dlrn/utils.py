@@ -11,12 +11,15 @@
 # under the License.
 import fcntl
 import hashlib
+import io
+import json
 import logging
 import os
 import re
 import requests
 import sh
 import sys
+import time
 import yaml
 
 from contextlib import contextmanager
@@ -27,21 +30,41 @@ from dlrn.db import getSession
 from dlrn.db import Project
 from dlrn.db import Promotion
 from dlrn.db import User
-
-re_known_errors = re.compile('Error: Nothing to do|'
-                             'Error downloading packages|'
-                             'No more mirrors to try|'
-                             'Cannot retrieve metalink for repository|'
-                             'Could not retrieve mirrorlist|'
-                             'Failed to synchronize cache for repo|'
-                             'No route to host|'
-                             'Device or resource busy|'
-                             'Could not resolve host|'
-                             'Temporary failure in name resolution|'
-                             'distroinfo.exception.CommandFailed: Command '
-                             'failed with return code 128: git|'
-                             'Error fetching remote|'
-                             'Connection timed out')
+from sqlalchemy import Boolean
+from sqlalchemy import Integer
+
+# Patterns of transient errors in the build logs. When a build fails with
+# one of them, it is retried later instead of being marked as failed
+KNOWN_ERRORS = ['Error: Nothing to do',
+                'Error downloading packages',
+                'No more mirrors to try',
+                'Cannot retrieve metalink for repository',
+                'Could not retrieve mirrorlist',
+                'Failed to synchronize cache for repo',
+                'No route to host',
+                'Device or resource busy',
+                'Could not resolve host',
+                'Temporary failure in name resolution',
+                'distroinfo.exception.CommandFailed: Command '
+                'failed with return code 128: git',
+                'Error fetching remote',
+                'Connection timed out']
+
+re_known_errors = re.compile('|'.join(KNOWN_ERRORS))
+
+# Build logs are scanned for known errors in chunks of this size, starting
+# from the end of the file, where the errors are usually found
+KNOWN_ERRORS_CHUNK_SIZE = 1024 * 1024
+
+# Number of matches for each known error pattern, used by the /metrics API
+# endpoint
+KNOWN_ERRORS_STATS_FILE = 'known-errors-stats.json'
+
+# Running totals of the build phase durations, used by the /metrics API
+# endpoint
+PHASE_STATS_FILE = 'build-phase-stats.json'
+# Upper bounds, in seconds, for the build phase duration histograms
+PHASE_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600]
 
 
 logger = logging.getLogger("dlrn-utils")
@@ -64,57 +87,59 @@ def import_object(import_str, *args, **kwargs):
     return myclass(*args, **kwargs)
 
 
-# Load a yaml file into a db session, used to populate a in memory database
-# during tests
-def loadYAML(session, yamlfile):
-    with open(yamlfile) as fp:
-        data = yaml.safe_load(fp)
-
-    try:
-        for user in data['users']:
-            my_user = User(**user)
-            session.add(my_user)
-            session.commit()
-    except KeyError:
-        pass   # No users in yaml, just ignore
-    for commit in data['commits']:
-        c = Commit(**commit)
+# Number of rows inserted or fetched at a time by loadYAML and saveYAML
+YAML_BATCH_SIZE = 1000
+
+# Use the libyaml bindings when available, they are much faster
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAMLDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Tables saved by saveYAML, in the order they need to be loaded to satisfy
+# the foreign keys
+YAML_TABLES = [('users', User), ('commits', Commit), ('projects', Project),
+               ('civotes', CIVote), ('civotes_agg', CIVote_Aggregate),
+               ('promotions', Promotion)]
+
+
+def _row_from_yaml(model, row):
+    # saveYAML stores every value as a string, convert back the ones the
+    # database driver would not accept
+    row = dict(row)
+    for column in model.__table__.columns:
+        value = row.get(column.name)
+        if not isinstance(value, str):
+            continue
+        if isinstance(column.type, Boolean):
+            row[column.name] = {'True': True, 'False': False}.get(value)
+        elif value == 'None' and isinstance(column.type, Integer):
+            row[column.name] = None
+    if model is Commit:
         # We need a special case for extended_hash, which could be "None"
-        if c.extended_hash == 'None':
-            c.extended_hash = None
+        if row.get('extended_hash') == 'None':
+            row['extended_hash'] = None
+        if row.get('timings') == 'None':
+            row['timings'] = None
         # Retro compatibility before commit type
-        if not c.type:
-            c.type = "rpm"
-        session.add(c)
-        session.commit()
-    try:
-        for project in data['projects']:
-            p = Project(**project)
-            session.add(p)
-            session.commit()
-    except KeyError:
-        pass   # No projects in yaml, just ignore
-    try:
-        for civote in data['civotes']:
-            vote = CIVote(**civote)
-            session.add(vote)
-            session.commit()
-    except KeyError:
-        pass   # No civotes in yaml, just ignore
-    try:
-        for civote in data['civotes_agg']:
-            vote = CIVote_Aggregate(**civote)
-            session.add(vote)
-            session.commit()
-    except KeyError:
-        pass   # No civotes_agg in yaml, just ignore
-    try:
-        for promotion in data['promotions']:
-            p = Promotion(**promotion)
-            session.add(p)
+        if not row.get('type'):
+            row['type'] = "rpm"
+    return row
+
+
+# Load a yaml file into a db session, used to populate a in memory database
+# during tests. The whole document is still parsed with yaml.load before the
+# rows are inserted, only the inserts are done in batches.
+def loadYAML(session, yamlfile, batch_size=YAML_BATCH_SIZE):
+    with open(yamlfile) as fp:
+        data = yaml.load(fp, Loader=YAMLLoader)
+
+    for name, model in YAML_TABLES:
+        # Some tables may not be in the yaml file, just ignore them
+        rows = data.get(name) or []
+        for i in range(0, len(rows), batch_size):
+            session.bulk_insert_mappings(
+                model, [_row_from_yaml(model, row)
+                        for row in rows[i:i + batch_size]])
             session.commit()
-    except KeyError:
-        pass   # No promotions in yaml, just ignore
 
     session.commit()
 
@@ -122,7 +147,7 @@ def loadYAML(session, yamlfile):
 # Load a yaml file into a list of commits
 def loadYAML_list(yamlfile):
     with open(yamlfile) as fp:
-        data = yaml.safe_load(fp)
+        data = yaml.load(fp, Loader=YAMLLoader)
 
     commit_list = []
     for commit in data['commits']:
@@ -130,6 +155,10 @@ def loadYAML_list(yamlfile):
         # We need a special case for extended_hash, which could be "None"
         if c.extended_hash == 'None':
             c.extended_hash = None
+        if c.timings == 'None':
+            c.timings = None
+        if c.next_retry_at == 'None':
+            c.next_retry_at = None
         # Retro compatibility before commit type
         if not c.type:
             c.type = "rpm"
@@ -140,71 +169,28 @@ def loadYAML_list(yamlfile):
 
 # Save a database to yaml, this is a helper function to assist in creating
 # yaml files for unit tests.
-def saveYAML(session, yamlfile):
-    data = {}
-
-    attrs = []
-    for a in Commit.__table__.columns.keys():
-        attrs.append(a)
-    data['commits'] = []
-    for commit in session.query(Commit).all():
-        d = {}
-        for a in attrs:
-            d[a] = str(getattr(commit, a))
-        data['commits'].append(d)
-
-    attrs = []
-    for a in Project.__table__.columns.keys():
-        attrs.append(a)
-    data['projects'] = []
-    for project in session.query(Project).all():
-        d = {}
-        for a in attrs:
-            d[a] = str(getattr(project, a))
-        data['projects'].append(d)
-
-    attrs = []
-    for a in CIVote.__table__.columns.keys():
-        attrs.append(a)
-    data['civotes'] = []
-    for vote in session.query(CIVote).all():
-        d = {}
-        for a in attrs:
-            d[a] = str(getattr(vote, a))
-        data['civotes'].append(d)
-
-    attrs = []
-    for a in CIVote_Aggregate.__table__.columns.keys():
-        attrs.append(a)
-    data['civotes_agg'] = []
-    for vote in session.query(CIVote_Aggregate).all():
-        d = {}
-        for a in attrs:
-            d[a] = str(getattr(vote, a))
-        data['civotes_agg'].append(d)
-
-    attrs = []
-    for a in User.__table__.columns.keys():
-        attrs.append(a)
-    data['users'] = []
-    for user in session.query(User).all():
-        d = {}
-        for a in attrs:
-            d[a] = str(getattr(user, a))
-        data['users'].append(d)
-
-    attrs = []
-    for a in Promotion.__table__.columns.keys():
-        attrs.append(a)
-    data['promotions'] = []
-    for promotion in session.query(Promotion).all():
-        d = {}
-        for a in attrs:
-            d[a] = str(getattr(promotion, a))
-        data['promotions'].append(d)
-
+def saveYAML(session, yamlfile, batch_size=YAML_BATCH_SIZE):
+    # The rows are written one by one, instead of building the whole
+    # document in memory. The output is the same as dumping a dict of
+    # {table: [row, ...]}, with all values as strings
     with open(yamlfile, 'w') as fp:
-        fp.write(yaml.dump(data, default_flow_style=False))
+        for name, model in sorted(YAML_TABLES):
+            table = model.__table__
+            attrs = table.columns.keys()
+            rows = session.execute(table.select().order_by(
+                *table.primary_key.columns)).yield_per(batch_size)
+            empty = True
+            for row in rows:
+                if empty:
+                    fp.write('%s:\n' % name)
+                    empty = False
+                d = {}
+                for a in attrs:
+                    d[a] = str(row._mapping[a])
+                fp.write(yaml.dump([d], Dumper=YAMLDumper,
+                                   default_flow_style=False))
+            if empty:
+                fp.write('%s: []\n' % name)
 
 
 # Save a single commit to yaml
@@ -246,21 +232,157 @@ def getNVRfromlist(rpmlist):
     return ""
 
 
+_known_errors_file_cache = {}
+_known_errors_regex_cache = {}
+
+
+def get_known_errors(patterns_file=None):
+    # Return the list of known error patterns, read from patterns_file if
+    # set. The file contains one regular expression per line, empty lines
+    # and lines starting with # are ignored
+    if not patterns_file:
+        return KNOWN_ERRORS
+    signature = file_signature(patterns_file)
+    if signature is None:
+        logger.warning('Known errors file %s not found, using the default '
+                       'patterns' % patterns_file)
+        return KNOWN_ERRORS
+    cached = _known_errors_file_cache.get(patterns_file)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    patterns = []
+    with open(patterns_file, 'r') as fp:
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            error = _check_known_error(line)
+            if error:
+                logger.warning('Ignoring invalid pattern at %s line %d: %s' %
+                               (patterns_file, number, error))
+                continue
+            patterns.append(line)
+    if not patterns:
+        logger.warning('No valid pattern in known errors file %s, using the '
+                       'default patterns' % patterns_file)
+        patterns = KNOWN_ERRORS
+    _known_errors_file_cache[patterns_file] = (signature, patterns)
+    return patterns
+
+
+def _check_known_error(pattern):
+    # Return why pattern cannot be used as a known error, or None. Patterns
+    # are combined in a single regex, so global flags such as (?i) are not
+    # allowed either
+    try:
+        regex = pattern.encode('utf-8')
+        re.compile(regex, re.MULTILINE)
+        re.compile(b'(?:)|(?:%s)' % regex, re.MULTILINE)
+    except re.error as e:
+        return str(e)
+    return None
+
+
+def _compile_known_errors(patterns):
+    # Return a single regex matching any of the patterns, and a regex for
+    # each pattern to find out which one matched. Logs are read as bytes,
+    # so they do not need to be decoded
+    key = tuple(patterns)
+    if key not in _known_errors_regex_cache:
+        valid = [pattern for pattern in patterns
+                 if _check_known_error(pattern) is None] or KNOWN_ERRORS
+        regexes = [(pattern, re.compile(pattern.encode('utf-8'),
+                                        re.MULTILINE))
+                   for pattern in valid]
+        combined = re.compile(b'|'.join(b'(?:%s)' % regex.pattern
+                                        for _, regex in regexes),
+                              re.MULTILINE)
+        _known_errors_regex_cache[key] = (combined, regexes)
+    return _known_errors_regex_cache[key]
+
+
+def _read_chunks_reversed(fp, chunk_size):
+    # Yield the contents of fp in chunks of complete lines, starting from
+    # the end of the file
+    fp.seek(0, os.SEEK_END)
+    position = fp.tell()
+    remainder = b''
+    while position > 0:
+        size = min(chunk_size, position)
+        position -= size
+        fp.seek(position)
+        chunk = fp.read(size) + remainder
+        if position > 0:
+            # The first line may be incomplete, keep it for the next chunk
+            newline = chunk.find(b'\n')
+            if newline == -1:
+                remainder = chunk
+                continue
+            remainder = chunk[:newline]
+            chunk = chunk[newline:]
+        yield chunk
+
+
+def find_known_error(logfile, patterns=None,
+                     chunk_size=KNOWN_ERRORS_CHUNK_SIZE):
+    # Return the known error pattern found closest to the end of logfile,
+    # or None if there is none
+    if not os.path.isfile(logfile):
+        return None
+    patterns = patterns or KNOWN_ERRORS
+    combined, regexes = _compile_known_errors(patterns)
+    with open(logfile, 'rb') as fp:
+        for chunk in _read_chunks_reversed(fp, chunk_size):
+            # Keep the last match in the chunk, closest to the end
+            match = None
+            for match in combined.finditer(chunk):
+                pass
+            if match is None:
+                continue
+            # Find out which pattern matched, looking at the whole line
+            start = chunk.rfind(b'\n', 0, match.start()) + 1
+            end = chunk.find(b'\n', match.end())
+            line = chunk[start:end if end != -1 else len(chunk)]
+            for pattern, regex in regexes:
+                if regex.search(line):
+                    return pattern
+            # The pattern may span several lines
+            for pattern, regex in regexes:
+                if regex.search(chunk):
+                    return pattern
+    return None
+
+
 # Check log file against known errors
 # Return True if known error, False otherwise
-def isknownerror(logfile):
+def isknownerror(logfile, patterns=None):
+    return find_known_error(logfile, patterns) is not None
 
-    if not os.path.isfile(logfile):
-        return False
-
-    with open(logfile) as fp:
-        for line in fp:
-            line = line.strip()
-            if re_known_errors.search(line):
-                # Found a known issue
-                return True
 
-    return False
+def record_known_error(datadir, pattern):
+    # Increase the number of matches of a known error pattern
+    stats_file = os.path.join(os.path.realpath(datadir),
+                              KNOWN_ERRORS_STATS_FILE)
+    try:
+        with lock_file(stats_file + '.lck'):
+            stats = get_known_error_stats(datadir)
+            stats[pattern] = stats.get(pattern, 0) + 1
+            with open(stats_file + '.tmp', 'w') as fp:
+                json.dump(stats, fp)
+            os.rename(stats_file + '.tmp', stats_file)
+    except (IOError, OSError) as e:
+        logger.warning('Could not update %s: %s' % (stats_file, e))
+
+
+def get_known_error_stats(datadir):
+    # Return the number of matches for each known error pattern
+    stats_file = os.path.join(os.path.realpath(datadir),
+                              KNOWN_ERRORS_STATS_FILE)
+    try:
+        with open(stats_file) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return {}
 
 
 # Return how many times a commit hash / distro had combination has
@@ -282,6 +404,80 @@ def lock_file(filename, mode='a'):
         fcntl.flock(lock_fp, fcntl.LOCK_UN)
 
 
+# Build phases whose duration is recorded for each commit, in the order
+# they happen
+BUILD_PHASES = ['refresh', 'preprocess', 'srpm', 'build', 'post_build',
+                'createrepo', 'reports', 'rsync']
+
+
+# Return a dict with the duration of each build phase for a commit, in seconds
+def get_timings(commit):
+    if not commit.timings or commit.timings == 'None':
+        return {}
+    try:
+        return json.loads(commit.timings)
+    except ValueError:
+        return {}
+
+
+def record_timings(datadir, commit):
+    # Add the build phase durations of a commit to the running totals
+    stats_file = os.path.join(os.path.realpath(datadir), PHASE_STATS_FILE)
+    timings = get_timings(commit)
+    if not timings:
+        return
+    try:
+        with lock_file(stats_file + '.lck'):
+            stats = get_phase_stats(datadir)
+            for phase, duration in timings.items():
+                phase_stats = stats.setdefault(
+                    phase, {'count': 0, 'sum': 0.0,
+                            'buckets': [0] * len(PHASE_BUCKETS)})
+                phase_stats['count'] += 1
+                phase_stats['sum'] = round(phase_stats['sum'] + duration, 3)
+                for index, bound in enumerate(PHASE_BUCKETS):
+                    if duration <= bound:
+                        phase_stats['buckets'][index] += 1
+            with open(stats_file + '.tmp', 'w') as fp:
+                json.dump(stats, fp)
+            os.rename(stats_file + '.tmp', stats_file)
+    except (IOError, OSError) as e:
+        logger.warning('Could not update %s: %s' % (stats_file, e))
+
+
+def get_phase_stats(datadir):
+    # Return the number of builds, total duration and cumulative histogram
+    # bucket counts for each build phase
+    stats_file = os.path.join(os.path.realpath(datadir), PHASE_STATS_FILE)
+    try:
+        with open(stats_file) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def add_timing(commit, phase, duration):
+    timings = get_timings(commit)
+    timings[phase] = round(timings.get(phase, 0) + duration, 3)
+    commit.timings = json.dumps(timings, sort_keys=True)
+
+
+def remove_timing(commit, phase):
+    timings = get_timings(commit)
+    if timings.pop(phase, None) is not None:
+        commit.timings = json.dumps(timings, sort_keys=True)
+
+
+# Context manager to record the duration of a build phase for a commit
+@contextmanager
+def timed_phase(commit, phase):
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_timing(commit, phase, time.time() - start)
+
+
 # Run external pre-processing step
 def run_external_preprocess(**kwargs):
     # Initially, get any params to be set as environment variables
@@ -345,14 +541,57 @@ def run_external_preprocess(**kwargs):
 
 # Return the list of all components that had a package built
 def get_component_list(session):
-    # The only way we have to get the components is to query the database
-    all_comp_commits = session.query(Commit).\
-        distinct(Commit.component).group_by(Commit.component).all()
-    component_list = []
-    for cmt in all_comp_commits:
-        if cmt.component is not None:
-            component_list.append(cmt.component)
-    return component_list
+    # The only way we have to get the components is to query the database.
+    # Only the component column is read, so this stays cheap on large
+    # databases, and components whose commits were all deleted are dropped
+    query = session.query(Commit.component).distinct()
+    return sorted(component for component, in query
+                  if component is not None)
+
+
+# Contents of the per-component files read by aggregate_repo_files,
+# as {path: (file signature, contents)}
+_component_file_cache = {}
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def _read_component_file(path):
+    # Return the contents of path, or None if it does not exist. The file
+    # is only read again if it changed since the last call
+    signature = file_signature(path)
+    if signature is None:
+        _component_file_cache.pop(path, None)
+        return None
+    cached = _component_file_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, 'r') as fp:
+        contents = fp.read()
+    _component_file_cache[path] = (signature, contents)
+    return contents
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r') as fp:
+            return fp.read()
+    except (IOError, OSError):
+        return None
+
+
+def _replace_symlink(target, link):
+    # Atomically replace link, unless it already points to target
+    if os.path.islink(link) and os.readlink(link) == target:
+        return
+    os.symlink(target, link + '_')
+    os.rename(link + '_', link)
 
 
 # Aggregate all .repo files from a given symlink into a top-level repo file
@@ -372,12 +611,14 @@ def aggregate_repo_files(dirname, datadir, session, reponame, packages,
         csv_file = os.path.join(datadir, "repos/component", component,
                                 dirname, "versions.csv")
 
-        if os.path.exists(repo_file):
-            with open(repo_file, 'r') as fp:
-                repo_content += fp.read() + '\n'
-        if os.path.exists(csv_file):
-            with open(csv_file, 'r') as fp:
-                csv_content.extend(fp.readlines()[1:])
+        # Only the files of the components that changed since the last
+        # aggregation are read again
+        contents = _read_component_file(repo_file)
+        if contents is not None:
+            repo_content += contents + '\n'
+        contents = _read_component_file(csv_file)
+        if contents is not None:
+            csv_content.extend(io.StringIO(contents).readlines()[1:])
 
     file_hash = hashlib.md5(repo_content.encode(),
                             usedforsecurity=False).hexdigest()
@@ -388,39 +629,38 @@ def aggregate_repo_files(dirname, datadir, session, reponame, packages,
     else:
         target_dir = os.path.join(datadir, "repos", dirname)
 
-    # Create target directory if not present
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    with open(os.path.join(target_dir, "%s.repo" % reponame), 'w') as fp:
-        fp.write(repo_content)
-    with open(os.path.join(target_dir, "%s.repo.md5" % reponame), 'w') as fp:
-        fp.write(file_hash)
-    with open(os.path.join(target_dir, "versions.csv"), 'w') as fp:
-        fp.write("Project,Source Repo,Source Sha,Dist Repo,Dist Sha,"
-                 "Status,Last Success Timestamp,Component,Extended Sha,"
-                 "Pkg NVR\n")
-        fp.writelines(csv_content)
+    csv_content = ("Project,Source Repo,Source Sha,Dist Repo,Dist Sha,"
+                   "Status,Last Success Timestamp,Component,Extended Sha,"
+                   "Pkg NVR\n" + ''.join(csv_content))
+
+    # Skip writing the files if the aggregate has not changed
+    if (_read_file(os.path.join(target_dir, "%s.repo.md5" % reponame)) !=
+            file_hash or
+            _read_file(os.path.join(target_dir, "%s.repo" % reponame)) !=
+            repo_content or
+            _read_file(os.path.join(target_dir, "versions.csv")) !=
+            csv_content):
+        # Create target directory if not present
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+        with open(os.path.join(target_dir, "%s.repo" % reponame),
+                  'w') as fp:
+            fp.write(repo_content)
+        with open(os.path.join(target_dir, "%s.repo.md5" % reponame),
+                  'w') as fp:
+            fp.write(file_hash)
+        with open(os.path.join(target_dir, "versions.csv"), 'w') as fp:
+            fp.write(csv_content)
 
     # If we created the file in a hashed dir, create the symlinks now
     if hashed_dir:
         base_promote_dir = os.path.join(datadir, "repos", dirname)
-        os.symlink(os.path.relpath(os.path.join(target_dir,
-                                                "%s.repo" % reponame),
-                                   base_promote_dir),
-                   os.path.join(base_promote_dir, "%s.repo_" % reponame))
-        os.rename(os.path.join(base_promote_dir, "%s.repo_" % reponame),
-                  os.path.join(base_promote_dir, "%s.repo" % reponame))
-        os.symlink(os.path.relpath(os.path.join(target_dir,
-                                                "%s.repo.md5" % reponame),
-                                   base_promote_dir),
-                   os.path.join(base_promote_dir, "%s.repo.md5_" % reponame))
-        os.rename(os.path.join(base_promote_dir, "%s.repo.md5_" % reponame),
-                  os.path.join(base_promote_dir, "%s.repo.md5" % reponame))
-        os.symlink(os.path.relpath(os.path.join(target_dir, 'versions.csv'),
-                                   base_promote_dir),
-                   os.path.join(base_promote_dir, "versions.csv_"))
-        os.rename(os.path.join(base_promote_dir, "versions.csv_"),
-                  os.path.join(base_promote_dir, "versions.csv"))
+        for filename in ["%s.repo" % reponame, "%s.repo.md5" % reponame,
+                         "versions.csv"]:
+            _replace_symlink(
+                os.path.relpath(os.path.join(target_dir, filename),
+                                base_promote_dir),
+                os.path.join(base_promote_dir, filename))
 
     return file_hash
 
@@ -433,11 +673,21 @@ def find_in_artifacts(artifacts, word):
             return artifact
 
 
-def fetch_remote_file(url):
+def _remote_file_cache_paths(url, cache_dir):
+    name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    base = os.path.join(os.path.expanduser(cache_dir), 'remote-files', name)
+    return base, base + '.json'
+
+
+def fetch_remote_file(url, cache_dir=None):
     '''Fetch a remote file and return a list of lines.
 
     Extended to support file:/// URL encoding without the need to add
     an extra dependency, like requests-file.
+
+    If cache_dir is set, the file is stored there with its ETag and
+    Last-Modified headers, and only downloaded again if the server reports
+    that it changed.
     '''
     result = []
 
@@ -445,8 +695,29 @@ def fetch_remote_file(url):
         with open(url.replace('file://', ''), 'r') as fp:
             result.extend(fp.readlines())
     else:
+        headers = {}
+        cached = None
+        if cache_dir:
+            cache_file, meta_file = _remote_file_cache_paths(url, cache_dir)
+            try:
+                with open(meta_file, 'r') as fp:
+                    cached = json.load(fp)
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+            except (IOError, OSError, ValueError):
+                cached = None
         try:
-            r = requests.get(url, timeout=10)
+            r = requests.get(url, timeout=10, headers=headers)
+            if cached is not None and r.status_code == 304:
+                try:
+                    with open(cache_file, 'r') as fp:
+                        logger.debug('Using cached copy of %s' % url)
+                        return fp.readlines()
+                except (IOError, OSError):
+                    # The cached copy is gone, fetch it again
+                    r = requests.get(url, timeout=10)
             # Raise an exception in case of a failure
             r.raise_for_status()
             for line in r.iter_lines():
@@ -454,10 +725,31 @@ def fetch_remote_file(url):
         except requests.exceptions.RequestException as e:
             logger.warning('Failed to fetch remote file: %s' % e)
             raise
+        if cache_dir and (r.headers.get('ETag') or
+                          r.headers.get('Last-Modified')):
+            _save_remote_file_cache(url, cache_dir, result, r.headers)
 
     return result
 
 
+def _save_remote_file_cache(url, cache_dir, content, headers):
+    cache_file, meta_file = _remote_file_cache_paths(url, cache_dir)
+    try:
+        if not os.path.exists(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        # Write to temporary files and rename, since several processes may
+        # be fetching the same file
+        with open(cache_file + '.%d' % os.getpid(), 'w') as fp:
+            fp.writelines(content)
+        os.rename(cache_file + '.%d' % os.getpid(), cache_file)
+        with open(meta_file + '.%d' % os.getpid(), 'w') as fp:
+            json.dump({'url': url, 'etag': headers.get('ETag'),
+                       'last_modified': headers.get('Last-Modified')}, fp)
+        os.rename(meta_file + '.%d' % os.getpid(), meta_file)
+    except (IOError, OSError) as e:
+        logger.warning('Could not cache %s: %s' % (url, e))
+
+
 def rename_output_dir(datadir, output_dir, commit):
     new_output_dir = os.path.join(datadir, "repos",
                                   commit.getshardedcommitdir())
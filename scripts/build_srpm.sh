@@ -103,5 +103,10 @@ if [ -z "$DLRN_KEEP_SPEC_AS_IS" ]; then
 fi
 cat *.spec
 spectool -g -C ${TOP_DIR}/SOURCES *.spec
-/usr/bin/mock --buildsrpm ${MOCKOPTS} --spec *.spec --sources=${TOP_DIR}/SOURCES
+if [ "${DLRN_WARM_CHROOT-}" = "1" ]; then
+    # Reuse the chroot set up by setup_mock, the package build reuses it too
+    /usr/bin/mock --buildsrpm ${MOCKOPTS} --no-clean --spec *.spec --sources=${TOP_DIR}/SOURCES
+else
+    /usr/bin/mock --buildsrpm ${MOCKOPTS} --spec *.spec --sources=${TOP_DIR}/SOURCES
+fi
 
@@ -12,24 +12,9 @@
 # under the License.
 
 import argparse
-import os
 import sys
 
-from tempfile import mkstemp
-
-from dlrn.db import getSession
-from dlrn.utils import loadYAML
-from dlrn.utils import saveYAML
-
-
-def migrate_db(source_string, dest_string):
-    osfd, tmpfilename = mkstemp()
-    session = getSession(source_string)
-    saveYAML(session, tmpfilename)
-    session.close()
-    session2 = getSession(dest_string)
-    loadYAML(session2, tmpfilename)
-    os.remove(tmpfilename)
+from dlrn.db_migrate import migrate_db
 
 
 def main():